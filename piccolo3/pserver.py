@@ -16,6 +16,10 @@
 # You should have received a copy of the GNU General Public License
 # along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+# time of server start used to measure startup performance
+startTime = time.monotonic()
+
 import piccolo3.server as piccolo
 from piccolo3.common import piccoloLogging
 import asyncio
@@ -23,68 +27,143 @@ import aiocoap.resource as resource
 import aiocoap
 import logging
 import os, sys
+import signal
 
-try:
-    import piccolo3.server.PiccoloHardware
-    piccoloStatusLED = piccolo3.server.PiccoloHardware.piccoloStatusLED
-except:
-    piccoloStatusLED = None
+# modules imported in the background once the CoAP endpoint is bound
+heavyModules = ['numpy','scipy.signal','sqlalchemy','seabreeze.spectrometers',
+                'gpiozero',
+                'piccolo3.server.PiccoloShutter',
+                'piccolo3.server.PiccoloSpectrometer',
+                'piccolo3.server.Piccolo']
 
-def piccolo_server(serverCfg):
+async def load_components(root,psys,pdata,piccoloCfg,serverCfg):
+    """load the hardware components and add them to the CoAP site
+
+    :return: the piccolo controller
+    :raises RuntimeError: if a component cannot be initialised
+    """
 
     log = logging.getLogger("piccolo.server")
+    loop = asyncio.get_event_loop()
 
-    log.info("piccolo3 server version %s"%piccolo.__version__)
+    # import the heavy modules in a thread so the server remains responsive
+    await loop.run_in_executor(None,psys.import_modules,heavyModules)
+    psys.startup_phase('imported')
 
-    # creat system info
-    psys = piccolo.PiccoloSysinfo()
-    # create data directory
-    pdata = piccolo.PiccoloDataDir(serverCfg.cfg['datadir']['datadir'],
-                                   device=serverCfg.cfg['datadir']['device'],
-                                   mntpnt=serverCfg.cfg['datadir']['mntpnt'],
-                                   mount=serverCfg.cfg['datadir']['mount'])
-    # read the piccolo instrument configuration file
-    piccoloCfg = piccolo.PiccoloConfig()
-    cfgFilename = pdata.join(serverCfg.cfg['config']) # Usually /mnt/piccolo2_data/piccolo.config
-    piccoloCfg.readCfg(cfgFilename) 
+    # the components talk to the hardware while they are initialised, create
+    # them in a thread so the server remains responsive
 
     # initialise the shutters
     try:
-        shutters = piccolo.PiccoloShutters(piccoloCfg.cfg['channels'])
-    except:
-        log.error('failed to initialise shutters')
-        sys.exit(1)
+        shutters = await loop.run_in_executor(
+            None,lambda: piccolo.PiccoloShutters(piccoloCfg.cfg['channels'],
+                                                 logdir=pdata.datadir))
+    except Exception as e:
+        raise RuntimeError('failed to initialise shutters: {}'.format(e)) from e
 
     # initialise the spectrometers
     try:
-        spectrometers = piccolo.PiccoloSpectrometers(piccoloCfg.cfg['spectrometers'],shutters.keys())
+        spectrometers = await loop.run_in_executor(
+            None,lambda: piccolo.PiccoloSpectrometers(piccoloCfg.cfg['spectrometers'],shutters.keys(),
+                                                      power_cfg=piccoloCfg.cfg['power'],
+                                                      worker_cfg=piccoloCfg.cfg['workers'],
+                                                      compute_cfg=piccoloCfg.cfg['compute'],
+                                                      loop=loop))
     except Exception as e:
-        log.error('failed to initialise spectrometers: {}'.format(str(e)))
-        sys.exit(1)
+        raise RuntimeError('failed to initialise spectrometers: {}'.format(e)) from e
 
     # initialise the piccolo controller
-    controller = piccolo.PiccoloControl(pdata,shutters,spectrometers)
+    controller = await loop.run_in_executor(
+        None,lambda: piccolo.PiccoloControl(pdata,shutters,spectrometers,
+                                            location=(piccoloCfg.cfg['location']['latitude'],
+                                                      piccoloCfg.cfg['location']['longitude']),
+                                            loop=loop))
 
-        
-    root = resource.Site()
     # add the components
-    for c in [psys,pdata,shutters,spectrometers,controller]:
+    for c in [shutters,spectrometers,controller]:
         root.add_resource(*c.coapSite)
 
+    # aggregate the state of all components
+    snapshot = piccolo.PiccoloSnapshot(root)
+    root.add_resource(*snapshot.coapSite)
 
-    root.add_resource(('.well-known', 'core'),
-                      resource.WKCResource(root.get_resources_as_linkheader))
-    asyncio.Task(aiocoap.Context.create_server_context(root,
-                                                       bind=serverCfg.bind,
-                                                       loggername='piccolo.coapserver'))
-
+    psys.startup_phase('ready',budget=serverCfg.cfg['startup']['ready_budget'])
 
+    try:
+        import piccolo3.server.PiccoloHardware
+        piccoloStatusLED = piccolo3.server.PiccoloHardware.piccoloStatusLED
+    except:
+        piccoloStatusLED = None
     if piccoloStatusLED is not None:
         piccoloStatusLED.blink()
     else:
         log.warning('no hardware support')
-    
-    asyncio.get_event_loop().run_forever()
+
+    return controller
+
+def piccolo_server(serverCfg):
+
+    log = logging.getLogger("piccolo.server")
+
+    log.info("piccolo3 server version %s"%piccolo.__version__)
+
+    # trace the CoAP requests
+    piccolo.configure_tracer(slow_threshold=serverCfg.cfg['trace']['slow_threshold'],
+                             history=serverCfg.cfg['trace']['slow_history'],
+                             slow_log=serverCfg.cfg['trace']['slow_log'])
+
+    # creat system info
+    psys = piccolo.PiccoloSysinfo(start_time=startTime)
+    # create data directory
+    pdata = piccolo.PiccoloDataDir(serverCfg.cfg['datadir']['datadir'],
+                                   device=serverCfg.cfg['datadir']['device'],
+                                   mntpnt=serverCfg.cfg['datadir']['mntpnt'],
+                                   mount=serverCfg.cfg['datadir']['mount'])
+    # read the piccolo instrument configuration file
+    piccoloCfg = piccolo.PiccoloConfig()
+    cfgFilename = pdata.join(serverCfg.cfg['config']) # Usually /mnt/piccolo2_data/piccolo.config
+    piccoloCfg.readCfg(cfgFilename) 
+
+    root = resource.Site()
+    # add the light-weight components, the others are added once loaded
+    for c in [psys,pdata]:
+        root.add_resource(*c.coapSite)
+
+    root.add_resource(('.well-known', 'core'),
+                      resource.WKCResource(root.get_resources_as_linkheader))
+
+    # bind the CoAP endpoint before loading the hardware components
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(aiocoap.Context.create_server_context(root,
+                                                                  bind=serverCfg.bind,
+                                                                  loggername='piccolo.coapserver'))
+    psys.startup_phase('bound',budget=serverCfg.cfg['startup']['bind_budget'])
+
+    components = loop.create_task(load_components(root,psys,pdata,piccoloCfg,serverCfg))
+    def components_loaded(task):
+        # the server is useless without its components, stop it
+        if not task.cancelled() and task.exception() is not None:
+            log.error('failed to load components',exc_info=task.exception())
+            loop.stop()
+    components.add_done_callback(components_loaded)
+
+    # shut down cleanly when terminated
+    loop.add_signal_handler(signal.SIGTERM,loop.stop)
+    failed = False
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if components.done() and not components.cancelled():
+            if components.exception() is not None:
+                failed = True
+            else:
+                # write outstanding scheduler changes
+                components.result().stop()
+        log.info('piccolo3 server stopped')
+    if failed:
+        sys.exit(1)
 
 
     
@@ -26,16 +26,19 @@ import asyncio
 import janus
 from piccolo3.common import PiccoloSpectraList, PiccoloSpectrometerStatus
 from .PiccoloComponent import PiccoloBaseComponent, piccoloGET, piccoloPUT, piccoloChanged
-from .PiccoloWorkerThreads import PiccoloThread,PiccoloWorkerThread
+from .PiccoloWorkerThreads import PiccoloThread,PiccoloWorkerThread,PiccoloCommand,PiccoloCommandQueue,piccoloTask
 from .PiccoloDataDir import PiccoloDataDir
 from .PiccoloShutter import PiccoloShutters
 from .PiccoloSpectrometer import PiccoloSpectrometers
-from .PiccoloScheduler import PiccoloScheduler
+from .PiccoloScheduler import PiccoloScheduler, cron_times
+from .PiccoloPlanner import PiccoloSequencePlan
 
 from queue import Queue
 import threading
 import logging
 import time
+import copy
+import datetime, pytz
 
 class PiccoloOutput(PiccoloThread):
     """piccolo writer thread"""
@@ -73,6 +76,8 @@ class PiccoloControlWorker(PiccoloWorkerThread):
         self.datadir = datadir
         self.shutters = shutters
         self.spectrometers = spectrometers
+        # the number of sequences recorded by the current batch
+        self.nrecorded = 0
 
         self.spectra = Queue()
         self.outputThread = PiccoloOutput(self.datadir,self.spectra)
@@ -82,6 +87,8 @@ class PiccoloControlWorker(PiccoloWorkerThread):
         self.info.put(('status',status))
     def update_sequence_number(self,s):
         self.info.put(('sequence',s))
+    def report_run(self,job_id,start_time,duration,nsequences,outcome,message=None):
+        self.info.put(('run',(job_id,start_time,duration,nsequences,outcome,message)))
 
     def stop(self):
         self.spectra.put(None)
@@ -120,29 +127,119 @@ class PiccoloControlWorker(PiccoloWorkerThread):
         else:
             return task
 
-    def process_task(self,task):
-        if task is None:
-            return
-        elif task[0] == 'record':
-            self.results.put('ok')
-            self.record_sequence(*task[1])
-            self.update_status('idle')
-        elif task[0] == 'dark':
-            self.results.put('ok')
-            self.record_dark(task[1])
-            self.update_status('idle')
-        elif task[0] == 'auto':
-            self.results.put('ok')
-            self.autointegrate(task[1])
-            self.update_status('idle')
-        elif task[0] == 'power_off':
-            self.results.put('ok')
-            self.spectrometers.power_off()
-            self.update_status('idle')
-        elif task[0] == 'power_on':
-            self.results.put('ok')
-            self.spectrometers.power_on()
-            self.update_status('idle')
+    @piccoloTask('abort')
+    def _task_abort(self):
+        # acquisition was paused and aborted while idle
+        pass
+    @piccoloTask('unpause')
+    def _task_unpause(self):
+        # acquisition was paused and resumed while idle
+        pass
+
+    @piccoloTask('record')
+    def _task_record(self,args,job_id=None):
+        """record a batch, scheduled jobs carry their ID"""
+        self.reply('ok')
+        start_time = datetime.datetime.now(tz=pytz.utc)
+        t0 = time.time()
+        self.nrecorded = 0
+        message = None
+        try:
+            outcome = self.record_sequence(*args)
+        except Exception as e:
+            self.log.error('recording failed: {}'.format(e))
+            outcome = 'failed'
+            message = str(e)
+        self.report_run(job_id,start_time,time.time()-t0,self.nrecorded,
+                        outcome,message)
+        self.update_status('idle')
+    @piccoloTask('dark')
+    def _task_dark(self,run_name):
+        self.reply('ok')
+        self.record_dark(run_name)
+        self.update_status('idle')
+    @piccoloTask('auto')
+    def _task_auto(self,target):
+        self.reply('ok')
+        self.autointegrate(target)
+        self.update_status('idle')
+    @piccoloTask('power_off')
+    def _task_power_off(self):
+        self.reply('ok')
+        self.spectrometers.power_off()
+        self.update_status('idle')
+    @piccoloTask('power_on')
+    def _task_power_on(self):
+        self.reply('ok')
+        self.spectrometers.power_on()
+        self.update_status('idle')
+
+    @piccoloTask('stream')
+    def _task_stream(self,run_name,channel,decimate,duration):
+        self.reply('ok')
+        self.stream(run_name,channel,decimate,duration)
+        self.update_status('idle')
+    @piccoloTask('stop_stream')
+    def _task_stop_stream(self):
+        self.reply('not streaming')
+
+    def stream(self,run_name,channel,decimate,duration):
+        """stream spectra of a single channel until stopped
+
+        :param duration: the maximum time in seconds to stream for or None
+        """
+        run = self.datadir[run_name]
+        self.log.info('start streaming channel {} of run {}'.format(channel,run.name))
+        self.update_status('streaming {}'.format(channel))
+        for shutter in self.shutters:
+            if shutter == channel:
+                self.shutters[shutter].openShutter()
+            else:
+                self.shutters[shutter].closeShutter()
+        self.shutters.wait_settled()
+
+        stamp = datetime.datetime.now(tz=pytz.utc).strftime('%Y%m%dT%H%M%S')
+        streaming = []
+        for spec in self.spectrometers:
+            if channel not in self.spectrometers[spec].channels:
+                continue
+            fname = run.full_path('stream_{}_{}_{}.pstream'.format(stamp,spec,channel))
+            try:
+                self.spectrometers[spec].start_stream(channel,fname,decimate=decimate)
+            except Exception as e:
+                self.log.warning(str(e))
+                continue
+            streaming.append(spec)
+
+        if duration is not None:
+            end = time.time()+duration
+        while len(streaming)>0:
+            timeout = None
+            if duration is not None:
+                timeout = end-time.time()
+                if timeout <= 0:
+                    break
+            task = self.get_task(timeout=timeout)
+            if task is None:
+                continue
+            if task == 'stop_stream':
+                self.reply('ok',task)
+                break
+            elif task == 'abort':
+                break
+            elif task == 'shutdown':
+                self.tasks.put(None)
+                break
+            else:
+                self.reply('piccolo system is streaming',task)
+
+        for spec in streaming:
+            try:
+                self.spectrometers[spec].stop_stream()
+            except Exception as e:
+                self.log.warning(str(e))
+        self.shutters[channel].closeShutter()
+        self.log.info('stopped streaming channel {}'.format(channel))
 
     def autointegrate(self,target):
         self.log.debug('autointegrate target={}'.format(target))
@@ -151,9 +248,12 @@ class PiccoloControlWorker(PiccoloWorkerThread):
         for shutter in self.shutters:
             self.update_status('autointegrate {}'.format(shutter))
             self.shutters[shutter].openShutter()
+            self.shutters.wait_settled()
 
             # start autointegration
             for spec in self.spectrometers:
+                if shutter not in self.spectrometers[spec].channels:
+                    continue
                 try:
                     self.spectrometers[spec].autointegrate(shutter,target=target)
                 except Exception as e:
@@ -167,55 +267,101 @@ class PiccoloControlWorker(PiccoloWorkerThread):
                     
             self.shutters[shutter].closeShutter()
                     
-    def record(self,channel,dark=False):
-        self.log.debug('recording {} dark={}'.format(channel,dark))
-        status = channel + ' '
-        if dark:
-            status += 'dark'
+    def plan(self):
+        """plan a sequence using the current integration times"""
+        return PiccoloSequencePlan.from_instrument(self.shutters,self.spectrometers)
+
+    def record_step(self,plan,step):
+        """record the spectra of a step
+
+        :return: tuple of lists of light and dark spectra
+        """
+        if step.shutter is None:
+            status = 'dark'
         else:
-            status += 'light'
+            status = step.shutter + ' light'
+            if len(step.darks)>0:
+                status += '/dark'
+        self.log.debug('recording {}'.format(status))
         self.update_status(status)
         for shutter in self.shutters:
-            if not dark and shutter == channel:
+            if shutter == step.shutter:
                 self.shutters[shutter].openShutter()
             else:
                 self.shutters[shutter].closeShutter()
+        self.shutters.wait_settled()
 
         # start acquisition
-        for spec in self.spectrometers:
+        started = []
+        for spec,channel,dark in step.acquisitions():
             try:
                 self.spectrometers[spec].start_acquisition(channel,dark=dark)
             except Exception as e:
                 self.log.warning(str(e))
+                continue
+            started.append((spec,channel,dark))
 
         time.sleep(0.1)
-            
+
         # collect spectra
-        spectra = []
-        for spec in self.spectrometers:
+        lights = []
+        darks = []
+        for spec,channel,dark in started:
             try:
                 s = self.spectrometers[spec].get_spectrum()
             except Exception as e:
                 self.log.warning(str(e))
                 continue
-            if s is not None:
-                spectra.append(s)
+            if s is None:
+                continue
+            if not dark:
+                lights.append(s)
+                continue
+            darks.append(s)
+            # channels with the same integration time share the dark
+            for c in plan.reused(spec,channel):
+                r = copy.deepcopy(s)
+                r.setDirection(c)
+                darks.append(r)
 
-        self.shutters[channel].closeShutter()
-        return spectra
+        if step.shutter is not None:
+            self.shutters[step.shutter].closeShutter()
+        return lights,darks
 
     def record_dark(self,run_name,batch=None,sequence=0):
         run = self.datadir[run_name]
         if batch is None:
             batch = run.get_next_batch()
         self.log.info("record dark sequence {} of run {} batch {}".format(sequence,batch,run.name))
+        plan = self.plan()
         spectra = PiccoloSpectraList(run=run_name,batch=batch,seqNr=sequence)
-        for shutter in self.shutters:
-            for s in self.record(shutter,dark=True):
+        for step in plan.steps(lights=False):
+            for s in self.record_step(plan,step)[1]:
                 spectra.append(s)
         self.spectra.put(spectra)
-    
+
+    def record_light(self,run_name,batch,sequence,plan,darks=False):
+        """record the light spectra of a sequence
+
+        :param darks: record the darks of the sequence alongside
+        """
+        lightSpectra = PiccoloSpectraList(run=run_name,batch=batch,seqNr=sequence)
+        darkSpectra = PiccoloSpectraList(run=run_name,batch=batch,seqNr=sequence)
+        for step in plan.steps(darks=darks):
+            lights,ds = self.record_step(plan,step)
+            for s in lights:
+                lightSpectra.append(s)
+            for s in ds:
+                darkSpectra.append(s)
+        if darks:
+            self.spectra.put(darkSpectra)
+        self.spectra.put(lightSpectra)
+
     def record_sequence(self,run_name,nsequence,auto,delay,target):
+        """record a batch
+
+        :return: completed or aborted
+        """
         run = self.datadir[run_name]
         batch = run.get_next_batch()
         self.log.info("start recording batch {} of run {} with {} sequences".format(batch,run.name,nsequence))
@@ -226,53 +372,43 @@ class PiccoloControlWorker(PiccoloWorkerThread):
             self.autointegrate(target)
             task = self.get_task(block=False)
             if task in ['abort','shutdown']:
-                return
+                return 'aborted'
+
+        # the plan only changes when the integration times change
+        plan = self.plan()
+        self.log.info('estimated duration of batch {}: {:.1f}s'.format(
+            batch,plan.estimate_batch(nsequence,auto,delay)['duration']))
 
-        if auto<1:
-            # record dark
-            self.record_dark(run_name,batch=batch)
-            
         for sequence in range(nsequence):
             if auto>0 and sequence%auto == 0:
                 self.autointegrate(target)
                 task = self.get_task(block=False)
                 if task in ['abort','shutdown']:
-                    return
-                self.record_dark(run_name,batch=batch,sequence=sequence)
-                task = self.get_task(block=False)
-                if task in ['abort','shutdown']:
-                    return
+                    return 'aborted'
+                plan = self.plan()
             
             task = self.get_task(block=False)
             if task in ['abort','shutdown']:
-                return
+                return 'aborted'
             self.log.info("recording sequence {} of run {} batch {}".format(sequence,run.name,batch))
             self.update_sequence_number(sequence)
-            spectra = PiccoloSpectraList(run=run_name,batch=batch,seqNr=sequence)
-            for shutter in self.shutters:
-                for s in self.record(shutter):
-                    try:
-                        spectra.append(s)
-                    except:
-                        print (type(s))
-                        raise
-            self.spectra.put(spectra)
+            self.record_light(run_name,batch,sequence,plan,
+                              darks=plan.needs_dark(sequence,nsequence,auto))
+            self.nrecorded += 1
             task = self.get_task(block=False)
             if task in ['abort','shutdown']:
-                return
+                return 'aborted'
             self.update_status('waiting')
             time.sleep(delay)
 
-        if nsequence>1:
-            # record dark
-            self.record_dark(run_name,batch=batch,sequence=nsequence-1)
+        return 'completed'
             
 class PiccoloControl(PiccoloBaseComponent):
     """the piccolo server"""
     
     NAME = "control"
 
-    def __init__(self,datadir,shutters,spectrometers):
+    def __init__(self,datadir,shutters,spectrometers,location=None,loop=None):
         """
         :param datadir: data directory
         :type datadir: PiccoloDataDir
@@ -280,6 +416,10 @@ class PiccoloControl(PiccoloBaseComponent):
         :type shutters: PiccoloShutters
         :param spectrometers: the spectrometers
         :type spectrometers: PiccoloSpectrometers
+        :param location: tuple of latitude and longitude of the instrument
+        :param loop: the event loop serving the controller, the current loop
+                     if None. It must be given when the controller is created
+                     outside the event loop
         """
         super().__init__()
 
@@ -287,9 +427,10 @@ class PiccoloControl(PiccoloBaseComponent):
         # The lock prevents two threads using the spectrometer at the same time.
         self._busy = threading.Lock()
         self._paused = threading.Lock()
-        loop = asyncio.get_event_loop()
-        self._tQ = janus.Queue(loop=loop) # Task queue.
-        self._rQ = janus.Queue(loop=loop) # Results queue.
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._tQ = PiccoloCommandQueue() # Task queue.
+        self._rQ = Queue() # Results queue.
         self._iQ = janus.Queue(loop=loop) # info queue
         
         self._datadir = datadir
@@ -311,23 +452,25 @@ class PiccoloControl(PiccoloBaseComponent):
         self._targetChanged = None
         
         # the scheduler for running tasks
-        self._scheduler = PiccoloScheduler(db='sqlite:///%s'%self._datadir.join('scheduler.sqlite'))
+        self._scheduler = PiccoloScheduler(db='sqlite:///%s'%self._datadir.join('scheduler.sqlite'),
+                                           location=location)
         self.coapResources.add_resource(['scheduler'],self._scheduler.coapResources)
         
         
         # start the info updater thread        
-        self._uiTask = loop.create_task(self._update_info())
-        self._schedulerTask = loop.create_task(self._check_scheduler())
+        self._uiTask = asyncio.run_coroutine_threadsafe(self._update_info(),loop)
+        self._schedulerTask = asyncio.run_coroutine_threadsafe(self._check_scheduler(),loop)
         
         self._piccolo = PiccoloControlWorker(self._datadir, self._shutters, self._spectrometers,
                                              self._busy, self._paused,
-                                             self._tQ.sync_q, self._rQ.sync_q, self._iQ.sync_q)
+                                             self._tQ, self._rQ, self._iQ.sync_q)
         self._piccolo.start()
 
     def stop(self):
         # send poison pill to worker
         self.log.info('shutting down')
-        self._tQ.sync_q.put(None)
+        self._tQ.put(None)
+        self._scheduler.stop()
 
     async def _check_scheduler(self):
         """check if a scheduled task should be run"""
@@ -339,11 +482,21 @@ class PiccoloControl(PiccoloBaseComponent):
                 task = job.job
                 if not task:
                     continue
+                # jobs are stored as tuples of command name and arguments
+                task = PiccoloCommand.from_task(task)
+                if task.name == 'record':
+                    # pass on job ID so the outcome can be recorded
+                    task = PiccoloCommand('record',task.args[0],job.id)
 
-                await self._tQ.async_q.put(task)
-                result = await self._rQ.async_q.get()
+                # queue the job behind any job already running
+                try:
+                    result = await asyncio.wrap_future(self._tQ.submit(task))
+                except Warning as e:
+                    result = str(e)
                 if result != 'ok':
-                    self.log.error('failed to run task {}: {}'.format(job.jid, result))
+                    self.log.error('failed to run task {}: {}'.format(job.id, result))
+                    now = datetime.datetime.now(tz=pytz.utc)
+                    self._scheduler.record_run(job.id,now,0.,0,'failed',result)
             await asyncio.sleep(1)
             
     async def _update_info(self):
@@ -366,10 +519,12 @@ class PiccoloControl(PiccoloBaseComponent):
                 self._status = t
                 if self._statusChanged is not None:
                     self._statusChanged()
+            elif s == 'run':
+                self._scheduler.record_run(*t)
             else:
                 self.log.warning('unknown spec {}={}'.format(s,t))
 
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_numSequences(self):
         return self._numSequences
     @piccoloPUT
@@ -385,7 +540,7 @@ class PiccoloControl(PiccoloBaseComponent):
     def callback_numSequences(self,cb):
         self._numSequencesChanged = cb
 
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_autointegration(self):
         return self._autointegration
     @piccoloPUT
@@ -399,7 +554,7 @@ class PiccoloControl(PiccoloBaseComponent):
     def callback_autointegration(self,cb):
         self._autointegrationChanged = cb
        
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_delay(self):
         return self._delay
     @piccoloPUT
@@ -415,7 +570,7 @@ class PiccoloControl(PiccoloBaseComponent):
     def callback_delay(self,cb):
         self._delayChanged = cb
 
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_target(self):
         return self._target
     @piccoloPUT
@@ -467,11 +622,110 @@ class PiccoloControl(PiccoloBaseComponent):
         else:        
             if self._busy.locked():
                 raise Warning('piccolo system is busy')
-            self._tQ.sync_q.put(job)
-            result = self._rQ.sync_q.get()
+            result = self._tQ.submit(PiccoloCommand.from_task(job),policy='reject').result()
             if result != 'ok':
                 raise RuntimeError(result)
             
+    def _record_job(self,run=None,nsequence=None,auto=None,delay=None,target=None):
+        """construct a record job, missing parameters are taken from the
+        current settings"""
+        if run is None:
+            run = self._datadir.get_current_run()
+        if nsequence is None:
+            nsequence = self.get_numSequences()
+        if auto is None:
+            auto = self.get_autointegration()
+        if delay is None:
+            delay = self.get_delay()
+        if target is None:
+            target = self.get_target()
+        nsequence = int(nsequence)
+        if nsequence<1:
+            raise ValueError('number of sequences must be greater than 0')
+        auto = max(int(auto),-1)
+        delay = float(delay)
+        if delay <0:
+            raise ValueError('delay must be >=0')
+        target = float(target)
+        if target <10 or target>90:
+            raise ValueError('target must be >=10 and <=90')
+        return ('record',(run,nsequence,auto,delay,target))
+
+    @piccoloPUT
+    def record_campaign(self,jobs):
+        """schedule a list of recording jobs in one go
+
+        Each entry is a dictionary which can contain the record_sequence
+        parameters run, nsequence, auto, delay and target. Missing parameters
+        are taken from the current settings. The times are given either by
+         * at_time and optionally interval and end_time or
+         * a cron rule together with end_time and optionally start_time or
+         * a minimum solar elevation (solar) together with interval,
+           end_time and optionally start_time; the job runs every interval
+           seconds while the sun is above the elevation
+        Set ignoreQuietTime to schedule the job during quiet time.
+
+        All entries are checked before any job gets scheduled.
+
+        :param jobs: list of job descriptions
+        :return: the number of scheduled jobs
+        """
+        if not isinstance(jobs,list):
+            raise ValueError('expected a list of jobs')
+
+        runs = set()
+        specs = []
+        for i,entry in enumerate(jobs):
+            try:
+                if not isinstance(entry,dict):
+                    raise ValueError('expected a dictionary')
+                entry = dict(entry)
+                job = self._record_job(**dict((k,entry.pop(k)) for k in
+                                              ['run','nsequence','auto','delay','target'] if k in entry))
+                ignoreQuietTime = bool(entry.pop('ignoreQuietTime',False))
+                if 'cron' in entry:
+                    rule = entry.pop('cron')
+                    if 'end_time' not in entry:
+                        raise ValueError('cron rule requires an end_time')
+                    end_time = self._scheduler.parseDateTime(entry.pop('end_time'))
+                    start_time = self._scheduler.parseDateTime(entry.pop('start_time',None))
+                    if start_time is None:
+                        start_time = self._scheduler.now()
+                    for t in cron_times(rule,start_time,end_time):
+                        specs.append({'start_time':t,'job':job,
+                                      'ignoreQuietTime':ignoreQuietTime})
+                elif 'solar' in entry:
+                    elevation = float(entry.pop('solar'))
+                    if 'end_time' not in entry or 'interval' not in entry:
+                        raise ValueError('solar window requires an interval and an end_time')
+                    interval = entry.pop('interval')
+                    end_time = self._scheduler.parseDateTime(entry.pop('end_time'))
+                    start_time = self._scheduler.parseDateTime(entry.pop('start_time',None))
+                    if start_time is None:
+                        start_time = self._scheduler.now()
+                    for ws,we in self._scheduler.sun_windows(start_time,end_time,elevation):
+                        specs.append({'start_time':ws,'job':job,
+                                      'interval':interval,'end_time':we,
+                                      'ignoreQuietTime':ignoreQuietTime,
+                                      'minSolarElevation':elevation})
+                elif 'at_time' in entry:
+                    specs.append({'start_time':entry.pop('at_time'),'job':job,
+                                  'interval':entry.pop('interval',None),
+                                  'end_time':entry.pop('end_time',None),
+                                  'ignoreQuietTime':ignoreQuietTime})
+                else:
+                    raise ValueError('neither at_time, cron rule nor solar window given')
+                if len(entry)>0:
+                    raise ValueError('unknown parameters {}'.format(', '.join(entry.keys())))
+            except Exception as e:
+                raise ValueError('entry {}: {}'.format(i,e))
+            runs.add(job[1][0])
+
+        new_jobs = self._scheduler.add_jobs(specs)
+        for run in runs:
+            self._datadir.create_run(run)
+        return len(new_jobs)
+            
     @piccoloPUT
     def auto(self,target=None):
         """determine best integration time
@@ -482,8 +736,7 @@ class PiccoloControl(PiccoloBaseComponent):
             raise Warning('piccolo system is busy')
         if target is not None:
             self.set_target(target)
-        self._tQ.sync_q.put(('auto',self.get_target()))
-        result = self._rQ.sync_q.get()
+        result = self._tQ.submit(PiccoloCommand('auto',self.get_target()),policy='reject').result()
         if result != 'ok':
             raise RuntimeError(result)
 
@@ -500,11 +753,42 @@ class PiccoloControl(PiccoloBaseComponent):
                 self._datadir.set_current_run(run)
             except Warning:
                 pass
-        self._tQ.sync_q.put(('dark',self._datadir.get_current_run()))
-        result = self._rQ.sync_q.get()
+        result = self._tQ.submit(PiccoloCommand('dark',self._datadir.get_current_run()),policy='reject').result()
         if result != 'ok':
             raise RuntimeError(result)             
 
+    @piccoloPUT
+    def start_stream(self,channel,decimate=10,run=None,duration=None):
+        """continuously record spectra of a single channel
+
+        :param channel: the channel to stream
+        :param decimate: publish the mean of every decimate frames as live
+                         frame of the spectrometers
+        :param run: name of the current run
+        :param duration: stop streaming after duration seconds
+        """
+        if self._busy.locked():
+            raise Warning('piccolo system is busy')
+        if channel not in self._shutters:
+            raise RuntimeError('unknown channel {}'.format(channel))
+        if run is not None:
+            try:
+                self._datadir.set_current_run(run)
+            except Warning:
+                pass
+        result = self._tQ.submit(PiccoloCommand('stream',self._datadir.get_current_run(),
+                                                channel,int(decimate),duration),
+                                 policy='reject').result()
+        if result != 'ok':
+            raise RuntimeError(result)
+
+    @piccoloGET(snapshot=False)
+    def stop_stream(self):
+        """stop streaming spectra"""
+        if not self._busy.locked():
+            raise Warning('piccolo system is not busy')
+        self._tQ.submit(PiccoloCommand('stop_stream'))
+
     def _power(self,task,at_time=None):
         """power on/off spectrometers
 
@@ -521,8 +805,7 @@ class PiccoloControl(PiccoloBaseComponent):
         else:
             if self._busy.locked():
                 raise Warning('piccolo system is busy')
-            self._tQ.sync_q.put(job)
-            result = self._rQ.sync_q.get()
+            result = self._tQ.submit(PiccoloCommand.from_task(job),policy='reject').result()
             if result != 'ok':
                 raise RuntimeError(result)
 
@@ -541,19 +824,32 @@ class PiccoloControl(PiccoloBaseComponent):
         """
         self._power('on',at_time=at_time)
 
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def abort(self):
         """abort current batch"""
         if not self._busy.locked():
             raise Warning('piccolo system is not busy')
-        self._tQ.sync_q.put('abort')
+        self._tQ.submit(PiccoloCommand('abort'))
 
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def pause(self):
         """pause current batch"""
         if not self._busy.locked():
             raise Warning('piccolo system is not busy')
-        self._tQ.sync_q.put('pause')
+        self._tQ.submit(PiccoloCommand('pause'))
+
+    @piccoloGET(snapshot=False)
+    def get_sequence_plan(self):
+        """the steps of a sequence recorded with the current integration times"""
+        return PiccoloSequencePlan.from_instrument(self._shutters,self._spectrometers).tolist()
+
+    @piccoloGET
+    def get_batch_estimate(self):
+        """estimate the duration in seconds and the number of spectra of a
+        batch recorded with the current settings"""
+        plan = PiccoloSequencePlan.from_instrument(self._shutters,self._spectrometers)
+        return plan.estimate_batch(self.get_numSequences(),self.get_autointegration(),
+                                   self.get_delay())
 
     @piccoloGET
     def get_current_sequence(self):
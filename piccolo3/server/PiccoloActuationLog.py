@@ -0,0 +1,171 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+persistent log of shutter actuations
+
+The log is a memory mapped file of fixed size. The header contains the
+magic string PICOSHUT, the format version, the capacity of the ring, the
+index of the next record, the cumulative counters and, while the shutter is
+open, the time up to which the open time has been accounted. It is followed
+by the ring of records, each containing the POSIX timestamp (float64), the
+action (uint8, 1 for open and 0 for close) and for closing the time in
+seconds the shutter was open (float32). All values are little endian.
+"""
+
+__all__ = ['PiccoloActuationLog']
+
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b'PICOSHUT'
+VERSION = 2
+# version, capacity, number of records written, opened, closed, open time
+# and, since version 2, the time the open time was accounted up to, 0 if the
+# shutter is closed
+HEADERS = {1:struct.Struct('<IIQQQd'),
+           2:struct.Struct('<IIQQQdd')}
+HEADER = HEADERS[VERSION]
+RECORD = struct.Struct('<dBf')
+HEADER_SIZE = len(MAGIC)+HEADER.size
+
+class PiccoloActuationLog:
+    """ring file recording shutter actuations and wear counters"""
+
+    def __init__(self,fname,capacity=4096):
+        """
+        :param fname: name of the log file, it is created if necessary
+        :param capacity: number of records kept if a new file is created
+        """
+        self._lock = threading.Lock()
+        size = HEADER_SIZE+capacity*RECORD.size
+
+        if os.path.exists(fname):
+            self._f = open(fname,'r+b')
+            if self._f.read(len(MAGIC)) != MAGIC:
+                self._f.close()
+                raise RuntimeError('{} is not a shutter log'.format(fname))
+        else:
+            self._f = open(fname,'w+b')
+            self._f.write(MAGIC+HEADER.pack(VERSION,capacity,0,0,0,0.,0.))
+            self._f.truncate(size)
+        self._f.flush()
+        self._map = mmap.mmap(self._f.fileno(),0)
+
+        self._version = struct.unpack_from('<I',self._map,len(MAGIC))[0]
+        if self._version not in HEADERS:
+            raise RuntimeError('unsupported shutter log version {}'.format(self._version))
+        self._header = HEADERS[self._version]
+        self._offset = len(MAGIC)+self._header.size
+        values = self._header.unpack_from(self._map,len(MAGIC))
+        self._capacity,self._nrecords,self._nopen,self._nclose,self._openTime = values[1:6]
+        # older logs do not keep the accounted time
+        self._accounted = values[6] if self._version > 1 else 0.
+        if len(self._map) < self._offset+self._capacity*RECORD.size:
+            raise RuntimeError('shutter log {} is truncated'.format(fname))
+
+    @property
+    def nopen(self):
+        """the number of times the shutter was opened"""
+        return self._nopen
+    @property
+    def nclose(self):
+        """the number of times the shutter was closed"""
+        return self._nclose
+    @property
+    def open_time(self):
+        """the total time in seconds the shutter was open"""
+        return self._openTime
+    @property
+    def accounted(self):
+        """the time the open time was accounted up to, None if the shutter
+        is closed"""
+        return self._accounted if self._accounted > 0 else None
+
+    def _write_header(self):
+        values = (self._version,self._capacity,self._nrecords,
+                  self._nopen,self._nclose,self._openTime)
+        if self._version > 1:
+            values += (self._accounted,)
+        self._header.pack_into(self._map,len(MAGIC),*values)
+
+    def record(self,t,opened,duration=0.):
+        """record an actuation
+
+        :param t: POSIX timestamp of the actuation
+        :param opened: True if the shutter was opened, False if closed
+        :param duration: the time in seconds the shutter was open when it
+                         is closed
+        """
+        with self._lock:
+            if opened:
+                self._nopen += 1
+                self._accounted = t
+            else:
+                self._nclose += 1
+                if self._accounted > 0:
+                    # part of the open time has already been accounted
+                    self._openTime += max(0.,t-self._accounted)
+                else:
+                    self._openTime += duration
+                self._accounted = 0.
+            idx = self._nrecords % self._capacity
+            RECORD.pack_into(self._map,self._offset+idx*RECORD.size,t,int(opened),duration)
+            self._nrecords += 1
+            self._write_header()
+
+    def account(self,t,closed=False):
+        """add the time the shutter has been open up to t to the open time
+
+        :param t: POSIX timestamp
+        :param closed: the shutter is no longer open, eg it was reset when
+                       the server started
+        """
+        with self._lock:
+            if self._accounted > 0:
+                self._openTime += max(0.,t-self._accounted)
+                self._accounted = 0. if closed else t
+                self._write_header()
+
+    def entries(self,n=None):
+        """get the most recent actuations, oldest first
+
+        :param n: the maximum number of entries
+        :return: list of timestamp, opened, duration tuples
+        """
+        with self._lock:
+            count = min(self._nrecords,self._capacity)
+            if n is not None:
+                count = min(count,n)
+            entries = []
+            for i in range(self._nrecords-count,self._nrecords):
+                t,opened,duration = RECORD.unpack_from(
+                    self._map,self._offset+(i%self._capacity)*RECORD.size)
+                entries.append((t,bool(opened),duration))
+        return entries
+
+    def flush(self):
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._f.close()
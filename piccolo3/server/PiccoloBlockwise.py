@@ -0,0 +1,149 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+support for streaming large results blockwise
+
+Handlers of resources declared with the stream option of piccoloGET or
+piccoloPUT can return a streamed list or a streamed text. These are
+encoded lazily while the client fetches the blocks of the response so that
+only a single block and the chunk currently being encoded are held in
+memory. The encoded result is identical to encoding the complete list or
+text.
+"""
+
+__all__ = ['streamed_list','streamed_text','read_chunks']
+
+# size of chunks in characters read from files
+CHUNK_SIZE = 4096
+# CBOR indefinite length array and text string headers and break marker
+CBOR_ARRAY = b'\x9f'
+CBOR_TEXT = b'\x7f'
+CBOR_BREAK = b'\xff'
+# the CoAP content format of CBOR
+CONTENT_FORMAT_CBOR = 60
+
+class PiccoloStreamedResult:
+    """a result that is encoded lazily"""
+
+    def __init__(self,iterable):
+        """
+        :param iterable: iterable producing the items or text chunks
+        """
+        self._iterable = iterable
+
+    def chunks(self,fmt,encode):
+        """iterate over the encoded chunks
+
+        :param fmt: the content format
+        :param encode: function encoding a value in a content format
+        """
+        raise NotImplementedError
+
+class streamed_list(PiccoloStreamedResult):
+    """a list whose items are encoded one by one"""
+
+    def chunks(self,fmt,encode):
+        if fmt == CONTENT_FORMAT_CBOR:
+            yield CBOR_ARRAY
+            for item in self._iterable:
+                yield encode(item,fmt)
+            yield CBOR_BREAK
+        else:
+            yield b'['
+            sep = b''
+            for item in self._iterable:
+                yield sep+encode(item,fmt)
+                sep = b', '
+            yield b']'
+
+class streamed_text(PiccoloStreamedResult):
+    """a text string produced in chunks"""
+
+    def chunks(self,fmt,encode):
+        if fmt == CONTENT_FORMAT_CBOR:
+            yield CBOR_TEXT
+            for chunk in self._iterable:
+                if len(chunk)>0:
+                    yield encode(chunk,fmt)
+            yield CBOR_BREAK
+        else:
+            yield b'"'
+            for chunk in self._iterable:
+                # strip the quotes of the encoded chunk
+                yield encode(chunk,fmt)[1:-1]
+            yield b'"'
+
+def read_chunks(fname,size=CHUNK_SIZE):
+    """iterate over the contents of a text file in chunks
+
+    :param fname: the name of the file
+    :param size: the number of characters per chunk
+    """
+    with open(fname,'r') as f:
+        while True:
+            chunk = f.read(size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+class PiccoloBlockCursor:
+    """serve blocks of a lazily produced payload
+
+    Blocks are expected to be fetched in order. The bytes before the
+    requested block are discarded.
+    """
+
+    def __init__(self,chunks):
+        """
+        :param chunks: iterable producing the payload in chunks of bytes
+        """
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        # offset of the start of the buffer in the payload
+        self._start = 0
+        self._done = False
+
+    @property
+    def start(self):
+        """the offset of the first byte still available"""
+        return self._start
+
+    def read(self,start,size):
+        """read a block
+
+        :param start: offset of the block in the payload
+        :param size: the size of the block
+        :return: tuple of the block and a flag indicating more blocks
+        """
+        if start < self._start:
+            raise ValueError('block at {} no longer available'.format(start))
+        # fill the buffer until it contains the block and one more byte
+        end = start+size
+        while not self._done and self._start+len(self._buffer) <= end:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                self._done = True
+        if start > self._start+len(self._buffer) or \
+           (start == self._start+len(self._buffer) and start > 0):
+            raise ValueError('block at {} out of bounds'.format(start))
+        del self._buffer[:start-self._start]
+        self._start = start
+        block = bytes(self._buffer[:size])
+        more = len(self._buffer) > size
+        return block,more
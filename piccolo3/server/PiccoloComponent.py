@@ -23,10 +23,188 @@
 import logging
 import aiocoap.resource as resource
 import aiocoap
+from aiocoap.optiontypes import BlockOption
+from aiocoap.numbers.constants import MAX_REGULAR_BLOCK_SIZE_EXP
 import functools
 import json
+import sys
+import hashlib
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-__all__ = ['PiccoloBaseComponent','PiccoloNamedComponent','piccoloGET', 'piccoloPUT','piccoloChanged']
+from .PiccoloTrace import PiccoloTrace, tracer
+from .PiccoloBlockwise import PiccoloBlockCursor, PiccoloStreamedResult
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+__all__ = ['PiccoloBaseComponent','PiccoloNamedComponent','piccoloGET', 'piccoloPUT','piccoloChanged',
+           'handler_latency','add_change_listener']
+
+# the CoAP content formats
+CONTENT_FORMAT_JSON = 50
+CONTENT_FORMAT_CBOR = 60
+
+# RFC 8746 tag of multi-dimensional arrays in row-major order
+CBOR_TAG_ARRAY = 40
+
+# the default Max-Age in seconds of cached resources, resources that change
+# need to be revalidated using their ETag
+CACHE_MAX_AGE = {'static':3600,
+                 'changed':0}
+
+# the default minimum time in seconds between notifying observers
+NOTIFY_MIN_INTERVAL = 0.5
+
+# the maximum number of partially transferred streamed results kept
+STREAM_CURSORS = 8
+# time in seconds after which partially transferred results are dropped
+STREAM_TIMEOUT = 60.
+
+# the maximum number of threads running blocking handlers
+HANDLER_THREADS = 4
+_executor = None
+# all resources, used for reporting handler latencies
+_resources = weakref.WeakSet()
+# functions called with the resource when a resource changes
+_changeListeners = []
+
+def _handler_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS,
+                                       thread_name_prefix='piccolo_handler')
+    return _executor
+
+async def call_handler(handler,blocking,*args,**kwargs):
+    """call a handler without blocking the event loop
+
+    Coroutine functions are awaited and blocking functions run on the
+    handler thread pool.
+    """
+    if asyncio.iscoroutinefunction(handler):
+        return await handler(*args,**kwargs)
+    if blocking:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_handler_executor(),
+                                          functools.partial(handler,*args,**kwargs))
+    return handler(*args,**kwargs)
+
+def handler_latency():
+    """the latency statistics of all handlers
+
+    :return: dictionary mapping handler names to dictionaries of the
+             statistics of the GET and PUT methods
+    """
+    latency = {}
+    for r in list(_resources):
+        stats = r.latency
+        if len(stats)>0:
+            latency[r.name] = stats
+    return latency
+
+def add_change_listener(listener):
+    """register a function that is called with the resource whenever the
+    change callback of a resource is called
+
+    The listener may be called from any thread.
+    """
+    _changeListeners.append(listener)
+
+class PiccoloLatency:
+    """latency statistics of a handler"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.last = 0.
+
+    def add(self,dt):
+        self.count += 1
+        self.total += dt
+        self.max = max(self.max,dt)
+        self.last = dt
+
+    def tolist(self):
+        return {'count':self.count,
+                'mean':self.total/self.count if self.count>0 else None,
+                'max':self.max,
+                'last':self.last}
+
+def _typed_array(a):
+    """encode a numpy array as RFC 8746 typed array"""
+    kind = a.dtype.kind
+    size = a.dtype.itemsize
+    if kind in 'ui' and size in [1,2,4,8]:
+        tag = 64 + [1,2,4,8].index(size)
+        if kind == 'i':
+            tag += 8
+    elif kind == 'f' and size in [2,4,8]:
+        tag = 80 + [2,4,8].index(size)
+    else:
+        return a.tolist()
+    if size > 1:
+        # always use little endian
+        tag += 4
+        a = a.astype(a.dtype.newbyteorder('<'),copy=False)
+    data = cbor2.CBORTag(tag,a.tobytes(order='C'))
+    if a.ndim != 1:
+        return cbor2.CBORTag(CBOR_TAG_ARRAY,[list(a.shape),data])
+    return data
+
+def _numpy(obj):
+    """convert numpy scalars, return arrays and None for other objects"""
+    # numpy objects can only exist if numpy has been imported
+    numpy = sys.modules.get('numpy')
+    if numpy is not None:
+        if isinstance(obj,numpy.generic):
+            return obj.item()
+        if isinstance(obj,numpy.ndarray):
+            return obj
+
+def _json_default(obj):
+    value = _numpy(obj)
+    if value is None:
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+    if not isinstance(value,(int,float,complex,bool,str,bytes)):
+        value = value.tolist()
+    return value
+
+def _cbor_default(encoder,obj):
+    value = _numpy(obj)
+    if value is None:
+        raise TypeError('cannot serialize type {}'.format(type(obj).__name__))
+    if not isinstance(value,(int,float,complex,bool,str,bytes)):
+        value = _typed_array(value)
+    encoder.encode(value)
+
+def encode_payload(data,content_format=CONTENT_FORMAT_JSON):
+    """encode data using JSON or CBOR"""
+    if content_format == CONTENT_FORMAT_CBOR:
+        return cbor2.dumps(data,default=_cbor_default)
+    return json.dumps(data,default=_json_default).encode()
+
+def decode_payload(payload,content_format=CONTENT_FORMAT_JSON):
+    """decode JSON or CBOR payload"""
+    if content_format == CONTENT_FORMAT_CBOR:
+        return cbor2.loads(payload)
+    return json.loads(payload.decode())
+
+def _content_format(fmt):
+    """check whether a content format is supported
+
+    :return: the content format or None if it is not supported
+    """
+    if fmt is None or fmt == CONTENT_FORMAT_JSON:
+        return CONTENT_FORMAT_JSON
+    if fmt == CONTENT_FORMAT_CBOR and cbor2 is not None:
+        return CONTENT_FORMAT_CBOR
 
 def _extract_path(f,prefix,path):
     if path is None:
@@ -39,33 +217,69 @@ def _extract_path(f,prefix,path):
     return p
         
 
-def piccoloGET(_func=None,*, path=None, observable=False, has_subs=False, parse_path=False):
+def piccoloGET(_func=None,*, path=None, observable=False, has_subs=False, parse_path=False, snapshot=True,
+               cache=None, max_age=None, blocking=False, stream=False):
+    """
+    The decorated method can be a coroutine function.
+
+    :param blocking: the method blocks, run it on the handler thread pool
+    :param stream: the method can return a streamed_list or streamed_text
+                   which is encoded block by block as the client requests it
+    :param snapshot: include the resource in the state snapshot, set to False
+                     for resources with side effects or large results, for
+                     resources parsing the path set to the name of the
+                     attribute listing the path arguments
+    :param cache: cache the result, *static* if it never changes or
+                  *changed* if it only changes when the piccoloChanged
+                  callback of the resource is called
+    :param max_age: the Max-Age in seconds of the result
+    """
+    if cache not in [None,'static','changed']:
+        raise ValueError('unknown cache policy {}'.format(cache))
     @functools.wraps(_func)
     def decorator_get(func):
         func.GET = (_extract_path(func,'get_',path),{"observable":observable,
                                                      "has_subs":has_subs,
-                                                     "parse_path":parse_path})
+                                                     "parse_path":parse_path,
+                                                     "snapshot":snapshot,
+                                                     "cache":cache,
+                                                     "max_age":max_age,
+                                                     "blocking":blocking,
+                                                     "stream":stream})
         return func
     if _func is None:
         return decorator_get
     else:
         return decorator_get(_func)
 
-def piccoloPUT(_func=None,*, path=None, has_subs=False, parse_path=False):
+def piccoloPUT(_func=None,*, path=None, has_subs=False, parse_path=False, blocking=False, stream=False):
+    """
+    The decorated method can be a coroutine function.
+
+    :param blocking: the method blocks, run it on the handler thread pool
+    :param stream: the method can return a streamed_list or streamed_text
+                   which is encoded block by block as the client requests it
+    """
     @functools.wraps(_func)
     def decorator_put(func):
         func.PUT = (_extract_path(func,'set_',path),{"has_subs":has_subs,
-                                                     "parse_path":parse_path})
+                                                     "parse_path":parse_path,
+                                                     "blocking":blocking,
+                                                     "stream":stream})
         return func
     if _func is None:
         return decorator_put
     else:
         return decorator_put(_func)
 
-def piccoloChanged(_func=None,*, path=None):
+def piccoloChanged(_func=None,*, path=None, min_interval=None):
+    """
+    :param min_interval: the minimum time in seconds between notifying
+                         observers, changes in between are coalesced
+    """
     @functools.wraps(_func)
     def decorator_changed(func):
-        func.CHANGED = (_extract_path(func,'callback_',path),{})
+        func.CHANGED = (_extract_path(func,'callback_',path),{"min_interval":min_interval})
         return func
     if _func is None:
         return decorator_changed
@@ -120,7 +334,10 @@ class PiccoloCoAPSite(type):
                         else:
                             x._resources[path]["resource_type"] = PiccoloObservalbeResource
         for p in x._resources:
-            r = x._resources[p]["resource_type"](x,x._resources[p])
+            if 'GET' in x._resources[p] and x._resources[p]['GET'][1]['cache'] == 'changed' \
+               and 'CHANGED' not in x._resources[p]:
+                raise RuntimeError('resource %s is invalidated by changes but has no callback'%p)
+            r = x._resources[p]["resource_type"](x,x._resources[p],path=p)
             if x._resources[p]["sub_sites"]:
                 sub_site = getattr(x,p+'_site')
                 sub_site.add_resource([],r)
@@ -137,51 +354,261 @@ class PiccoloResource(resource.Resource):
     """
     a CoAP resource
     """
-    def __init__(self,component,spec):
+    def __init__(self,component,spec,path=None):
         super().__init__()
         self._component = component
         self._spec = spec
+        self._path = path
+        self._latency = {}
+        _resources.add(self)
 
         self._get = None
         self._put = None
+        self._cachePolicy = None
+        self._maxAge = None
         if 'GET' in self._spec:
             self._get = getattr(self._component,self._spec['GET'][0])
+            self._cachePolicy = self._spec['GET'][1].get('cache')
+            self._maxAge = self._spec['GET'][1].get('max_age')
+            if self._maxAge is None and self._cachePolicy is not None:
+                self._maxAge = CACHE_MAX_AGE[self._cachePolicy]
         if 'PUT' in self._spec:
             self._put = getattr(self._component,self._spec['PUT'][0])
+
+        # the cached payloads and ETags
+        self._cache = {}
+        self._cacheGeneration = 0
+        # time in seconds uncached results are shared between requests
+        self._shareTime = 0.
+        # partially transferred streamed results
+        self._cursors = OrderedDict()
         
     @property
     def log(self):
         return self._component.log
 
+    @property
+    def name(self):
+        """the name of the handler"""
+        name = self._component.logName
+        if name.startswith('piccolo.'):
+            name = name[len('piccolo.'):]
+        if self._path is not None:
+            name += '/'+self._path
+        return name
+
+    @property
+    def latency(self):
+        """the latency statistics of the GET and PUT methods"""
+        return {m:self._latency[m].tolist() for m in self._latency}
+
+    async def _call(self,method,trace,*args,**kwargs):
+        """call the GET or PUT method and record its latency"""
+        handler = self._get if method == 'GET' else self._put
+        blocking = self._spec[method][1].get('blocking',False)
+        t0 = time.monotonic()
+        try:
+            return await call_handler(handler,blocking,*args,**kwargs)
+        finally:
+            dt = time.monotonic()-t0
+            trace.handler = dt
+            if method not in self._latency:
+                self._latency[method] = PiccoloLatency()
+            self._latency[method].add(dt)
+
+    def _encode(self,result,fmt,trace):
+        t0 = time.monotonic()
+        if isinstance(result,PiccoloStreamedResult):
+            payload = b''.join(result.chunks(fmt,encode_payload))
+        else:
+            payload = encode_payload(result,fmt)
+        trace.encode = time.monotonic()-t0
+        return payload
+
+    def _streaming(self,request):
+        """check whether the response to a request is streamed"""
+        method = str(request.code)
+        if method not in self._spec or not self._spec[method][1].get('stream',False):
+            return False
+        # observations and blockwise requests are assembled by aiocoap
+        return request.opt.observe is None and request.opt.block1 is None
+
+    async def needs_blockwise_assembly(self, request):
+        return not self._streaming(request)
+
+    async def _stream_response(self,method,request,trace,args,kwargs,fmt):
+        """answer a request for a block of a streamed result"""
+        maxexp = MAX_REGULAR_BLOCK_SIZE_EXP
+        if request.remote is not None:
+            maxexp = min(maxexp,request.remote.maximum_block_size_exp)
+        block = request.opt.block2
+        if block is None:
+            block = BlockOption.BlockwiseTuple(0,False,maxexp)
+        else:
+            block = block.reduced_to(maxexp)
+
+        # drop stale cursors
+        now = time.monotonic()
+        for k in list(self._cursors):
+            if now-self._cursors[k][1] > STREAM_TIMEOUT:
+                del self._cursors[k]
+
+        # requests for later blocks may not repeat the payload
+        key = (request.remote,method,tuple(request.opt.uri_path),fmt)
+        cursor = None
+        if block.block_number > 0 and key in self._cursors and \
+           block.start >= self._cursors[key][0].start:
+            cursor = self._cursors[key][0]
+        elif block.block_number > 0 and method == 'PUT':
+            return aiocoap.Message(code=aiocoap.REQUEST_ENTITY_INCOMPLETE)
+        if cursor is None:
+            # start a new transfer, GET requests can continue a transfer
+            # started elsewhere, eg by an observation
+            result = await self._call(method,trace,*args,**kwargs)
+            if method == 'PUT':
+                self.invalidate()
+            if isinstance(result,PiccoloStreamedResult):
+                chunks = result.chunks(fmt,encode_payload)
+            elif method == 'PUT' and result is None:
+                chunks = []
+            else:
+                chunks = [self._encode(result,fmt,trace)]
+            cursor = PiccoloBlockCursor(chunks)
+        self._cursors[key] = (cursor,now)
+        self._cursors.move_to_end(key)
+        while len(self._cursors) > STREAM_CURSORS:
+            self._cursors.popitem(last=False)
+
+        t0 = time.monotonic()
+        try:
+            if self._spec[method][1].get('blocking',False):
+                loop = asyncio.get_running_loop()
+                payload,more = await loop.run_in_executor(_handler_executor(),
+                                                          cursor.read,block.start,block.size)
+            else:
+                payload,more = cursor.read(block.start,block.size)
+        except:
+            self._cursors.pop(key,None)
+            raise
+        trace.encode += time.monotonic()-t0
+        if not more:
+            del self._cursors[key]
+        code = aiocoap.CONTENT if method == 'GET' else aiocoap.CHANGED
+        if block.start == 0 and not more:
+            # the result fits into a single message
+            if method == 'PUT' and len(payload) == 0:
+                return aiocoap.Message(code=code)
+            return aiocoap.Message(code=code,payload=payload,content_format=fmt)
+        return aiocoap.Message(code=code,payload=payload,content_format=fmt,
+                               block2=(block.block_number,more,block.size_exponent))
+
+    def _trace(self,request):
+        """start the trace of a request"""
+        args_size = len(request.payload)+sum(len(a) for a in request.opt.uri_path)
+        return PiccoloTrace(self.name,str(request.code),args_size)
+
+    def invalidate(self):
+        """drop the cached results"""
+        self._cacheGeneration += 1
+        self._cache = {}
+
     def notify(self):
-        pass
+        self.invalidate()
+        for listener in _changeListeners:
+            listener(self)
+
+    async def _render(self,args,fmt,trace):
+        """call the GET method and encode the result
+
+        :return: tuple of payload and ETag
+        """
+        key = (tuple(args),fmt)
+        if key in self._cache:
+            payload,etag,t = self._cache[key]
+            if self._cachePolicy is not None or time.monotonic()-t < self._shareTime:
+                trace.cached = True
+                return payload,etag
+        generation = self._cacheGeneration
+        msg = 'calling {}'.format(self._get.__name__)
+        if len(args)>0:
+            msg += ' args={}'.format(args)
+        self.log.debug(msg)
+        result = await self._call('GET',trace,*args)
+        payload = self._encode(result,fmt,trace)
+        self.log.debug('result: %s'%(payload))
+        etag = hashlib.sha1(payload).digest()[:8]
+        # do not cache results that were invalidated in the meantime
+        if (self._cachePolicy is not None or self._shareTime > 0) and \
+           generation == self._cacheGeneration:
+            self._cache[key] = (payload,etag,time.monotonic())
+        return payload,etag
     
     async def render_get(self, request):
+        trace = self._trace(request)
+        response = await self._get_response(request,trace)
+        tracer.record(trace.finish(response))
+        return response
+
+    async def _get_response(self, request, trace):
         args = request.opt.uri_path
         if self._get is None:
             return aiocoap.Message(code=aiocoap.METHOD_NOT_ALLOWED)
+        fmt = _content_format(request.opt.accept)
+        if fmt is None:
+            return aiocoap.Message(code=aiocoap.NOT_ACCEPTABLE)
+        if self._streaming(request):
+            try:
+                return await self._stream_response('GET',request,trace,list(args),{},fmt)
+            except Exception as e:
+                result = str(e)
+                self.log.error(result)
+                return aiocoap.Message(code=aiocoap.INTERNAL_SERVER_ERROR,payload=result.encode())
         try:
-            msg = 'calling {}'.format(self._get.__name__)
-            if len(args)>0:
-                msg += ' args={}'.format(args)
-            self.log.debug(msg)
-            result = self._get(*args)
-            result = json.dumps(result)
-            self.log.debug('result: %s'%(result))
-            code = aiocoap.CONTENT
+            payload,etag = await self._render(args,fmt,trace)
         except Exception as e:
             result = str(e)
             self.log.error(result)
-            code = aiocoap.INTERNAL_SERVER_ERROR
-        return aiocoap.Message(code=code,payload=result.encode())
+            return aiocoap.Message(code=aiocoap.INTERNAL_SERVER_ERROR,payload=result.encode())
+        options = {'etag':etag}
+        if self._maxAge is not None:
+            options['max_age'] = self._maxAge
+        if etag in request.opt.etags:
+            # the client already has the current representation
+            return aiocoap.Message(code=aiocoap.VALID,**options)
+        return aiocoap.Message(code=aiocoap.CONTENT,payload=payload,content_format=fmt,**options)
 
     async def render_put(self, request):
+        trace = self._trace(request)
+        response = await self._put_response(request,trace)
+        tracer.record(trace.finish(response))
+        return response
+
+    async def _put_response(self, request, trace):
         args = list(request.opt.uri_path)
         if self._put is None:
             return aiocoap.Message(code=aiocoap.METHOD_NOT_ALLOWED)    
-        # convert payload to json
+        fmt = _content_format(request.opt.content_format)
+        if fmt is None:
+            return aiocoap.Message(code=aiocoap.UNSUPPORTED_CONTENT_FORMAT)
+        # the reply uses the same format as the request unless requested otherwise
+        if request.opt.accept is not None:
+            rfmt = _content_format(request.opt.accept)
+            if rfmt is None:
+                return aiocoap.Message(code=aiocoap.NOT_ACCEPTABLE)
+        else:
+            rfmt = fmt
+        if self._streaming(request) and request.opt.block2 is not None and \
+           request.opt.block2.block_number > 0:
+            # continue transferring a streamed result
+            try:
+                return await self._stream_response('PUT',request,trace,None,None,rfmt)
+            except Exception as e:
+                e = str(e)
+                self.log.error(e)
+                return aiocoap.Message(code=aiocoap.BAD_REQUEST, payload=e.encode())
+        # decode payload
         try:
-            data = json.loads(request.payload.decode())
+            data = decode_payload(request.payload,fmt)
         except Exception as e:
             e = str(e)
             self.log.error(e)
@@ -204,7 +631,9 @@ class PiccoloResource(resource.Resource):
             kwargs = {}
         self.log.debug('calling {}, args={}, kwargs={}'.format(self._put.__name__,args,kwargs))
         try:
-            result = self._put(*args,**kwargs)
+            if self._streaming(request):
+                return await self._stream_response('PUT',request,trace,args,kwargs,rfmt)
+            result = await self._call('PUT',trace,*args,**kwargs)
         except Warning as e:
             e = str(e)
             self.log.warning(e)
@@ -213,18 +642,68 @@ class PiccoloResource(resource.Resource):
             e = str(e)
             self.log.error(e)
             return aiocoap.Message(code=aiocoap.BAD_REQUEST, payload=e.encode())
+        self.invalidate()
         if result is not None:
-            result = json.dumps(result)
+            result = self._encode(result,rfmt,trace)
         else:
-            result = ""
+            result = b""
         self.log.debug('result: %s'%(result))
         if len(result)>0:
             self.notify()
-        return aiocoap.Message(code=aiocoap.CHANGED, payload=result.encode())
+            return aiocoap.Message(code=aiocoap.CHANGED, payload=result, content_format=rfmt)
+        return aiocoap.Message(code=aiocoap.CHANGED, payload=result)
 
 class PiccoloObservalbeResource(PiccoloResource,resource.ObservableResource):
+    """
+    an observable CoAP resource
+
+    Changes are coalesced so that observers are notified at most once per
+    minimum interval. The result rendered for a notification is shared by
+    all observers.
+    """
+    def __init__(self,component,spec,path=None):
+        super().__init__(component,spec,path=path)
+
+        self._minInterval = NOTIFY_MIN_INTERVAL
+        if 'CHANGED' in spec and spec['CHANGED'][1].get('min_interval') is not None:
+            self._minInterval = spec['CHANGED'][1]['min_interval']
+        self._shareTime = self._minInterval
+
+        self._loop = None
+        self._lastNotified = 0.
+        self._notifyPending = False
+
     def notify(self):
+        super().notify()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            self._schedule_notification()
+        elif self._loop is not None:
+            # called from another thread
+            self._loop.call_soon_threadsafe(self._schedule_notification)
+        # otherwise nobody has observed the resource yet
+
+    def _schedule_notification(self):
+        if self._notifyPending:
+            return
+        self._notifyPending = True
+        delay = max(0.,self._lastNotified + self._minInterval - time.monotonic())
+        asyncio.get_running_loop().call_later(delay,self._notify_observers)
+
+    def _notify_observers(self):
+        self._notifyPending = False
+        self._lastNotified = time.monotonic()
         self.updated_state()
+
+    def update_observation_count(self,newcount):
+        self._component.observation_count_changed(self._path,newcount)
+
+    async def render_get(self, request):
+        self._loop = asyncio.get_running_loop()
+        return await super().render_get(request)
         
 class PiccoloResourcePath(PiccoloResource,resource.PathCapable):
     pass
@@ -255,6 +734,10 @@ class PiccoloBaseComponent(metaclass=PiccoloCoAPSite):
     @property
     def coapSite(self):
         return ((self.NAME,),self.coapResources)
+
+    def observation_count_changed(self,path,count):
+        """called when the number of observers of a resource changes"""
+        pass
         
     @property
     def log(self):
@@ -0,0 +1,140 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+offload numeric processing of spectra
+
+The compute pool runs the analysis of spectra on a pool of threads or
+processes and returns futures so that the spectrometer workers can carry on
+recording. Process pools receive the arrays through shared memory. Only
+submit work that the worker does not need before its next exposure, cheap
+reductions whose result is needed straight away are called directly.
+"""
+
+__all__ = ['PiccoloComputePool','default_pool','max_intensity','frame_mean',
+           'wavelength_coefficients']
+
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from queue import Queue
+import numpy
+
+# the number of arrays that can be in transit to a process pool and the
+# maximum number of values of each array
+SHARED_SLOTS = 4
+SHARED_SIZE = 65536
+
+def max_intensity(pixels):
+    """the height of the most prominent peak, the maximum if there are no peaks"""
+    from scipy.signal import find_peaks
+    try:
+        peaks, properties = find_peaks(pixels,width=5)
+        return float(max(properties['prominences']))
+    except:
+        return float(max(pixels))
+
+def frame_mean(frames):
+    """the mean of a stack of frames"""
+    return frames.mean(axis=0)
+
+def wavelength_coefficients(wavelengths):
+    """fit a cubic polynomial to the wavelengths of the pixels
+
+    :return: the coefficients, constant term first
+    """
+    coeff = numpy.polyfit(numpy.arange(len(wavelengths)),wavelengths,3)
+    return [float(c) for c in coeff[::-1]]
+
+# the shared memory of a process pool worker
+_shared = None
+
+def _init_process(buf):
+    global _shared
+    _shared = numpy.frombuffer(buf,dtype=numpy.float64).reshape((SHARED_SLOTS,SHARED_SIZE))
+
+def _call_shared(func,slot,shape,args):
+    """call func on an array held in shared memory"""
+    n = int(numpy.prod(shape))
+    return func(_shared[slot,:n].reshape(shape),*args)
+
+class PiccoloComputePool:
+    """pool of threads or processes analysing spectra"""
+
+    KINDS = ['thread','process']
+
+    def __init__(self,kind='thread',workers=2):
+        """
+        :param kind: run the analysis on a pool of threads or processes
+        :param workers: the number of threads or processes
+        """
+        if kind not in self.KINDS:
+            raise ValueError('unknown kind of compute pool {}'.format(kind))
+        self._kind = kind
+        self._free = None
+        if kind == 'process':
+            ctx = multiprocessing.get_context('spawn')
+            buf = ctx.RawArray('d',SHARED_SLOTS*SHARED_SIZE)
+            self._shared = numpy.frombuffer(buf,dtype=numpy.float64).reshape((SHARED_SLOTS,SHARED_SIZE))
+            self._free = Queue()
+            for i in range(SHARED_SLOTS):
+                self._free.put(i)
+            self._executor = ProcessPoolExecutor(max_workers=workers,mp_context=ctx,
+                                                 initializer=_init_process,initargs=(buf,))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers,
+                                                thread_name_prefix='piccolo_compute')
+
+    @property
+    def kind(self):
+        return self._kind
+
+    def submit(self,func,data,*args):
+        """analyse an array
+
+        :param func: module level function called with the array and args
+        :param data: the array
+        :return: future holding the result
+        :rtype: concurrent.futures.Future
+        """
+        data = numpy.asarray(data)
+        if self._free is None or data.size > SHARED_SIZE:
+            return self._executor.submit(func,data,*args)
+        # wait for a free slot of shared memory
+        slot = self._free.get()
+        self._shared[slot,:data.size] = data.ravel()
+        try:
+            future = self._executor.submit(_call_shared,func,slot,data.shape,args)
+        except:
+            self._free.put(slot)
+            raise
+        future.add_done_callback(lambda f: self._free.put(slot))
+        return future
+
+    def shutdown(self,wait=True):
+        self._executor.shutdown(wait=wait)
+
+_default = None
+_defaultLock = threading.Lock()
+
+def default_pool():
+    """the compute pool used unless another one is configured"""
+    global _default
+    with _defaultLock:
+        if _default is None:
+            _default = PiccoloComputePool()
+    return _default
@@ -37,18 +37,39 @@ defaultCfgStr = """
     direction = string
     reverse = boolean(default=False) # Is the polarity of the shutter connection reversed?
     fibreDiameter = integer(default=600) # micrometres
+    settle_time = float(default=0.05) # time in seconds the shutter takes to settle after switching
 
 [spectrometers]
   [[__many__]]
     detectorSetTemperature = float(default=-10.0)
     fan = boolean(default=True)
     power_switch = integer(default=-1) # GPIO pin number used for switch
+    channels = string_list(default=list()) # channels the spectrometer is connected to, all if empty
     min_integration_time = float(default=1000.) # minimum integration time in ms
     max_integration_time = float(default=65535000.) # maximum integration time in ms
     [[[calibration]]]
       [[[[__many__]]]]
         wavelengthCalibrationCoefficientsPiccolo = float_list()
 
+[power]
+  # spectrometers are switched on one after the other
+  inrush_delay = float(default=0.5) # minimum time in seconds between switching on spectrometers
+  enumeration_timeout = float(default=10.) # maximum time in seconds to wait for a spectrometer to appear on the USB bus
+
+[workers]
+  process = boolean(default=False) # run each spectrometer worker in its own process
+  hang_timeout = float(default=60.) # restart a worker process that makes no progress for this many seconds, must exceed the longest integration time
+
+[compute]
+  # pool analysing spectra, worker processes use their own pool of threads
+  kind = option('thread','process',default='thread') # analyse spectra in threads or processes
+  workers = integer(default=2) # the number of threads or processes
+
+[location]
+  # location of the instrument, used for computing the position of the sun
+  latitude = float(default=None) # degrees north
+  longitude = float(default=None) # degrees east
+
 [output]
   # overwrite output files when clobber is set to True
   clobber = boolean(default=False)
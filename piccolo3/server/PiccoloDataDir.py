@@ -23,6 +23,7 @@
 __all__ = ['PiccoloDataDir']
 
 from .PiccoloComponent import PiccoloBaseComponent, PiccoloNamedComponent, piccoloGET, piccoloPUT, piccoloChanged 
+from .PiccoloBlockwise import streamed_list, streamed_text, read_chunks
 import os, os.path, glob
 import subprocess
 
@@ -50,12 +51,14 @@ class PiccoloRunDir(PiccoloNamedComponent):
         """construct full path given name"""
         return os.path.join(self.datadir.join(self.name),name)
                 
-    @piccoloPUT(path="spectra")
+    @piccoloPUT(path="spectra",blocking=True,stream=True)
     def get_spectra(self,sname):
-        data = open(self.full_path(sname),'r').read()
-        return data
+        fname = self.full_path(sname)
+        if not os.path.isfile(fname):
+            raise Warning('no spectra file {}'.format(sname))
+        return streamed_text(read_chunks(fname))
                 
-    @piccoloGET
+    @piccoloGET(snapshot=False,blocking=True)
     def get_spectra_list(self):
         spectra = []
         for s in glob.glob(self.full_path(self._pattern)):
@@ -110,13 +113,13 @@ class PiccoloDataDir(PiccoloBaseComponent):
         self._current_run = None
         self._current_runChanged = None
         self._runs = {}
-        for r in self.get_runs():
+        for r in self.list_runs():
             self.add_run(r)
 
         if len(self._runs) == 0:
             self.set_current_run('spectra')
         else:
-            r = self.get_runs(reverse=True,nitems=1)[0]
+            r = self.list_runs(reverse=True,nitems=1)[0]
             self.set_current_run(r)
                 
     @property
@@ -135,6 +138,14 @@ class PiccoloDataDir(PiccoloBaseComponent):
             self._runs[run] = PiccoloRunDir(self,run)
             self.coapResources.add_resource(['runs',run],self._runs[run].coapResources)
         return self._runs[run]
+
+    def create_run(self,run):
+        """create the directory for a run if necessary and register it"""
+        r = self.join(run)
+        if not os.path.isdir(r):
+            self.log.debug('creating directory for run %s'%run)
+            os.makedirs(r)
+        return self.add_run(run)
     
     def _check_datadir(self):
         """check if data directory exists with correct permissions, if not create it"""
@@ -146,7 +157,7 @@ class PiccoloDataDir(PiccoloBaseComponent):
         if not os.access(self.datadir,os.W_OK):
             raise RuntimeError('cannot write to {}'.format(self.datadir))
 
-    @piccoloGET
+    @piccoloGET(blocking=True)
     def get_mount(self):
         """check if device is mounted in specified location
 
@@ -164,7 +175,7 @@ class PiccoloDataDir(PiccoloBaseComponent):
             return False
         raise OSError ("Cannot read /proc/mounts")
 
-    @piccoloPUT
+    @piccoloPUT(blocking=True)
     def set_mount(self,mount):
         """mount/unmount device at mountpoint
 
@@ -195,12 +206,16 @@ class PiccoloDataDir(PiccoloBaseComponent):
                 raise Warning("device {} is already unmounted".format(self.device))
         return msg
 
-    @piccoloGET
+    @piccoloGET(cache='static')
     def get_datadir(self):
         return self.datadir
 
-    @piccoloPUT(path="all_runs")
+    @piccoloPUT(path="all_runs",blocking=True,stream=True)
     def get_runs(self,alpha=False,reverse=False,nitems=None,page=0):
+        """get list of runs, see list_runs"""
+        return streamed_list(self.list_runs(alpha=alpha,reverse=reverse,nitems=nitems,page=page))
+
+    def list_runs(self,alpha=False,reverse=False,nitems=None,page=0):
         """get list of runs
         :param alpha: set to True to sort names alphanumerically, otherwise sort by time stamp
         :param reverse: set to True to reverse order
@@ -225,7 +240,7 @@ class PiccoloDataDir(PiccoloBaseComponent):
             runs = runs[page]
         return runs
 
-    @piccoloGET(observable=True)
+    @piccoloGET(observable=True,cache='changed')
     def get_current_run(self):
         """get the current run"""
         return self._current_run
@@ -234,11 +249,7 @@ class PiccoloDataDir(PiccoloBaseComponent):
         """set the current run"""
         if run == self._current_run:
             raise Warning('already using run %s'%run)
-        r = self.join(run)
-        if not os.path.isdir(r):
-            self.log.debug('creating directory for run %s'%run)
-            os.makedirs(r)
-            self.add_run(run)
+        self.create_run(run)
         self._current_run = run
         if self._current_runChanged is not None:
             self._current_runChanged()
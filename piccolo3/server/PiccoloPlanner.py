@@ -0,0 +1,236 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+plan the acquisitions of a sequence
+
+A sequence is broken into steps. During each step at most one shutter is
+open. Spectrometers connected to the open channel record a light spectrum
+while spectrometers not connected to it can record a dark spectrum at the
+same time. Darks left over are recorded with all shutters closed. A dark is
+only recorded once per integration time and spectrometer and reused for all
+channels of that spectrometer with the same integration time.
+"""
+
+__all__ = ['PiccoloStep','PiccoloSequencePlan']
+
+import math
+
+# time in seconds spent on top of the integration time by each acquisition,
+# the spectrometer worker reads a second spectrum when the integration time
+# changed or the first one was buffered before the request, so at worst
+# two exposures are needed
+ACQUISITION_OVERHEAD = 0.2
+# time in seconds spent on each step for moving the shutters
+STEP_OVERHEAD = 0.1
+# the number of spectra recorded when autointegrating a channel
+AUTOINTEGRATION_ATTEMPTS = 5
+
+def acquisition_time(integration_time):
+    """estimate the time in seconds taken to record a spectrum
+
+    :param integration_time: the integration time in milliseconds
+    """
+    return 2*integration_time/1000. + ACQUISITION_OVERHEAD
+
+class PiccoloStep:
+    """the acquisitions happening at the same time"""
+
+    def __init__(self,shutter=None,lights=None,darks=None):
+        """
+        :param shutter: the shutter opened during the step, None if all
+                        shutters stay closed
+        :param lights: dictionary mapping spectrometers to the channel of
+                       their light spectrum
+        :param darks: dictionary mapping spectrometers to the channel of
+                      their dark spectrum
+        """
+        self.shutter = shutter
+        self.lights = {} if lights is None else lights
+        self.darks = {} if darks is None else darks
+
+    def acquisitions(self):
+        """iterate over spectrometer, channel, dark tuples"""
+        for spec in sorted(self.lights):
+            yield spec,self.lights[spec],False
+        for spec in sorted(self.darks):
+            yield spec,self.darks[spec],True
+
+    def duration(self,integration_times):
+        """estimate the duration of the step in seconds"""
+        t = 0.
+        for spec,channel,dark in self.acquisitions():
+            t = max(t,acquisition_time(integration_times[spec][channel]))
+        return t + STEP_OVERHEAD
+
+    def tolist(self):
+        return {'shutter':self.shutter,'lights':self.lights,'darks':self.darks}
+
+class PiccoloSequencePlan:
+    """the timeline of the acquisitions of a sequence"""
+
+    def __init__(self,shutters,topology,integration_times):
+        """
+        :param shutters: list of shutters, in the order they are opened
+        :param topology: dictionary mapping spectrometers to the list of
+                         channels they are connected to
+        :param integration_times: dictionary mapping spectrometers to a
+                                  dictionary of integration times in
+                                  milliseconds per channel
+        """
+        self._shutters = list(shutters)
+        self._topology = topology
+        self._times = integration_times
+
+        # the darks that need to be recorded per spectrometer, darks of
+        # channels with the same integration time are reused
+        self._reuse = {}
+        self._darks = {}
+        for spec in topology:
+            self._reuse[spec] = {}
+            byTime = {}
+            for c in topology[spec]:
+                t = integration_times[spec][c]
+                if t in byTime:
+                    self._reuse[spec][byTime[t]].append(c)
+                else:
+                    byTime[t] = c
+                    self._reuse[spec][c] = []
+            # record the longest darks first
+            self._darks[spec] = sorted(byTime.values(),
+                                       key=lambda c: -integration_times[spec][c])
+
+    @classmethod
+    def from_instrument(cls,shutters,spectrometers):
+        """plan a sequence using the current integration times
+
+        :param shutters: the shutters
+        :param spectrometers: the spectrometers
+        """
+        topology = {}
+        times = {}
+        for spec in spectrometers:
+            channels = [c for c in spectrometers[spec].channels if c in shutters]
+            topology[spec] = channels
+            times[spec] = {c:spectrometers[spec].get_current_time(c) for c in channels}
+        return cls(shutters,topology,times)
+
+    @property
+    def integration_times(self):
+        return self._times
+
+    def reused(self,spec,channel):
+        """the channels that reuse the dark of channel"""
+        return self._reuse[spec].get(channel,[])
+
+    def steps(self,lights=True,darks=True):
+        """construct the steps of a sequence
+
+        :param lights: record light spectra
+        :param darks: record dark spectra
+        :return: list of steps
+        """
+        pending = {}
+        if darks:
+            pending = {spec:list(self._darks[spec]) for spec in self._darks}
+
+        steps = []
+        if lights:
+            for shutter in self._shutters:
+                step = PiccoloStep(shutter)
+                for spec in self._topology:
+                    if shutter in self._topology[spec]:
+                        step.lights[spec] = shutter
+                    elif len(pending.get(spec,[]))>0:
+                        # not connected to the open shutter, record a dark
+                        step.darks[spec] = pending[spec].pop(0)
+                if len(step.lights)>0 or len(step.darks)>0:
+                    steps.append(step)
+
+        while any(len(pending[spec])>0 for spec in pending):
+            step = PiccoloStep()
+            for spec in pending:
+                if len(pending[spec])>0:
+                    step.darks[spec] = pending[spec].pop(0)
+            steps.append(step)
+        return steps
+
+    def duration(self,lights=True,darks=True):
+        """estimate the time in seconds taken to record a sequence"""
+        return sum(s.duration(self._times) for s in self.steps(lights=lights,darks=darks))
+
+    def autointegration_duration(self):
+        """estimate the time in seconds taken to autointegrate all channels"""
+        t = 0.
+        for shutter in self._shutters:
+            ts = [self._times[spec][shutter] for spec in self._topology
+                  if shutter in self._topology[spec]]
+            if len(ts)>0:
+                t += AUTOINTEGRATION_ATTEMPTS*acquisition_time(max(ts)) + STEP_OVERHEAD
+        return t
+
+    def count(self,lights=True,darks=True):
+        """the number of light and dark spectra of a sequence"""
+        nlight = 0
+        ndark = 0
+        for spec in self._topology:
+            if lights:
+                nlight += len(self._topology[spec])
+            if darks:
+                ndark += len(self._topology[spec])
+        return nlight,ndark
+
+    @staticmethod
+    def needs_dark(sequence,nsequence,auto):
+        """check whether a dark is recorded alongside a sequence"""
+        if auto<1 and sequence == 0:
+            return True
+        if auto>0 and sequence%auto == 0:
+            return True
+        if nsequence>1 and sequence == nsequence-1:
+            return True
+        return False
+
+    def estimate_batch(self,nsequence,auto,delay):
+        """estimate the duration of a batch
+
+        :param nsequence: the number of sequences
+        :param auto: autointegrate every auto sequences, only once at the
+                     start if 0 and never if negative
+        :param delay: the delay in seconds between sequences
+        :return: dictionary containing the duration in seconds and the
+                 number of light and dark spectra
+        """
+        duration = 0.
+        nlight = 0
+        ndark = 0
+        if auto == 0:
+            duration += self.autointegration_duration()
+        elif auto>0:
+            duration += math.ceil(nsequence/auto)*self.autointegration_duration()
+        for sequence in range(nsequence):
+            darks = self.needs_dark(sequence,nsequence,auto)
+            duration += self.duration(darks=darks) + delay
+            nl,nd = self.count(darks=darks)
+            nlight += nl
+            ndark += nd
+        return {'duration':duration,
+                'light_spectra':nlight,
+                'dark_spectra':ndark}
+
+    def tolist(self):
+        return [s.tolist() for s in self.steps()]
@@ -15,20 +15,116 @@
 # You should have received a copy of the GNU General Public License
 # along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
 
-__all__ = ['PiccoloScheduler']
+__all__ = ['PiccoloScheduler','cron_times']
 
 from .PiccoloComponent import PiccoloBaseComponent, PiccoloNamedComponent, piccoloGET, piccoloPUT, piccoloChanged
+from .PiccoloBlockwise import streamed_list
+from .PiccoloWorkerThreads import PiccoloThread
+from .PiccoloSolar import solar_elevation, sun_windows
 from piccolo3.common import PiccoloSchedulerStatus
 import logging
 import datetime, pytz
 from dateutil import parser
 import json
+import threading
+import time
+from queue import Queue, Empty
+from collections import OrderedDict, deque
+import itertools
 import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 Base = declarative_base()
 
+# the maximum number of jobs that can be added in one go
+MAX_BULK_JOBS = 10000
+# the number of job changes kept for observers fetching incremental updates
+JOBS_LOG_LENGTH = 1000
+# the possible outcomes of running a job
+RUN_OUTCOMES = ['completed','aborted','failed']
+# the maximum time in seconds to wait for outstanding changes to be written
+# when stopping
+STOP_TIMEOUT = 10.
+
+def _parse_cron_field(field,vmin,vmax):
+    """parse a single field of a cron expression
+
+    :param field: the field, supports *, lists (a,b), ranges (a-b) and steps (*/n, a-b/n)
+    :param vmin: the minimum value of the field
+    :param vmax: the maximum value of the field
+    :return: the set of matching values
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part,step = part.split('/')
+            step = int(step)
+            if step < 1:
+                raise ValueError('cron step must be positive')
+        if part == '*':
+            start,end = vmin,vmax
+        elif '-' in part:
+            start,end = [int(v) for v in part.split('-')]
+        else:
+            start = int(part)
+            end = start if step == 1 else vmax
+        if start < vmin or end > vmax or start > end:
+            raise ValueError('cron value {} out of range [{},{}]'.format(part,vmin,vmax))
+        values.update(range(start,end+1,step))
+    return values
+
+def cron_times(rule,start_time,end_time):
+    """expand a cron-like rule into a list of times
+
+    The rule has the usual five fields: minute, hour, day of month, month and
+    day of week (0 or 7 is Sunday). All times are in UTC.
+
+    :param rule: the cron expression
+    :param start_time: the earliest time
+    :type start_time: datetime.datetime
+    :param end_time: the latest time
+    :type end_time: datetime.datetime
+    :return: list of times matching the rule
+    """
+    fields = rule.split()
+    if len(fields) != 5:
+        raise ValueError('cron rule \'{}\' does not have 5 fields'.format(rule))
+    minutes = sorted(_parse_cron_field(fields[0],0,59))
+    hours = sorted(_parse_cron_field(fields[1],0,23))
+    days = _parse_cron_field(fields[2],1,31)
+    months = _parse_cron_field(fields[3],1,12)
+    weekdays = _parse_cron_field(fields[4],0,7)
+    if 7 in weekdays:
+        weekdays.add(0)
+    # as in cron, a day matches either field if both are restricted
+    restrictDay = fields[2] != '*'
+    restrictWeekday = fields[4] != '*'
+
+    times = []
+    day = start_time.date()
+    while day <= end_time.date():
+        if day.month in months:
+            dayMatch = day.day in days
+            weekdayMatch = day.isoweekday()%7 in weekdays
+            if restrictDay and restrictWeekday:
+                match = dayMatch or weekdayMatch
+            else:
+                match = dayMatch and weekdayMatch
+            if match:
+                for h in hours:
+                    for m in minutes:
+                        t = datetime.datetime.combine(day,datetime.time(h,m),
+                                                      tzinfo=pytz.utc)
+                        if start_time <= t <= end_time:
+                            times.append(t)
+                            if len(times) > MAX_BULK_JOBS:
+                                raise ValueError('cron rule \'{}\' expands to more than {} jobs'.format(rule,MAX_BULK_JOBS))
+        day += datetime.timedelta(days=1)
+    return times
+
 class DateTimeTZ(sqlalchemy.TypeDecorator):
     """a DateTime object with utc time zone"""
     impl = sqlalchemy.DateTime
@@ -67,17 +163,8 @@ class QuietTime(Base):
     label = sqlalchemy.Column(sqlalchemy.String,primary_key=True)
     datetime = sqlalchemy.Column(DateTimeTZ(timezone=True))
     
-
-class DummyJob:
-    def __init__(self,job):
-        self.job = job
-        self.id = -1
-
-class PiccoloScheduledJob(Base):
-    """a scheduled job
-
-    a job will only get scheduled if it is in the future
-    """
+class ScheduledJobRecord(Base):
+    """database representation of a scheduled job"""
     
     __tablename__ = 'jobs'
 
@@ -90,12 +177,76 @@ class PiccoloScheduledJob(Base):
     ignoreQuietTime = sqlalchemy.Column(sqlalchemy.Boolean, default=False)
     status = sqlalchemy.Column(sqlalchemy.Enum(PiccoloSchedulerStatus),
                                default=PiccoloSchedulerStatus.active)
+    minSolarElevation = sqlalchemy.Column(sqlalchemy.Float, default=None)
+    version = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+
+class JobRunRecord(Base):
+    """database representation of a single run of a job"""
+
+    __tablename__ = 'job_runs'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    job_id = sqlalchemy.Column(sqlalchemy.Integer, index=True)
+    start_time = sqlalchemy.Column(DateTimeTZ(timezone=True), index=True)
+    duration = sqlalchemy.Column(sqlalchemy.Float)
+    nsequences = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    outcome = sqlalchemy.Column(sqlalchemy.String)
+    message = sqlalchemy.Column(sqlalchemy.String, default=None)
+
+    def tolist(self):
+        return [self.job_id,
+                self.start_time.isoformat(),
+                self.duration,
+                self.nsequences,
+                self.outcome,
+                self.message]
+
+class DummyJob:
+    def __init__(self,job):
+        self.job = job
+        self.id = -1
+
+class PiccoloScheduledJob:
+    """a scheduled job
+
+    a job will only get scheduled if it is in the future
+    """
+
+    COLUMNS = ['id','job','start_time','next_time','end_time','interval',
+               'ignoreQuietTime','status','minSolarElevation','version']
+
+    def __init__(self,id,job,start_time,next_time=None,end_time=None,
+                 interval=None,ignoreQuietTime=False,
+                 status=PiccoloSchedulerStatus.active,minSolarElevation=None,
+                 version=0):
+        self.id = id
+        self.job = job
+        self.start_time = start_time
+        if next_time is None:
+            next_time = start_time
+        self.next_time = next_time
+        self.end_time = end_time
+        self.interval = interval
+        self.ignoreQuietTime = bool(ignoreQuietTime)
+        self.status = status
+        self.minSolarElevation = minSolarElevation
+        # the version of the job table when the job was last changed
+        self.version = version
 
     def __repr__(self):
         return f'PiccoloScheduledJob(id={self.id}, job={self.job}, ' \
             'start_time={self.start_time!r}, next_time={self.next_time!r}, ' \
             'end_time={self.end_time!r}, interval={self.interval!r}, ' \
-            'ignoreQuietTime={self.ignoreQuietTime}, status={self.status})'
+            'ignoreQuietTime={self.ignoreQuietTime}, status={self.status}, ' \
+            'minSolarElevation={self.minSolarElevation})'
+
+    def as_dict(self):
+        """the job as a dictionary suitable for storing in the database"""
+        return dict((c,getattr(self,c)) for c in self.COLUMNS)
+
+    @property
+    def is_scheduled(self):
+        return self.status in [PiccoloSchedulerStatus.active,PiccoloSchedulerStatus.suspended]
 
     def check_done(self):
         changed = False
@@ -127,7 +278,12 @@ class PiccoloScheduledJob(Base):
             changed = True
         return changed
 
-    def tolist(self):
+    def tolist(self,extended=False):
+        """the job as served to clients
+
+        :param extended: append the minimum solar elevation, the list of
+                         jobs keeps its original six fields
+        """
         if self.end_time is not None:
             et = self.end_time.isoformat()
         else:
@@ -136,73 +292,383 @@ class PiccoloScheduledJob(Base):
             dt = self.interval.total_seconds()
         else:
             dt = None
-        return [
+        job = [
             self.id,
             self.job,
             self.start_time.isoformat(),
             et,
             dt,
             self.status.name]
+        if extended:
+            job.append(self.minSolarElevation)
+        return job
+
+class PiccoloSchedulerDB(PiccoloThread):
+    """thread persisting the scheduler state
+
+    The scheduler works on an in-memory copy of its settings and jobs. All
+    changes are queued and written to the database by this thread. Changes
+    arriving within the coalesce period are merged and committed in a single
+    transaction.
+    """
+
+    def __init__(self,db,coalesce=0.5,daemon=True):
+        """
+        :param db: the database URL
+        :param coalesce: time in seconds during which changes are collected
+                         before they are committed
+        """
+
+        super().__init__('scheduler_db',daemon=daemon)
+
+        kwargs = {}
+        if db in ['sqlite://','sqlite:///:memory:']:
+            # share the in-memory database between threads
+            kwargs['connect_args'] = {'check_same_thread':False}
+            kwargs['poolclass'] = StaticPool
+        self._engine = sqlalchemy.create_engine(db,**kwargs)
+        Base.metadata.create_all(self._engine)
+        self._upgrade()
+        self._Session = sessionmaker(bind=self._engine)
+
+        self._coalesce = coalesce
+        self._queue = Queue()
+        self._max_id = 0
+        # run records have no natural key
+        self._runKeys = itertools.count()
+        # serialise access to the database connection
+        self._lock = threading.Lock()
+
+    def _upgrade(self):
+        """add columns missing from tables created by older versions"""
+        inspector = sqlalchemy.inspect(self._engine)
+        for table in Base.metadata.sorted_tables:
+            existing = [c['name'] for c in inspector.get_columns(table.name)]
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                self.log.info('adding column {} to table {}'.format(column.name,table.name))
+                ctype = column.type.compile(dialect=self._engine.dialect)
+                with self._engine.begin() as conn:
+                    conn.execute(sqlalchemy.text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                        table.name,column.name,ctype)))
+
+    @property
+    def max_id(self):
+        """the largest job ID stored in the database"""
+        return self._max_id
+
+    def load(self):
+        """read the stored state
+
+        :return: tuple of settings, quiet times and scheduled jobs
+        """
+        session = self._Session()
+        try:
+            settings = {}
+            for s in session.query(Settings):
+                settings[s.key] = s.value
+            quietTimes = {}
+            for q in session.query(QuietTime):
+                quietTimes[q.label] = q.datetime
+            jobs = []
+            for j in session.query(ScheduledJobRecord).filter(
+                    ScheduledJobRecord.status.in_([PiccoloSchedulerStatus.active,
+                                                   PiccoloSchedulerStatus.suspended])).order_by(ScheduledJobRecord.id):
+                jobs.append(PiccoloScheduledJob(**dict(
+                    (c,getattr(j,c)) for c in PiccoloScheduledJob.COLUMNS)))
+            max_id = session.query(sqlalchemy.func.max(ScheduledJobRecord.id)).scalar()
+            if max_id is not None:
+                self._max_id = max_id
+        finally:
+            session.close()
+        return settings,quietTimes,jobs
+
+    def put_setting(self,key,value):
+        self._queue.put(('settings',key,{'key':key,'value':value}))
+    def put_quietTime(self,label,dt):
+        self._queue.put(('quiettime',label,{'label':label,'datetime':dt}))
+    def put_job(self,job):
+        self._queue.put(('jobs',job.id,job.as_dict()))
+    def put_jobs(self,jobs):
+        """queue a list of jobs which are written in a single transaction"""
+        self._queue.put(('batch',None,[('jobs',job.id,job.as_dict()) for job in jobs]))
+    def put_run(self,**values):
+        self._queue.put(('job_runs',next(self._runKeys),values))
+
+    def _filter_runs(self,query,job_id,start_time,end_time):
+        if job_id is not None:
+            query = query.filter(JobRunRecord.job_id == job_id)
+        if start_time is not None:
+            query = query.filter(JobRunRecord.start_time >= start_time)
+        if end_time is not None:
+            query = query.filter(JobRunRecord.start_time < end_time)
+        return query
+
+    def query_runs(self,job_id=None,start_time=None,end_time=None,limit=None):
+        """get the runs matching the criteria, most recent first"""
+        with self._lock:
+            session = self._Session()
+            try:
+                query = self._filter_runs(session.query(JobRunRecord),
+                                          job_id,start_time,end_time)
+                query = query.order_by(JobRunRecord.start_time.desc())
+                if limit is not None:
+                    query = query.limit(limit)
+                return [r.tolist() for r in query]
+            finally:
+                session.close()
+
+    def query_run_stats(self,job_id=None,start_time=None,end_time=None):
+        """compute the number of runs, success rate and mean duration per job"""
+        completed = sqlalchemy.cast(JobRunRecord.outcome == 'completed',sqlalchemy.Integer)
+        with self._lock:
+            session = self._Session()
+            try:
+                query = session.query(JobRunRecord.job_id,
+                                      sqlalchemy.func.count(JobRunRecord.id),
+                                      sqlalchemy.func.sum(completed),
+                                      sqlalchemy.func.avg(JobRunRecord.duration))
+                query = self._filter_runs(query,job_id,start_time,end_time)
+                stats = {}
+                for jid,n,ok,duration in query.group_by(JobRunRecord.job_id):
+                    stats[jid] = {'runs':n,
+                                  'success_rate':ok/n,
+                                  'mean_duration':duration}
+                return stats
+            finally:
+                session.close()
+
+    def flush(self,timeout=None):
+        """wait until all queued changes are written
+
+        :return: True if the changes were written within the timeout
+        """
+        if not self.is_alive():
+            return False
+        done = threading.Event()
+        self._queue.put(('flush',done))
+        return done.wait(timeout)
+
+    def stop(self,timeout=STOP_TIMEOUT):
+        """write outstanding changes and stop the thread
+
+        :param timeout: the maximum time in seconds to wait for the thread
+        :return: True if the thread stopped within the timeout
+        """
+        if not self.is_alive():
+            return True
+        self._queue.put(None)
+        self.join(timeout)
+        if self.is_alive():
+            self.log.error('scheduler database thread did not stop within {}s'.format(timeout))
+            return False
+        return True
+
+    def _commit(self,pending):
+        if len(pending) == 0:
+            return
+        with self._lock:
+            self._commit_locked(pending)
+
+    def _commit_locked(self,pending):
+        session = self._Session()
+        try:
+            for (table,key),values in pending.items():
+                if table == 'settings':
+                    session.merge(Settings(**values))
+                elif table == 'quiettime':
+                    session.merge(QuietTime(**values))
+                elif table == 'jobs':
+                    session.merge(ScheduledJobRecord(**values))
+                elif table == 'job_runs':
+                    session.add(JobRunRecord(**values))
+            session.commit()
+            self.log.debug('committed {} changes'.format(len(pending)))
+        except Exception as e:
+            session.rollback()
+            self.log.error('failed to write scheduler state: {}'.format(e))
+        finally:
+            session.close()
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            pending = OrderedDict()
+            flushed = []
+            stop = False
+            deadline = time.time()+self._coalesce
+            while True:
+                if item is None:
+                    stop = True
+                elif item[0] == 'flush':
+                    flushed.append(item[1])
+                elif item[0] == 'batch':
+                    for table,key,values in item[2]:
+                        pending[(table,key)] = values
+                else:
+                    # later changes to the same row replace earlier ones
+                    pending[(item[0],item[1])] = item[2]
+                if stop or len(flushed)>0:
+                    break
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except Empty:
+                    break
+            self._commit(pending)
+            for f in flushed:
+                f.set()
+            if stop:
+                self.log.info('stopped scheduler database thread')
+                return
 
 class PiccoloScheduler(PiccoloBaseComponent):
     """the piccolo scheduler holds the scheduled jobs"""
 
     NAME = "scheduler"
     
-    def __init__(self,db='sqlite:///:memory:'):
+    def __init__(self,db='sqlite:///:memory:',location=None):
+        """
+        :param db: the database URL
+        :param location: tuple of latitude and longitude of the instrument used
+                         for computing the position of the sun or None
+        """
 
         super().__init__()
-        
-        engine = sqlalchemy.create_engine(db)
-        Session = sessionmaker(bind=engine)
-        self._session = Session()
-        Base.metadata.create_all(engine)
+
+        self._location = None
+        if location is not None and None not in location:
+            self._location = (float(location[0]),float(location[1]))
+
+        # the database is only accessed by the writer thread, the scheduler
+        # works on an in-memory mirror of the settings and jobs
+        self._db = PiccoloSchedulerDB(db)
+        self._settings, self._quietTimes, jobs = self._db.load()
+        self._jobs = OrderedDict()
+        for job in jobs:
+            self._jobs[job.id] = job
+        self._next_id = self._db.max_id + 1
 
         self._loggedQuietTime = None
         self._powered_off = None
         self._powerOffTooShortWarning = False
 
-        self._quietTimeEnabled = self.session.query(Settings).filter(Settings.key == 'quiet_time_enabled').one_or_none()
-        if self._quietTimeEnabled is None:
-            self._quietTimeEnabled = Settings(key='quiet_time_enabled',value='False')
-            self.session.add(self._quietTimeEnabled)
+        for key,value in [('quiet_time_enabled','False'),
+                          ('power_off_enabled','False'),
+                          ('power_delay','600'),
+                          ('solar_quiet_time','False'),
+                          ('min_solar_elevation','0'),
+                          ('jobs_version','0')]:
+            if key not in self._settings:
+                self._set_setting(key,value)
         self._quietTimeEnabled_changed = None
-
-        self._powerOffEnabled = self.session.query(Settings).filter(Settings.key == 'power_off_enabled').one_or_none()
-        if self._powerOffEnabled is None:
-            self._powerOffEnabled = Settings(key='power_off_enabled',value='False')
-            self.session.add(self._powerOffEnabled)
         self._powerOffEnabled_changed = None
-
-        self._powerDelay = self.session.query(Settings).filter(Settings.key == 'power_delay').one_or_none()
-        if self._powerDelay is None:
-            self._powerDelay = Settings(key='power_delay',value='600')
-            self.session.add(self._powerDelay)
         self._powerDelay_changed = None
-        
-        self._quietStart = self.session.query(QuietTime).filter(QuietTime.label == 'start').one_or_none()
-        if self._quietStart is None:
-            self._quietStart = QuietTime(label='start',
-                                         datetime=datetime.datetime.combine(
-                                             self.now().date(),
-                                             self._parseTime('22:00:00'),
-                                             tzinfo=pytz.utc))
-            self.session.add(self._quietStart)
+        self._solarQuietTime_changed = None
+        self._minSolarElevation_changed = None
+
+        if 'start' not in self._quietTimes:
+            self._set_quietTime('start',datetime.datetime.combine(
+                self.now().date(),
+                self._parseTime('22:00:00'),
+                tzinfo=pytz.utc))
         self._quietStart_changed = None
 
-        self._quietEnd = self.session.query(QuietTime).filter(QuietTime.label == 'end').one_or_none()
-        if self._quietEnd is None:
-            self._quietEnd = QuietTime(label='end',
-                                       datetime=datetime.datetime.combine(
-                                           self._quietStart.datetime.date()+datetime.timedelta(days=1),
-                                           self._parseTime('04:00:00'),
-                                           tzinfo=pytz.utc))
-            self.session.add(self._quietEnd)
+        if 'end' not in self._quietTimes:
+            self._set_quietTime('end',datetime.datetime.combine(
+                self.quietStart.date()+datetime.timedelta(days=1),
+                self._parseTime('04:00:00'),
+                tzinfo=pytz.utc))
         self._quietEnd_changed = None
-        self.session.commit()
         self._update_quietTime()
 
         self._jobs_changed = None
+        self._jobsVersion_changed = None
+        # log of changes to the jobs, older changes are only available as a
+        # full list of jobs
+        self._jobsVersion = int(self._settings['jobs_version'])
+        self._jobsLog = deque(maxlen=JOBS_LOG_LENGTH)
+        self._jobsLogBase = self._jobsVersion
+
+        self._db.start()
+
+    def stop(self,timeout=STOP_TIMEOUT):
+        """write outstanding changes and stop the database thread
+
+        :return: True if all changes were written within the timeout
+        """
+        return self._db.stop(timeout=timeout)
+
+    def flush(self,timeout=None):
+        """wait until all changes are written to the database"""
+        return self._db.flush(timeout=timeout)
+
+    def record_run(self,job_id,start_time,duration,nsequences,outcome,message=None):
+        """record the outcome of running a job
+
+        :param job_id: the ID of the job, None if the run was not scheduled
+        :param start_time: the time the run started
+        :type start_time: datetime.datetime
+        :param duration: the duration of the run in seconds
+        :param nsequences: the number of sequences recorded
+        :param outcome: one of completed, aborted or failed
+        :param message: optional message, eg the error
+        """
+        if outcome not in RUN_OUTCOMES:
+            raise ValueError('unknown outcome {}'.format(outcome))
+        self._db.put_run(job_id=job_id,start_time=start_time,duration=duration,
+                         nsequences=nsequences,outcome=outcome,message=message)
+        if outcome == 'completed':
+            self.log.debug('job {} completed in {:.1f}s'.format(job_id,duration))
+        else:
+            self.log.warning('job {} {} after {:.1f}s: {}'.format(job_id,outcome,
+                                                                  duration,message))
+
+    @piccoloPUT(blocking=True)
+    def runs(self,job_id=None,start_time=None,end_time=None,limit=100):
+        """get the history of job runs, most recent first
+
+        :param job_id: only get runs of this job
+        :param start_time: only get runs that started after this time
+        :param end_time: only get runs that started before this time
+        :param limit: the maximum number of runs returned
+        :return: list of runs, each run is a list of job ID, start time,
+                 duration, number of sequences, outcome and message
+        """
+        if job_id is not None:
+            job_id = int(job_id)
+        if limit is not None:
+            limit = int(limit)
+        return self._db.query_runs(job_id=job_id,
+                                   start_time=self.parseDateTime(start_time),
+                                   end_time=self.parseDateTime(end_time),
+                                   limit=limit)
+
+    @piccoloPUT(blocking=True)
+    def run_stats(self,job_id=None,start_time=None,end_time=None):
+        """get the number of runs, success rate and mean duration per job
+
+        :param job_id: only get the statistics of this job
+        :param start_time: only consider runs that started after this time
+        :param end_time: only consider runs that started before this time
+        :return: dictionary mapping job IDs to statistics
+        """
+        if job_id is not None:
+            job_id = int(job_id)
+        return self._db.query_run_stats(job_id=job_id,
+                                        start_time=self.parseDateTime(start_time),
+                                        end_time=self.parseDateTime(end_time))
+
+    def _set_setting(self,key,value):
+        self._settings[key] = value
+        self._db.put_setting(key,value)
+
+    def _set_quietTime(self,label,dt):
+        self._quietTimes[label] = dt
+        self._db.put_quietTime(label,dt)
 
     @staticmethod
     def _parseTime(t):
@@ -219,9 +685,15 @@ class PiccoloScheduler(PiccoloBaseComponent):
     def now():
         return datetime.datetime.now(tz=pytz.utc)
 
-    @piccoloGET
+    @staticmethod
+    def parseDateTime(t):
+        if t is None or isinstance(t,datetime.datetime):
+            return t
+        return parser.parse(t)
+
+    @piccoloGET(cache='changed')
     def get_quietTimeEnabled(self):
-        if self._quietTimeEnabled.value == 'True':
+        if self._settings['quiet_time_enabled'] == 'True':
             return True
         else:
             return False
@@ -231,8 +703,7 @@ class PiccoloScheduler(PiccoloBaseComponent):
             e = str(e)
         if not e in ['True','False']:
             raise ValueError('unexpected value for quietTimeEnabled %s'%str(e))
-        self._quietTimeEnabled.value = e
-        self.session.commit()
+        self._set_setting('quiet_time_enabled',e)
         if self._quietTimeEnabled_changed is not None:
             self._quietTimeEnabled_changed()
     @piccoloChanged
@@ -242,9 +713,9 @@ class PiccoloScheduler(PiccoloBaseComponent):
     def quietTimeEnabled(self):
         return self.get_quietTimeEnabled()
         
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_powerOffEnabled(self):
-        if self._powerOffEnabled.value == 'True':
+        if self._settings['power_off_enabled'] == 'True':
             return True
         else:
             return False
@@ -254,8 +725,7 @@ class PiccoloScheduler(PiccoloBaseComponent):
             e = str(e)
         if not e in ['True','False']:
             raise ValueError('unexpected value for powerOffEnabled %s'%str(e))
-        self._powerOffEnabled.value = e
-        self.session.commit()
+        self._set_setting('power_off_enabled',e)
         if self._powerOffEnabled_changed is not None:
             self._powerOffEnabled_changed()
     @piccoloChanged
@@ -283,11 +753,10 @@ class PiccoloScheduler(PiccoloBaseComponent):
         return self.quietStart.strftime("%H:%M:%S%z")
     @piccoloPUT
     def set_quietStart(self,t):
-        self._quietStart.datetime = datetime.datetime.combine(
+        self._set_quietTime('start',datetime.datetime.combine(
             self.now().date(),
             self._parseTime(t),
-            tzinfo=pytz.utc)
-        self.session.commit()
+            tzinfo=pytz.utc))
         if self._quietStart_changed is not None:
             self._quietStart_changed()
     @piccoloChanged
@@ -295,7 +764,7 @@ class PiccoloScheduler(PiccoloBaseComponent):
         self._quietStart_changed = cb
     @property
     def quietStart(self):
-        qs = self._quietStart.datetime
+        qs = self._quietTimes['start']
         return qs
 
     @piccoloGET
@@ -309,8 +778,7 @@ class PiccoloScheduler(PiccoloBaseComponent):
             tzinfo=pytz.utc)
         if qe < self.quietStart:
             qe += datetime.timedelta(days=1)
-        self._quietEnd.datetime = qe
-        self.session.commit()
+        self._set_quietTime('end',qe)
         if self._quietEnd_changed is not None:
             self._quietEnd_changed()
     @piccoloChanged
@@ -318,26 +786,121 @@ class PiccoloScheduler(PiccoloBaseComponent):
         self._quietEnd_changed = cb
     @property
     def quietEnd(self):
-        qe = self._quietEnd.datetime
+        qe = self._quietTimes['end']
         return qe
 
-    def _update_quietTime(self):
+    def _update_quietTime(self,force=False):
         now = self.now()
+        if self.solarQuietTime and (force or self.quietEnd < now):
+            if self._update_solarQuietTime(now):
+                return
         if self.quietEnd < now:
             # compute number of days until next quiet end
             dt = datetime.timedelta(days=max(1, (now-self.quietEnd).days))
             self.log.info(f'updating quiet perioed by adding {dt}.')
-            self._quietStart.datetime += dt
-            self._quietEnd.datetime += dt
-            self.session.commit()
+            self._set_quietTime('start',self.quietStart+dt)
+            self._set_quietTime('end',self.quietEnd+dt)
             
+    def _update_solarQuietTime(self,now):
+        """set quiet time to the next period when the sun is below the
+        minimum elevation"""
+        end = now+datetime.timedelta(days=2)
+        windows = self.sun_windows(now-datetime.timedelta(days=1),end,
+                                   self.minSolarElevation)
+        for i in range(len(windows)-1):
+            qs = windows[i][1]
+            qe = windows[i+1][0]
+            if qe > now:
+                break
+        else:
+            if len(windows) == 0 or (end-windows[-1][1]).total_seconds() > 1:
+                # polar night, the sun stays below the elevation
+                self.log.warning('sun does not rise above {} degrees, using fixed quiet time'.format(self.minSolarElevation))
+            else:
+                self.log.warning('sun does not set below {} degrees, using fixed quiet time'.format(self.minSolarElevation))
+            return False
+        if qs != self.quietStart or qe != self.quietEnd:
+            self.log.info('solar quiet time from {} until {}'.format(qs,qe))
+            self._set_quietTime('start',qs)
+            self._set_quietTime('end',qe)
+            if self._quietStart_changed is not None:
+                self._quietStart_changed()
+            if self._quietEnd_changed is not None:
+                self._quietEnd_changed()
+        return True
+
+    @property
+    def location(self):
+        """the latitude and longitude of the instrument or None"""
+        return self._location
+    @piccoloGET(cache='static')
+    def get_location(self):
+        return self.location
+
+    def sun_windows(self,start_time,end_time,min_elevation):
+        """the periods during which the sun is above min_elevation"""
+        if self.location is None:
+            raise RuntimeError('location of instrument is not configured')
+        return sun_windows(start_time,end_time,self.location[0],self.location[1],
+                           min_elevation=min_elevation)
+
     @piccoloGET
+    def get_solarElevation(self):
+        """the current elevation of the sun in degrees"""
+        if self.location is None:
+            return None
+        return float(solar_elevation(self.now(),self.location[0],self.location[1])[0])
+
+    @piccoloGET(cache='changed')
+    def get_solarQuietTime(self):
+        if self._settings['solar_quiet_time'] == 'True':
+            return True
+        else:
+            return False
+    @piccoloPUT
+    def set_solarQuietTime(self,e):
+        if isinstance(e,bool):
+            e = str(e)
+        if not e in ['True','False']:
+            raise ValueError('unexpected value for solarQuietTime %s'%str(e))
+        if e == 'True' and self.location is None:
+            raise RuntimeError('location of instrument is not configured')
+        self._set_setting('solar_quiet_time',e)
+        self._update_quietTime(force=True)
+        if self._solarQuietTime_changed is not None:
+            self._solarQuietTime_changed()
+    @piccoloChanged
+    def callback_solarQuietTime(self,cb):
+        self._solarQuietTime_changed = cb
+    @property
+    def solarQuietTime(self):
+        return self.location is not None and self.get_solarQuietTime()
+
+    @piccoloGET(cache='changed')
+    def get_minSolarElevation(self):
+        return self.minSolarElevation
+    @piccoloPUT
+    def set_minSolarElevation(self,elevation):
+        elevation = float(elevation)
+        if elevation < -18 or elevation > 90:
+            raise ValueError('minimum solar elevation must be >=-18 and <=90')
+        self._set_setting('min_solar_elevation',str(elevation))
+        self._update_quietTime(force=True)
+        if self._minSolarElevation_changed is not None:
+            self._minSolarElevation_changed()
+    @piccoloChanged
+    def callback_minSolarElevation(self,cb):
+        self._minSolarElevation_changed = cb
+    @property
+    def minSolarElevation(self):
+        return float(self._settings['min_solar_elevation'])
+
+    @piccoloGET(cache='changed')
     def get_powerDelay(self):
         return self.powerDelay
     @piccoloPUT
     def set_powerDelay(self,delay):
-        self._powerDelay.value = str(delay)
-        self.session.commit()
+        self._set_setting('power_delay',str(delay))
         if self._powerDelay_changed is not None:
             self._powerDelay_changed()
     @piccoloChanged
@@ -345,7 +908,7 @@ class PiccoloScheduler(PiccoloBaseComponent):
         self._powerDelay_changed = cb
     @property
     def powerDelay(self):
-        return int(self._powerDelay.value)
+        return int(self._settings['power_delay'])
     @property
     def powerOffTime(self):
         return self.quietStart + datetime.timedelta(seconds=self.powerDelay)
@@ -353,42 +916,90 @@ class PiccoloScheduler(PiccoloBaseComponent):
     def powerOnTime(self):
         return self.quietEnd - datetime.timedelta(seconds=self.powerDelay)
 
-    @piccoloGET
+    def _scheduled_jobs(self):
+        return [job for job in self._jobs.values() if job.is_scheduled]
+
+    @piccoloGET(snapshot=False,stream=True)
     def get_jobs(self):
-        jobs = []
-        for job in self.session.query(PiccoloScheduledJob).filter(PiccoloScheduledJob.status.in_([PiccoloSchedulerStatus.active,PiccoloSchedulerStatus.suspended])):
-            jobs.append(job.tolist())
-        return jobs
-    @piccoloChanged
+        return streamed_list(job.tolist() for job in self._scheduled_jobs())
+    @piccoloChanged(min_interval=1.)
     def callback_jobs(self,cb):
         self._jobs_changed = cb
 
+    @piccoloGET(cache='changed')
+    def get_jobs_version(self):
+        """the version of the job table"""
+        return self._jobsVersion
+    @piccoloChanged(min_interval=1.)
+    def callback_jobs_version(self,cb):
+        self._jobsVersion_changed = cb
+
+    @piccoloPUT(path='jobs_since')
+    def get_jobs_since(self,version):
+        """get the jobs that changed since version
+
+        :param version: the version of the job table known to the client
+        :return: dictionary containing the current version, whether the list
+                 of jobs is complete (full) and the list of jobs; if full is
+                 False the list only contains jobs that changed, including
+                 those that are done or deleted. Unlike the jobs resource
+                 each job also contains the minimum solar elevation
+        """
+        version = int(version)
+        if version == self._jobsVersion:
+            return {'version':self._jobsVersion,'full':False,'jobs':[]}
+        if version < self._jobsLogBase or version > self._jobsVersion:
+            jobs = [job.tolist(extended=True) for job in self._scheduled_jobs()]
+            return {'version':self._jobsVersion,'full':True,'jobs':jobs}
+        jobs = OrderedDict()
+        for v,job in self._jobsLog:
+            if v > version:
+                jobs[job[0]] = job
+        return {'version':self._jobsVersion,'full':False,'jobs':list(jobs.values())}
+
+    def _jobs_modified(self,jobs):
+        """bump the version of the job table and notify observers"""
+        self._jobsVersion += 1
+        self._set_setting('jobs_version',str(self._jobsVersion))
+        for job in jobs:
+            job.version = self._jobsVersion
+            if len(self._jobsLog) == self._jobsLog.maxlen:
+                self._jobsLogBase = self._jobsLog[0][0]
+            self._jobsLog.append((self._jobsVersion,job.tolist(extended=True)))
+        if self._jobs_changed is not None:
+            self._jobs_changed()
+        if self._jobsVersion_changed is not None:
+            self._jobsVersion_changed()
+
+    def _store_job(self,job):
+        """persist job and drop it from the mirror once it is finished"""
+        self._db.put_job(job)
+        if not job.is_scheduled and job.id in self._jobs:
+            del self._jobs[job.id]
+
     @piccoloPUT
     def suspend(self,jid):
         job = self.get_job(jid)
         if job is not None and job.suspend():
-            self.session.commit()
+            self._jobs_modified([job])
+            self._store_job(job)
             self.log.info('suspended schedule {}'.format(jid))
-            if self._jobs_changed is not None:
-                self._jobs_changed()
         
     @piccoloPUT
     def unsuspend(self,jid):
         job = self.get_job(jid)
         if job is not None and job.unsuspend():
-            self.session.commit()
+            self._jobs_modified([job])
+            self._store_job(job)
             self.log.info('unsuspended schedule {}'.format(jid))
-            if self._jobs_changed is not None:
-                self._jobs_changed()
                 
     @piccoloPUT
     def delete(self,jid):
         job = self.get_job(jid)
         if job is not None and job.delete():
-            self.session.commit()
+            self._jobs_modified([job])
+            self._store_job(job)
             self.log.info('deleted schedule {}'.format(jid))
-            if self._jobs_changed is not None:
-                self._jobs_changed()
 
     def _inTime(self,ttype='quiet'):
         inTime = False
@@ -414,8 +1025,51 @@ class PiccoloScheduler(PiccoloBaseComponent):
     def inPowerOffTime(self):
         return self._inTime(ttype='power_off')
         
+    def _new_job(self,start_time,job,interval=None,end_time=None,
+                 ignoreQuietTime=False,minSolarElevation=None):
+        """parse the job parameters and create a new job
+
+        :return: the new job or None if the job would never run
+        """
+        now = self.now()
+
+        start_time = self.parseDateTime(start_time)
+        end_time = self.parseDateTime(end_time)
+        if not (interval is None or isinstance(interval,datetime.timedelta)):
+            interval = datetime.timedelta(seconds=float(interval))
+        for t in [start_time,end_time]:
+            if t is not None and t.tzinfo is None:
+                raise ValueError('time {} has no timezone'.format(t))
+        if interval is not None and interval.total_seconds() <= 0:
+            raise ValueError('interval must be positive')
+        if not job:
+            raise ValueError('no job given')
+        if minSolarElevation is not None:
+            minSolarElevation = float(minSolarElevation)
+            if self.location is None:
+                raise ValueError('location of instrument is not configured')
+        
+        if interval is None and start_time < now:
+            return
+        if end_time is not None and  end_time < now:
+            return
+            
+        return PiccoloScheduledJob(None,
+                                   job=job,
+                                   start_time=start_time,
+                                   next_time=start_time,
+                                   interval=interval,
+                                   end_time=end_time,
+                                   ignoreQuietTime = ignoreQuietTime,
+                                   minSolarElevation = minSolarElevation)
+
+    def _register_job(self,new_job):
+        new_job.id = self._next_id
+        self._next_id += 1
+        self._jobs[new_job.id] = new_job
+
     def add(self,start_time,job,interval=None,end_time=None,
-            ignoreQuietTime=False):
+            ignoreQuietTime=False,minSolarElevation=None):
         """add a new job
 
         :param start_time: the time at which the job should run
@@ -428,29 +1082,19 @@ class PiccoloScheduler(PiccoloBaseComponent):
         :param ignoreQuietTime: whether job should be scheduled irrespective 
                                 of quiet time (default False)
         :type ignoreQuietTime: bool
+        :param minSolarElevation: only run job when the sun is above this
+                                  elevation in degrees, ignored if None
         """
-        now = self.now()
 
-        if not isinstance(start_time, datetime.datetime):
-            start_time = parser.parse(start_time)
-        if not (end_time is None or isinstance(end_time, datetime.datetime)):
-            end_time = parser.parse(end_time)
-        if not (interval is None or isinstance(interval,datetime.timedelta)):
-            interval = datetime.timedelta(seconds=float(interval))
-        
-        if interval is None and start_time < now:
+        new_job = self._new_job(start_time,job,interval=interval,
+                                end_time=end_time,
+                                ignoreQuietTime=ignoreQuietTime,
+                                minSolarElevation=minSolarElevation)
+        if new_job is None:
             return
-        if end_time is not None and  end_time < now:
-            return
-            
-        new_job = PiccoloScheduledJob(job=job,
-                                      start_time=start_time,
-                                      next_time=start_time,
-                                      interval=interval,
-                                      end_time=end_time,
-                                      ignoreQuietTime = ignoreQuietTime)
-        self.session.add(new_job)
-        self.session.commit()
+        self._register_job(new_job)
+        self._jobs_modified([new_job])
+        self._db.put_job(new_job)
 
         if len(job)>1:
             job_str = '{}{}'.format(job[0],str(job[1]))
@@ -458,21 +1102,53 @@ class PiccoloScheduler(PiccoloBaseComponent):
             job_str = '{}()'.format(job[0])
 
         lstring = 'scheduled job {}: running {} at {}'.format(
-            new_job.id,job_str,str(start_time))
-        if end_time is not None:
-            lstring += ' every {} until {}'.format(interval,str(end_time))
+            new_job.id,job_str,str(new_job.start_time))
+        if new_job.end_time is not None:
+            lstring += ' every {} until {}'.format(new_job.interval,str(new_job.end_time))
         
         self.log.info(lstring)
-        if self._jobs_changed is not None:
-            self._jobs_changed()
         return new_job
 
-    @property
-    def session(self):
-        return self._session
+    def add_jobs(self,jobs):
+        """add a list of jobs
+
+        All jobs are validated before any of them is scheduled. The jobs are
+        stored in a single transaction and observers are notified once.
+
+        :param jobs: list of dictionaries containing the arguments of the add
+                     method
+        :return: the list of new jobs
+        """
+
+        if len(jobs) > MAX_BULK_JOBS:
+            raise ValueError('too many jobs {}>{}'.format(len(jobs),MAX_BULK_JOBS))
+        new_jobs = []
+        for i,j in enumerate(jobs):
+            try:
+                new_job = self._new_job(**j)
+            except Exception as e:
+                raise ValueError('job {}: {}'.format(i,e))
+            if new_job is not None:
+                new_jobs.append(new_job)
+
+        if len(new_jobs) == 0:
+            return new_jobs
+        for new_job in new_jobs:
+            self._register_job(new_job)
+        self._jobs_modified(new_jobs)
+        self._db.put_jobs(new_jobs)
+
+        self.log.info('scheduled {} jobs {}-{}'.format(len(new_jobs),
+                                                       new_jobs[0].id,
+                                                       new_jobs[-1].id))
+        return new_jobs
 
     def get_job(self,jid):
-        return self.session.query(PiccoloScheduledJob).filter(PiccoloScheduledJob.id == jid).one_or_none()
+        try:
+            jid = int(jid)
+        except (TypeError,ValueError):
+            return None
+        return self._jobs.get(jid)
     
     @property
     def runable_jobs(self):
@@ -499,14 +1175,21 @@ class PiccoloScheduler(PiccoloBaseComponent):
         self._update_quietTime()
 
         # loop over active/suspended jobs
-        for job in self.session.query(PiccoloScheduledJob).filter(
-                PiccoloScheduledJob.next_time < self.now(),
-                PiccoloScheduledJob.status.in_([PiccoloSchedulerStatus.active,PiccoloSchedulerStatus.suspended])):
+        now = self.now()
+        solarElevation = None
+        for job in [j for j in self._jobs.values() if j.next_time < now and j.is_scheduled]:
             now = self.now()
+            status = job.status
             runJob = False
             if job.status == PiccoloSchedulerStatus.active:
                 if job.ignoreQuietTime or not inQuietTime:
                     runJob = True
+                if runJob and job.minSolarElevation is not None and self.location is not None:
+                    if solarElevation is None:
+                        solarElevation = self.get_solarElevation()
+                    if solarElevation < job.minSolarElevation:
+                        self.log.info('job {0}: sun is below {1} degrees'.format(job.id,job.minSolarElevation))
+                        runJob = False
 
             # check if we missed some record times
             if job.interval is not None:
@@ -531,9 +1214,10 @@ class PiccoloScheduler(PiccoloBaseComponent):
                 # one off job
                 job.status = PiccoloSchedulerStatus.done
 
-            if self._jobs_changed is not None:
-                self._jobs_changed()
-            self.session.commit()
+            # only the status change is visible to observers
+            if job.status != status:
+                self._jobs_modified([job])
+            self._store_job(job)
 
             if runJob:
                 self.log.info("running scheduled job {0}".format(job.id))
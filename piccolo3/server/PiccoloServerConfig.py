@@ -70,6 +70,21 @@ mntpnt = string(default=/mnt)
 address = string(default="::")
 # The port to listen on. By default use the CoAP port 5683
 port = integer(default=5683)
+
+[startup]
+# the CoAP endpoint is bound before the hardware is initialised
+# maximum time in seconds until the CoAP endpoint is bound
+bind_budget = float(default=5.)
+# maximum time in seconds until all components are loaded
+ready_budget = float(default=60.)
+
+[trace]
+# requests taking longer than slow_threshold seconds are logged as slow
+slow_threshold = float(default=0.5)
+# the number of slow requests kept in memory
+slow_history = integer(default=100)
+# also write slow requests to slow_log if set
+slow_log = string(default=None)
 """
 
 # populate the default server config object which is used as a validator
@@ -20,11 +20,19 @@
 
 """
 
-__all__ = ['PiccoloShutters']
+__all__ = ['PiccoloShutters','PiccoloShutterState']
 
 from .PiccoloComponent import PiccoloBaseComponent, PiccoloNamedComponent, piccoloGET, piccoloPUT
+from .PiccoloWorkerThreads import PiccoloThread
+from .PiccoloActuationLog import PiccoloActuationLog
 import threading
+import heapq
+import itertools
+import enum
 import time
+import os.path
+import datetime
+import pytz
 
 try:
     from .PiccoloHardware import piccoloShutters
@@ -32,58 +40,185 @@ try:
 except:
     HAVE_SHUTTERS = False
 
-def shutter(shutter,milliseconds):
-    """worker function used to open the shutter for the set period
-
-    :param shutter: the shutter instance to operate on
-    :type shutter: PiccoloShutter
-    :param milliseconds: time to leave shutter open in milliseconds"""
-    assert isinstance(shutter,PiccoloShutter)
-    
-    result = shutter.openShutter()
-    if result!='ok':
-        return result
-    time.sleep(milliseconds/1000.)
-    result = shutter.closeShutter()
-    return result
-    
+# time in seconds the shutters are held open during the startup self-test
+SELF_TEST_DURATION = 1.
+# the number of actuations returned by the actuation_log resource
+ACTUATION_LOG_ENTRIES = 100
+# time in seconds between saving the open time of an open shutter
+OPEN_TIME_CHECKPOINT = 10.
+
+class PiccoloShutterState(enum.IntEnum):
+    CLOSED = 0
+    OPENING = 1
+    OPEN = 2
+    CLOSING = 3
+
+class PiccoloShutterActuator(PiccoloThread):
+    """thread operating the shutters
+
+    Actions are callables run by the thread at the time they are due. All
+    shutters share a single actuator so that the hardware is only ever
+    driven by one thread.
+    """
+
+    def __init__(self,daemon=True):
+        super().__init__('shutter_actuator',daemon=daemon)
+
+        self._actions = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def schedule(self,action,delay=0.):
+        """run action after delay seconds"""
+        with self._cond:
+            heapq.heappush(self._actions,(time.monotonic()+delay,next(self._counter),action))
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if len(self._actions)>0:
+                        wait = self._actions[0][0]-time.monotonic()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._cond.wait(wait)
+                due,n,action = heapq.heappop(self._actions)
+            try:
+                action()
+            except Exception as e:
+                self.log.error('shutter action failed: {}'.format(e))
 
 class PiccoloShutter(PiccoloNamedComponent):
-    """class used to control a shutter"""
+    """class used to control a shutter
+
+    Opening and closing a shutter only requests the transition which is
+    carried out by the actuator thread. The shutter is opening or closing
+    until the hardware has been switched and the settle time has passed.
+    """
 
     NAME = "shutter"
     
-    def __init__(self,name,shutter=None,reverse=False,fibreDiameter=600.):
+    def __init__(self,name,shutter=None,reverse=False,fibreDiameter=600.,
+                 settle_time=0.05,actuator=None,actuation_log=None):
         """
         :param name: name of the component
         :param shutter: the shutter object, if None use dummy
         :param reverse: reverse the polarity of the shutter
         :param fibreDiameter: the diameter of the fibre, used for info
+        :param settle_time: time in seconds the shutter takes to settle
+                            after being switched
+        :param actuator: the thread operating the shutter, a new one is
+                         started if None
+        :param actuation_log: the log recording the actuations or None
         """
 
         super().__init__(name)
 
-        self._lock = threading.Lock()
-        
+        self._cond = threading.Condition()
+        self._state = PiccoloShutterState.CLOSED
+        # set while the hardware has not been switched yet
+        self._pending = False
+        # whether the hardware was last switched to open
+        self._hwOpen = False
+        self._settled = 0.
+        # incremented on every transition requested
+        self._generation = 0
+
+        self._actuations = actuation_log
+        if self._actuations is not None:
+            if self._actuations.accounted is not None:
+                # the server stopped while the shutter was open, the open
+                # time was saved up to the last checkpoint
+                self._actuations.account(self._actuations.accounted,closed=True)
+            self._nopen = self._actuations.nopen
+            self._nclose = self._actuations.nclose
+            self._openTime = self._actuations.open_time
+        else:
+            self._nopen = 0
+            self._nclose = 0
+            self._openTime = 0.
+        self._lastActuation = None
+        # the time the hardware was last opened
+        self._openedAt = None
+
         self._fibre = float(fibreDiameter)
         self._reverse = reverse
+        self._settle_time = settle_time
+
+        if actuator is None:
+            actuator = PiccoloShutterActuator()
+            actuator.start()
+        self._actuator = actuator
 
         self._shutter = shutter
-        if self._shutter!=None:
-            self.openShutter()
-            time.sleep(1)
-            self.closeShutter()
 
-    @piccoloGET
+    @property
+    def has_hardware(self):
+        return self._shutter is not None
+
+    @property
+    def state(self):
+        """the state of the shutter"""
+        with self._cond:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        if self._pending or time.monotonic() < self._settled:
+            return
+        if self._state == PiccoloShutterState.OPENING:
+            self._state = PiccoloShutterState.OPEN
+        elif self._state == PiccoloShutterState.CLOSING:
+            self._state = PiccoloShutterState.CLOSED
+
+    @piccoloGET(cache='static')
     def get_reverse(self):
         """whether polarity is reversed"""
         return self._reverse
 
-    @piccoloGET
+    @piccoloGET(cache='static')
     def get_fibre_diameter(self):
         """the diameter of the optical fibre"""
         return self._fibre
 
+    @piccoloGET(cache='static')
+    def get_settle_time(self):
+        """the time in seconds the shutter takes to settle"""
+        return self._settle_time
+
+    @piccoloGET
+    def get_counters(self):
+        """the number of times the shutter was opened and closed, the total
+        time in seconds it was open and the time of the last actuation"""
+        with self._cond:
+            last = self._lastActuation
+            if last is not None:
+                last = last.isoformat()
+            openTime = self._openTime
+            if self._openedAt is not None:
+                openTime += time.time()-self._openedAt
+            return {'opened':self._nopen,
+                    'closed':self._nclose,
+                    'open_time':openTime,
+                    'last_actuation':last}
+
+    @piccoloGET(snapshot=False)
+    def get_actuation_log(self):
+        """the most recent actuations"""
+        if self._actuations is None:
+            return []
+        log = []
+        for t,opened,duration in self._actuations.entries(ACTUATION_LOG_ENTRIES):
+            e = {'time':datetime.datetime.fromtimestamp(t,tz=pytz.utc).isoformat(),
+                 'action':'open' if opened else 'close'}
+            if not opened:
+                e['duration'] = duration
+            log.append(e)
+        return log
+
     @piccoloPUT
     def set_open_shutter(self,sopen=True):
         """open shutter"""
@@ -98,30 +233,103 @@ class PiccoloShutter(PiccoloNamedComponent):
     def set_close_shutter(self,sclose=True):
         """close shutter"""
         self.set_open_shutter(not sclose)        
-    
-    def openShutter(self):
-        """open the shutter"""
 
-        if self._lock.locked():
-            self.log.warn('shutter already open')
-            return 'shutter already open'
-        self._lock.acquire()
-        self.log.info('open shutter')
-        if self._shutter!=None:
-            self._shutter.open()
+    def _request(self,state):
+        with self._cond:
+            self._update_state()
+            if state == PiccoloShutterState.OPENING and \
+               self._state in [PiccoloShutterState.OPEN,PiccoloShutterState.OPENING]:
+                self.log.warn('shutter already open')
+                return 'shutter already open'
+            if state == PiccoloShutterState.CLOSING and \
+               self._state in [PiccoloShutterState.CLOSED,PiccoloShutterState.CLOSING]:
+                self.log.info('shutter already closed')
+                return 'shutter already closed'
+            self._state = state
+            self._generation += 1
+            if self._pending and (state == PiccoloShutterState.OPENING) == self._hwOpen:
+                # the hardware is already in the requested state, drop the
+                # pending actuation
+                self._pending = False
+                self._cond.notify_all()
+                return 'ok'
+            self._pending = True
+        self._actuator.schedule(self._actuate)
         return 'ok'
+
+    def _actuate(self):
+        """switch the hardware, called by the actuator thread"""
+        with self._cond:
+            if not self._pending:
+                # already carried out or dropped
+                return
+            opening = self._state == PiccoloShutterState.OPENING
+            self._hwOpen = opening
+        if self._shutter is not None:
+            if opening:
+                self._shutter.open()
+            else:
+                self._shutter.close()
+        t = time.time()
+        with self._cond:
+            duration = 0.
+            if opening:
+                self._nopen += 1
+                self._openedAt = t
+            else:
+                self._nclose += 1
+                if self._openedAt is not None:
+                    duration = t-self._openedAt
+                    self._openTime += duration
+                self._openedAt = None
+            self._lastActuation = datetime.datetime.fromtimestamp(t,tz=pytz.utc)
+        if self._actuations is not None:
+            self._actuations.record(t,opening,duration)
+            if opening:
+                self._actuator.schedule(lambda: self._checkpoint(t),delay=OPEN_TIME_CHECKPOINT)
+        with self._cond:
+            # the state may have been changed again in the meantime
+            if opening != (self._state == PiccoloShutterState.OPENING):
+                return
+            self._settled = time.monotonic() + self._settle_time
+            self._pending = False
+            self._cond.notify_all()
+        self.log.info('opened shutter' if opening else 'closed shutter')
+
+    def _checkpoint(self,openedAt):
+        """save the open time so that it survives a restart of the server"""
+        with self._cond:
+            if self._openedAt != openedAt:
+                # the shutter was closed in the meantime
+                return
+        self._actuations.account(time.time())
+        self._actuator.schedule(lambda: self._checkpoint(openedAt),delay=OPEN_TIME_CHECKPOINT)
+
+    def openShutter(self):
+        """open the shutter"""
+        return self._request(PiccoloShutterState.OPENING)
         
     def closeShutter(self):
         """close the shutter"""
-        
-        if not self._lock.locked():
-            self.log.info('shutter already closed')
-            return 'shutter already closed'
-        if self._shutter!=None:
-            self._shutter.close()
-        self._lock.release()
-        self.log.info('closed shutter')
-        return 'ok'
+        return self._request(PiccoloShutterState.CLOSING)
+
+    def wait_settled(self,timeout=None):
+        """wait until the shutter is open or closed
+
+        :param timeout: maximum time in seconds to wait
+        :return: True if the shutter settled
+        """
+        if timeout is not None:
+            end = time.monotonic()+timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._pending,timeout):
+                return False
+            wait = self._settled - time.monotonic()
+        if timeout is not None:
+            wait = min(wait,end-time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+        return self.state in [PiccoloShutterState.OPEN,PiccoloShutterState.CLOSED]
 
     def open_close(self,milliseconds=1000):
         """open the shutter for a set period
@@ -130,20 +338,28 @@ class PiccoloShutter(PiccoloNamedComponent):
 
         self.log.info('opening the shutter for {0} milliseconds'.format(milliseconds))
 
-        t = threading.Thread(target = shutter, args = (self,milliseconds),name=self.name)
-        t.daemon=True
-        t.start()
+        result = self.openShutter()
+        if result == 'ok':
+            with self._cond:
+                generation = self._generation
+            self._actuator.schedule(lambda: self._delayed_close(generation),
+                                    delay=milliseconds/1000.+self._settle_time)
+        return result
+
+    def _delayed_close(self,generation):
+        # do not close the shutter if it was operated in the meantime
+        with self._cond:
+            if generation != self._generation:
+                return
+        self.closeShutter()
 
     @piccoloGET    
     def status(self):
         """return status of shutter
 
-        :return: *open* if the shutter is open or *closed* if it is closed"""
+        :return: *open*, *closed*, *opening* or *closing*"""
 
-        if self._lock.locked():
-            return 'open'
-        else:
-            return 'closed'
+        return self.state.name.lower()
 
 
 class PiccoloShutters(PiccoloBaseComponent):
@@ -151,10 +367,17 @@ class PiccoloShutters(PiccoloBaseComponent):
     
     NAME = "shutter"
 
-    def __init__(self,shutter_cfg):
+    def __init__(self,shutter_cfg,logdir=None):
+        """
+        :param shutter_cfg: the shutter configuration
+        :param logdir: directory holding the shutter actuation logs, no
+                       logs are kept if None
+        """
         super().__init__()
 
         self._shutters = {}
+        self._actuator = PiccoloShutterActuator()
+        self._actuator.start()
         ok = True
         for c in shutter_cfg:
             parsed = c.startswith('shutter_')
@@ -181,24 +404,55 @@ class PiccoloShutters(PiccoloBaseComponent):
             d = shutter_cfg[c]['direction']
             self.shutters[d] = PiccoloShutter(d, shutter=shutter,
                                               reverse=shutter_cfg[c]['reverse'],
-                                              fibreDiameter=shutter_cfg[c]['fibreDiameter'])
+                                              fibreDiameter=shutter_cfg[c]['fibreDiameter'],
+                                              settle_time=shutter_cfg[c].get('settle_time',0.05),
+                                              actuator=self._actuator,
+                                              actuation_log=self._actuation_log(logdir,d))
 
         if not ok:
             raise RuntimeError('failed to initialise shutters')
 
+        # exercise all shutters at the same time
+        for s in self.shutters:
+            if self.shutters[s].has_hardware:
+                self.shutters[s].open_close(SELF_TEST_DURATION*1000.)
+
         for s in self.shutters:
             self.coapResources.add_resource([s],self.shutters[s].coapResources)
 
+    def _actuation_log(self,logdir,name):
+        if logdir is None:
+            return
+        fname = os.path.join(logdir,'shutter_{}.actuations'.format(name))
+        try:
+            return PiccoloActuationLog(fname)
+        except Exception as e:
+            self.log.error('cannot open actuation log {}: {}'.format(fname,e))
+
     @property
     def shutters(self):
         return self._shutters
         
-    @piccoloGET#(has_subs=True)
+    @piccoloGET(cache='static')#(has_subs=True)
     def get_shutters(self):
         shutters = list(self.shutters.keys())
         shutters.sort()
         return shutters
 
+    def wait_settled(self,timeout=1.):
+        """wait until all shutters are open or closed
+
+        :param timeout: maximum time in seconds to wait
+        :return: True if all shutters settled
+        """
+        end = time.monotonic()+timeout
+        ok = True
+        for s in self.shutters:
+            if not self.shutters[s].wait_settled(max(0.,end-time.monotonic())):
+                self.log.warning('shutter {} did not settle'.format(s))
+                ok = False
+        return ok
+
     # implement methods so object can act as a read-only dictionary
     def keys(self):
         return self.get_shutters()
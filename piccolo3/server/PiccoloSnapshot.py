@@ -0,0 +1,266 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+aggregate the state of all components in a single resource
+
+The CoAP site is walked and the GET method of every piccolo resource that
+has not been excluded from snapshots using the snapshot option of
+piccoloGET is called. The results are collected in a dictionary keyed by
+the resource path.
+
+The snapshot is refreshed when it is requested and is out of date, ie a
+resource reported a change or the snapshot is older than the refresh
+interval. While the snapshot is observed it is refreshed as soon as a
+resource changes and at least once per interval.
+"""
+
+__all__ = ['PiccoloSnapshot']
+
+from .PiccoloComponent import PiccoloBaseComponent, PiccoloResource, piccoloGET, piccoloPUT, piccoloChanged, \
+    add_change_listener
+import aiocoap.resource as resource
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from pytz import utc
+
+# the maximum age in seconds of the snapshot, resources that do not report
+# changes are picked up within this time
+SNAPSHOT_INTERVAL = 2.
+# the number of snapshots kept for computing deltas
+SNAPSHOT_HISTORY = 32
+
+def _walk(site,prefix=()):
+    """iterate over the paths and resources of a site"""
+    for path,r in list(site._resources.items()):
+        yield prefix+path,r
+    for path,r in list(site._subsites.items()):
+        if isinstance(r,resource.Site):
+            yield from _walk(r,prefix+path)
+        else:
+            yield prefix+path,r
+
+def _snapshot_option(r):
+    """the snapshot option of a resource, False if it is not part of
+    snapshots"""
+    if not isinstance(r,PiccoloResource) or 'GET' not in r._spec:
+        return False
+    return r._spec['GET'][1].get('snapshot',True)
+
+def _delta(old,new):
+    """the entries of new that differ from old, removed entries are None"""
+    delta = {}
+    for k in new:
+        if k not in old or old[k] != new[k]:
+            delta[k] = new[k]
+    for k in old:
+        if k not in new:
+            delta[k] = None
+    return delta
+
+class PiccoloSnapshot(PiccoloBaseComponent):
+    """versioned snapshot of the state of the piccolo server"""
+
+    NAME = 'snapshot'
+
+    def __init__(self,root,interval=SNAPSHOT_INTERVAL):
+        """
+        :param root: the root CoAP site
+        :param interval: the maximum age in seconds of the snapshot
+        """
+        super().__init__()
+
+        self._root = root
+        self._interval = interval
+
+        self._version = 0
+        self._time = None
+        self._state = {}
+        self._delta = {}
+        self._history = deque(maxlen=SNAPSHOT_HISTORY)
+
+        self._state_changed = None
+        self._delta_changed = None
+
+        # a resource changed since the snapshot was collected
+        self._stale = True
+        self._refreshed = None
+        self._refreshTask = None
+        # the number of observers of each resource of the snapshot
+        self._observers = {}
+        self._updateTask = None
+
+        self._loop = asyncio.get_event_loop()
+        add_change_listener(self._changed)
+
+    def collect(self):
+        """call the GET methods of all resources
+
+        :return: dictionary mapping resource paths to results
+        """
+        state = {}
+        for path,r in _walk(self._root):
+            snapshot = _snapshot_option(r)
+            if snapshot is False or r._component is self:
+                continue
+            name,kwargs = r._spec['GET']
+            get = getattr(r._component,name)
+            if kwargs.get('parse_path',False):
+                # the component provides the list of path arguments
+                if not isinstance(snapshot,str):
+                    continue
+                calls = [(path+(a,),(a,)) for a in getattr(r._component,snapshot)]
+            else:
+                calls = [(path,())]
+            for p,args in calls:
+                try:
+                    if asyncio.iscoroutinefunction(get):
+                        # collect runs in an executor, hand coroutines to the loop
+                        value = asyncio.run_coroutine_threadsafe(get(*args),self._loop).result()
+                    else:
+                        value = get(*args)
+                    state['/'.join(p)] = value
+                except Exception as e:
+                    self.log.debug('snapshot of {} failed: {}'.format('/'.join(p),e))
+        return state
+
+    async def refresh(self):
+        """collect the state and update the version if it changed"""
+        loop = asyncio.get_event_loop()
+        self._stale = False
+        self._refreshed = time.monotonic()
+        state = await loop.run_in_executor(None,self.collect)
+        self._time = datetime.now(tz=utc).isoformat()
+        if self._version > 0 and state == self._state:
+            return
+        self._delta = _delta(self._state,state)
+        self._version += 1
+        self._state = state
+        self._history.append((self._version,state))
+        for cb in [self._state_changed,self._delta_changed]:
+            if cb is not None:
+                cb()
+
+    @property
+    def observed(self):
+        """whether the snapshot is observed"""
+        return sum(self._observers.values()) > 0
+
+    async def _current(self):
+        """refresh the snapshot if it is out of date"""
+        if self._refreshTask is None:
+            if not self._stale and time.monotonic()-self._refreshed < self._interval:
+                return
+            self._refreshTask = asyncio.ensure_future(self.refresh())
+            self._refreshTask.add_done_callback(self._refresh_done)
+        try:
+            await asyncio.shield(self._refreshTask)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log.error('failed to update snapshot: {}'.format(e))
+
+    def _refresh_done(self,task):
+        self._refreshTask = None
+        if self._stale and self.observed:
+            # resources changed while the snapshot was collected
+            self._loop.create_task(self._current())
+
+    def _changed(self,r):
+        """called when a resource changes, possibly from another thread"""
+        if r._component is self or self._stale:
+            return
+        if _snapshot_option(r) is False:
+            # eg live frames or logs
+            return
+        self._stale = True
+        if self.observed:
+            self._loop.call_soon_threadsafe(self._loop.create_task,self._current())
+
+    async def _update(self):
+        """refresh the snapshot while it is observed"""
+        while True:
+            await self._current()
+            await asyncio.sleep(self._interval)
+
+    def observation_count_changed(self,path,count):
+        self._observers[path] = count
+        if self.observed and self._updateTask is None:
+            self._updateTask = self._loop.create_task(self._update())
+        elif not self.observed and self._updateTask is not None:
+            self._updateTask.cancel()
+            self._updateTask = None
+
+    @piccoloGET
+    async def get_version(self):
+        """the version of the snapshot"""
+        await self._current()
+        return self._version
+
+    @piccoloGET
+    async def get_state(self):
+        """the state of all resources"""
+        await self._current()
+        return {'version':self._version,
+                'time':self._time,
+                'state':self._state}
+    @piccoloChanged
+    def callback_state(self,cb):
+        self._state_changed = cb
+
+    @piccoloGET
+    async def get_delta(self):
+        """the resources that changed with the latest version"""
+        await self._current()
+        return {'version':self._version,
+                'base':self._version-1,
+                'time':self._time,
+                'state':self._delta}
+    @piccoloChanged
+    def callback_delta(self,cb):
+        self._delta_changed = cb
+
+    @piccoloPUT(path='since')
+    async def get_since(self,version):
+        """get the resources that changed since a version
+
+        :param version: the version of the snapshot known to the client
+        :return: dictionary containing the current version, whether the
+                 full state is returned because the version is no longer
+                 known and the state
+        """
+        # accept versions sent as strings or floats
+        if isinstance(version,str):
+            try:
+                version = int(version)
+            except ValueError:
+                pass
+        elif isinstance(version,float) and version.is_integer():
+            version = int(version)
+        if isinstance(version,bool) or not isinstance(version,int):
+            raise ValueError('version {} is not an integer'.format(version))
+        await self._current()
+        for v,state in self._history:
+            if v == version:
+                return {'version':self._version,
+                        'full':False,
+                        'state':_delta(state,self._state)}
+        return {'version':self._version,
+                'full':True,
+                'state':self._state}
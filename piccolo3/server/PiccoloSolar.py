@@ -0,0 +1,159 @@
+# Copyright 2014-2016 The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+compute the position of the sun using the NOAA solar calculator equations
+
+All functions operate on numpy arrays of POSIX timestamps so that the solar
+position for a whole day can be computed in one go. No network access is
+required.
+"""
+
+__all__ = ['solar_position','solar_elevation','sun_windows','SUNRISE_ELEVATION']
+
+import datetime
+import pytz
+import numpy
+
+# elevation of the sun centre at sunrise/sunset, accounts for refraction and
+# the size of the solar disc
+SUNRISE_ELEVATION = -0.833
+
+def _timestamps(times):
+    """convert times to an array of POSIX timestamps"""
+    if isinstance(times,numpy.ndarray) and times.dtype.kind in 'fi':
+        return times.astype(float)
+    ts = []
+    for t in numpy.atleast_1d(times):
+        if isinstance(t,datetime.datetime):
+            if t.tzinfo is None:
+                raise ValueError('time {} has no timezone'.format(t))
+            t = t.timestamp()
+        ts.append(t)
+    return numpy.array(ts,dtype=float)
+
+def solar_position(times,latitude,longitude):
+    """compute the solar zenith and azimuth angles
+
+    :param times: a timezone aware datetime, a sequence of them or an array
+                  of POSIX timestamps
+    :param latitude: latitude in degrees north
+    :param longitude: longitude in degrees east
+    :return: tuple of arrays containing zenith and azimuth angles in degrees
+    """
+
+    ts = _timestamps(times)
+    lat = numpy.radians(latitude)
+
+    # julian century
+    jc = (ts/86400. + 2440587.5 - 2451545.)/36525.
+
+    L = numpy.mod(280.46646 + jc*(36000.76983 + jc*0.0003032),360.)
+    M = numpy.radians(357.52911 + jc*(35999.05029 - 0.0001537*jc))
+    ecc = 0.016708634 - jc*(0.000042037 + 0.0000001267*jc)
+    centre = numpy.sin(M)*(1.914602 - jc*(0.004817 + 0.000014*jc)) + \
+        numpy.sin(2*M)*(0.019993 - 0.000101*jc) + numpy.sin(3*M)*0.000289
+    omega = numpy.radians(125.04 - 1934.136*jc)
+    appLong = numpy.radians(L + centre - 0.00569 - 0.00478*numpy.sin(omega))
+    obliquity = 23. + (26. + (21.448 - jc*(46.815 + jc*(0.00059 - jc*0.001813)))/60.)/60.
+    obliquity = numpy.radians(obliquity + 0.00256*numpy.cos(omega))
+    declination = numpy.arcsin(numpy.sin(obliquity)*numpy.sin(appLong))
+
+    y = numpy.tan(obliquity/2.)**2
+    L = numpy.radians(L)
+    # equation of time in minutes
+    eqTime = 4.*numpy.degrees(y*numpy.sin(2*L) - 2*ecc*numpy.sin(M) +
+                              4*ecc*y*numpy.sin(M)*numpy.cos(2*L) -
+                              0.5*y*y*numpy.sin(4*L) - 1.25*ecc*ecc*numpy.sin(2*M))
+
+    minutes = numpy.mod(ts,86400.)/60.
+    trueSolarTime = numpy.mod(minutes + eqTime + 4.*longitude,1440.)
+    hourAngle = numpy.radians(trueSolarTime/4. - 180.)
+
+    cosZenith = numpy.sin(lat)*numpy.sin(declination) + \
+        numpy.cos(lat)*numpy.cos(declination)*numpy.cos(hourAngle)
+    zenith = numpy.arccos(numpy.clip(cosZenith,-1.,1.))
+
+    denom = numpy.cos(lat)*numpy.sin(zenith)
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        cosAzimuth = (numpy.sin(lat)*numpy.cos(zenith) - numpy.sin(declination))/denom
+    cosAzimuth = numpy.where(denom == 0,1.,numpy.clip(cosAzimuth,-1.,1.))
+    azimuth = numpy.degrees(numpy.arccos(cosAzimuth))
+    azimuth = numpy.where(hourAngle > 0,
+                          numpy.mod(azimuth + 180.,360.),
+                          numpy.mod(540. - azimuth,360.))
+
+    return numpy.degrees(zenith),azimuth
+
+def solar_elevation(times,latitude,longitude):
+    """compute the solar elevation angle in degrees
+
+    :param times: a timezone aware datetime, a sequence of them or an array
+                  of POSIX timestamps
+    :param latitude: latitude in degrees north
+    :param longitude: longitude in degrees east
+    """
+    zenith,azimuth = solar_position(times,latitude,longitude)
+    return 90. - zenith
+
+def sun_windows(start_time,end_time,latitude,longitude,
+                min_elevation=SUNRISE_ELEVATION,resolution=60.):
+    """find the periods during which the sun is above an elevation
+
+    :param start_time: beginning of period to search
+    :type start_time: datetime.datetime
+    :param end_time: end of period to search
+    :type end_time: datetime.datetime
+    :param latitude: latitude in degrees north
+    :param longitude: longitude in degrees east
+    :param min_elevation: the minimum solar elevation in degrees
+    :param resolution: the time step in seconds used for sampling the
+                       solar elevation
+    :return: list of (start,end) datetime tuples, the first and last window
+             are clipped to the search period
+    """
+
+    t0 = start_time.timestamp()
+    t1 = end_time.timestamp()
+    ts = numpy.append(numpy.arange(t0,t1,resolution),t1)
+    elevation = solar_elevation(ts,latitude,longitude)
+    above = elevation >= min_elevation
+
+    windows = []
+    wstart = ts[0] if above[0] else None
+    for i in numpy.flatnonzero(above[1:] != above[:-1]):
+        # interpolate linearly to find crossing
+        frac = (min_elevation - elevation[i])/(elevation[i+1]-elevation[i])
+        crossing = ts[i] + frac*(ts[i+1]-ts[i])
+        if above[i+1]:
+            wstart = crossing
+        else:
+            windows.append((wstart,crossing))
+            wstart = None
+    if wstart is not None:
+        windows.append((wstart,ts[-1]))
+
+    return [(datetime.datetime.fromtimestamp(s,tz=pytz.utc),
+             datetime.datetime.fromtimestamp(e,tz=pytz.utc)) for s,e in windows]
+
+if __name__ == '__main__':
+    now = datetime.datetime.now(tz=pytz.utc)
+    # Edinburgh
+    lat,lon = 55.95,-3.19
+    print ('solar elevation', solar_elevation(now,lat,lon))
+    for w in sun_windows(now,now+datetime.timedelta(days=3),lat,lon):
+        print (w[0].isoformat(),w[1].isoformat())
@@ -25,16 +25,23 @@ __all__ = ['PiccoloSpectrometers']
 import asyncio
 from piccolo3.common import PiccoloSpectrum, PiccoloSpectrometerStatus
 from .PiccoloComponent import PiccoloBaseComponent, PiccoloNamedComponent, piccoloGET, piccoloPUT, piccoloChanged
-from .PiccoloWorkerThreads import PiccoloWorkerThread
+from .PiccoloWorkerThreads import PiccoloWorkerThread, PiccoloCommand, PiccoloCommandQueue, piccoloTask
+from .PiccoloWorkerProcess import PiccoloWorkerProcess
+from .PiccoloUSBMonitor import PiccoloUSBMonitor
+from .PiccoloStream import PiccoloRingBuffer, PiccoloStreamWriter
+from .PiccoloBlockwise import streamed_list
+from .PiccoloCompute import PiccoloComputePool, default_pool, max_intensity, frame_mean, wavelength_coefficients
 import threading
 from queue import Queue, Empty
 import janus
 import logging
 import uuid
+import os
 import time
+import datetime
+import pytz
 from collections import deque
 import numpy
-from scipy.signal import find_peaks
 
 import seabreeze.spectrometers as sb
 
@@ -43,12 +50,103 @@ try:
 except ModuleNotFoundError:
     DigitalOutputDevice = None
 
+# time in seconds between samples of the TEC temperature
+TEC_SAMPLE_INTERVAL = 1.
+# the number of TEC samples kept
+TEC_HISTORY = 600
+# time in seconds after which a spectrum triggers a new temperature sample
+TEC_MAX_AGE = 10.
+# the number of frames kept in memory while streaming
+STREAM_BUFFER_LENGTH = 256
+# time in seconds the device takes to apply a new integration time
+SETTLE_TIME = 0.1
+# integration time in ms below which the buffered frame is always flushed,
+# the time taken to read a buffered frame cannot be told apart from a fresh
+# exposure
+FLUSH_INTEGRATION_TIME = 50.
+
+class PiccoloPowerSequencer:
+    """serialise powering on spectrometers
+
+    Switching on several spectrometers at once causes a large inrush current
+    and the devices compete during USB enumeration. A spectrometer is only
+    switched on once the previous one has appeared on the USB bus, or the
+    enumeration timeout has passed, and at least inrush_delay seconds after
+    the previous one was switched on.
+    """
+
+    def __init__(self,inrush_delay=0.5,enumeration_timeout=10.):
+        """
+        :param inrush_delay: minimum time in seconds between switching on
+                             spectrometers
+        :param enumeration_timeout: maximum time in seconds to wait for a
+                                    spectrometer to enumerate
+        """
+        self._log = logging.getLogger('piccolo.power')
+        self._inrush_delay = inrush_delay
+        self._enumeration_timeout = enumeration_timeout
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._last_on = 0.
+        self._enumeration_times = deque(maxlen=10)
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def enumeration_time(self):
+        """the mean measured enumeration time in seconds or None"""
+        if len(self._enumeration_times) == 0:
+            return None
+        return sum(self._enumeration_times)/len(self._enumeration_times)
+
+    def power_on(self,name,switch_on):
+        """wait for the previous spectrometer and switch on power
+
+        :param name: the name of the spectrometer
+        :param switch_on: function switching on the power
+        """
+        with self._cond:
+            while self._pending is not None:
+                remaining = self._last_on + self._enumeration_timeout - time.time()
+                if remaining <= 0:
+                    self.log.warning('spectrometer {} did not enumerate within {}s'.format(
+                        self._pending,self._enumeration_timeout))
+                    break
+                self._cond.wait(remaining)
+            delay = self._last_on + self._inrush_delay - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            switch_on()
+            self._pending = name
+            self._last_on = time.time()
+
+    def enumerated(self,name):
+        """spectrometer has appeared on the USB bus"""
+        with self._cond:
+            if self._pending != name:
+                return
+            dt = time.time() - self._last_on
+            self._enumeration_times.append(dt)
+            self.log.info('spectrometer {} enumerated after {:.1f}s'.format(name,dt))
+            self._pending = None
+            self._cond.notify_all()
+
+    def release(self,name):
+        """stop waiting for a spectrometer that is no longer connecting"""
+        with self._cond:
+            if self._pending == name:
+                self._pending = None
+                self._cond.notify_all()
+
 class PiccoloSpectrometerWorker(PiccoloWorkerThread):
     """Spectrometer worker thread object. The worker thread performs assigned
     tasks in the background and holds on to the results until they are
     picked up."""
 
-    def __init__(self, name, channels, calibration, busy, tasks, results,info, power_switch = -1, power_delay=0,daemon=True):
+    def __init__(self, name, channels, calibration, busy, tasks, results,info, power_switch = -1, power_sequencer=None,hotplug=False,compute=None,daemon=True):
         """Initialize the worker thread.
 
         Note: calling __init__ does not start the thread, a subsequent call to
@@ -60,13 +158,20 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
         :param busy: a "lock" which prevents using the spectrometer when it is busy
         :type busy: thread.lock
         :param tasks: a queue into which tasks will be put
-        :type tasks: Queue.Queue
+        :type tasks: PiccoloCommandQueue
         :param results: the results queue from where results will be collected
         :type results: Queue.Queue
         :param info: queue for reporting back info
         :type info: Queue.Queue
         :param power_switch: power switch number, -1 to disable power switch
-        :param power_delay: delay powering on by power_delay seconds, default 0
+        :param power_sequencer: sequencer shared by spectrometers to stagger
+                                powering on, None to switch on immediately
+        :type power_sequencer: PiccoloPowerSequencer
+        :param hotplug: set to True if a USB monitor reports the device
+                        appearing, otherwise keep trying to connect
+        :param compute: the pool analysing spectra, None to use the default
+                        pool
+        :type compute: PiccoloComputePool
         """
         
         super().__init__('spectrometer_worker.{}'.format(name),busy, tasks, results,info,daemon=daemon)
@@ -84,7 +189,12 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
             else:
                 self._power_switch = DigitalOutputDevice(power_switch)
 
-        self._power_delay = power_delay
+        self._power_sequencer = power_sequencer
+        self._hotplug = hotplug
+        self._compute = compute if compute is not None else default_pool()
+        if not hotplug:
+            # poll the device to find out if it disappeared
+            self.health_interval = 1
         
         # the integration times
         self._currentIntegrationTime = {}
@@ -96,11 +206,19 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
             self._auto[c] = None
 
         self._haveTEC = None
+        self._targetTemperature = None
+        self._TECenabled = False
+        # the time and temperature of the most recent TEC sample
+        self._tecSample = None
+        # set to stop sampling the TEC when there are no health checks
+        self._tecSampler = None
             
         self._meta = None
             
         self._maxIntegrationTime = None
         self._minIntegrationTime = None
+        # the integration time the device is configured with, None if unknown
+        self._deviceIntegrationTime = None
 
         self._spec = None
         self._status = None
@@ -127,8 +245,11 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
     def power_switch(self):
         return self._power_switch
     @property
-    def power_delay(self):
-        return self._power_delay
+    def power_sequencer(self):
+        return self._power_sequencer
+    @property
+    def hotplug(self):
+        return self._hotplug
         
     def connect(self):
         if self.status > PiccoloSpectrometerStatus.DISCONNECTED:
@@ -142,6 +263,16 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
                 self.log.info('trying to connect to spectrometer %s'%self.serial)
                 self.status = PiccoloSpectrometerStatus.CONNECTING
 
+                if self.hotplug:
+                    # the USB monitor reports when the device appears
+                    try:
+                        self._spec = sb.Spectrometer.from_serial_number(serial=self.serial)
+                    except:
+                        self.log.info('waiting for spectrometer {} to appear'.format(self.serial))
+                        return
+                    self._open()
+                    return
+
                 next = time.time()
                 while True:
                     try:
@@ -158,29 +289,89 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
                         if task == 'shutdown':
                             self.tasks.put(None)
                             # reinjecting shutdown
+                            if self.power_sequencer is not None:
+                                self.power_sequencer.release(self.serial)
                             return
-                        elif task[0] == 'disconnect':
+                        elif task == 'check':
+                            # the device is not open yet
+                            self._checkPending.clear()
+                        elif task.name == 'disconnect':
+                            if self.power_sequencer is not None:
+                                self.power_sequencer.release(self.serial)
                             self.log.info('disconnecting spectrometer {}'.format(self.serial))
                             self._spec = None
                             self.status = PiccoloSpectrometerStatus.DISCONNECTED
                             return
-                        elif task[0] == 'status':
-                            self.results.put(self.status)
+                        elif task.name == 'status':
+                            self.reply(self.status,task)
                         else:
                             self.tasks.put(task)
 
 
-                self.log.info('opening device')
-                self._spec.open()
-
-                self._meta = None
+                self._open()
+                return
             self.log.info('connected to spectrometer %s'%self.serial)
             self.status = PiccoloSpectrometerStatus.IDLE
             self.enableTEC(True)
             self.minIntegrationTime = 0
 
+    def _open(self):
+        """open the device once it was found"""
+        if self.power_sequencer is not None:
+            self.power_sequencer.enumerated(self.serial)
+        self.log.info('opening device')
+        self._spec.open()
+        self._deviceIntegrationTime = None
+        self._tecSample = None
+
+        self._meta = None
+        self.log.info('connected to spectrometer %s'%self.serial)
+        self.status = PiccoloSpectrometerStatus.IDLE
+        self.enableTEC(True)
+        self.minIntegrationTime = 0
+
+    def device_added(self):
+        """a spectrometer appeared on the USB bus"""
+        if self.status not in [PiccoloSpectrometerStatus.CONNECTING,
+                               PiccoloSpectrometerStatus.DROPPED]:
+            return
+        # the device might not be accessible straight away
+        for i in range(3):
+            try:
+                self._spec = sb.Spectrometer.from_serial_number(serial=self.serial)
+                break
+            except:
+                time.sleep(0.5)
+        else:
+            return
+        self._open()
+
+    def device_removed(self,serial):
+        """a spectrometer was removed from the USB bus"""
+        if self.status < PiccoloSpectrometerStatus.IDLE or self.is_dummy:
+            return
+        if serial == self.serial:
+            self._dropped()
+        else:
+            # the removed device did not report its serial number
+            self.check_ok()
+
+    def _dropped(self):
+        self.status = PiccoloSpectrometerStatus.DROPPED
+        self._spec = None
+        self._schedule_tec(False)
+        self.log.warning('spectrometer {} disappeared'.format(self.serial))
+        if not self.hotplug:
+            self.tasks.put(PiccoloCommand('connect'))
+
     def disconnect(self):
-        if self.status < PiccoloSpectrometerStatus.IDLE:
+        if self.status == PiccoloSpectrometerStatus.CONNECTING:
+            # stop waiting for the device to appear
+            if self.power_sequencer is not None:
+                self.power_sequencer.release(self.serial)
+            self.log.info('disconnecting spectrometer {}'.format(self.serial))
+            self.status = PiccoloSpectrometerStatus.DISCONNECTED
+        elif self.status < PiccoloSpectrometerStatus.IDLE:
             self.log.warning('spectrometer is not connected')
         else:
             self.log.info('disconnecting spectrometer {}'.format(self.serial))
@@ -190,6 +381,7 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
                 except Exception as e:
                     self.log.error(e)
             self._spec = None
+            self._schedule_tec(False)
             self.status = PiccoloSpectrometerStatus.DISCONNECTED
 
     def power_off(self):
@@ -210,10 +402,10 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
             self.log.warning('spectrometer is already powered-on')
         else:
             self.log.info('powering on spectrometer {}'.format(self.serial))
-            if self.power_delay > 0:
-                self.log.info('waiting for {} seconds'.format(self.power_delay))
-                time.sleep(self.power_delay)
-            self.power_switch.off()
+            if self.power_sequencer is not None:
+                self.power_sequencer.power_on(self.serial,self.power_switch.off)
+            else:
+                self.power_switch.off()
             self.status = PiccoloSpectrometerStatus.DISCONNECTED
         self.connect()
 
@@ -222,6 +414,7 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
         if self.haveTEC:
             try:
                 self.spec.f.thermo_electric.enable_tec(state)
+                self._schedule_tec(state)
                 if state:
                     self.log.info('TEC enabled')
                 else:
@@ -246,14 +439,60 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
 
     def check_ok(self):
         if self.status>PiccoloSpectrometerStatus.DISCONNECTED and not self.is_dummy and not self._spec._dev.is_open:
-            self.status = PiccoloSpectrometerStatus.DROPPED
-            self._spec = None
-            self.log.warning('spectrometer {} disappeared'.format(self.serial))
-            self.tasks.put(('connect',None))
+            self._dropped()
             return False
         else:
             return True
 
+    @piccoloTask('check')
+    def _check(self):
+        super()._check()
+        if self._TECenabled:
+            self._sample_tec()
+
+    def _schedule_tec(self,enabled):
+        """sample the TEC periodically while it is enabled"""
+        self._TECenabled = enabled
+        if self.health_interval is not None:
+            # the health checks sample the TEC
+            return
+        if enabled and self._tecSampler is None:
+            self._tecSampler = threading.Event()
+            threading.Thread(target=self._sample_tec_periodically,args=(self._tecSampler,),
+                             name='{}.tec'.format(self.name),daemon=True).start()
+        elif not enabled and self._tecSampler is not None:
+            self._tecSampler.set()
+            self._tecSampler = None
+
+    def _sample_tec_periodically(self,stop):
+        """queue a check, which samples the TEC, every TEC_SAMPLE_INTERVAL seconds"""
+        while not stop.wait(TEC_SAMPLE_INTERVAL) and not self._stopped.is_set():
+            if not self._checkPending.is_set():
+                self._checkPending.set()
+                self.tasks.put(PiccoloCommand('check'))
+
+    def _sample_tec(self):
+        """read the TEC temperature and report it
+
+        :return: the temperature, None if there is no TEC
+        """
+        if self.status < PiccoloSpectrometerStatus.IDLE or not self.haveTEC:
+            return
+        try:
+            temperature = self.currentTemperature
+        except Exception as e:
+            self.log.warning('failed to read temperature: {}'.format(e))
+            return
+        self._tecSample = (time.time(),temperature)
+        self.info.put(('tec',(self._tecSample[0],temperature,self._targetTemperature)))
+        return temperature
+
+    def _temperature(self):
+        """the most recent TEC temperature, sampled if it is too old"""
+        if self._tecSample is not None and time.time()-self._tecSample[0] < TEC_MAX_AGE:
+            return self._tecSample[1]
+        return self._sample_tec()
+
     def check_ready(self):
         if not self.check_ok():
             raise RuntimeError('spectrometer {} disappeared'.format(self.serial))
@@ -305,14 +544,14 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
                 }
             else:
                 # fit a polynomial to the wavelengths
-                wavelengths = self.spec.wavelengths()
-                coeff = numpy.polyfit(numpy.arange(len(wavelengths)),wavelengths,3)
+                coeff = wavelength_coefficients(self.spec.wavelengths())
+                # use python types so that the metadata can be JSON encoded
                 self._meta = {
                     'SerialNumber': self.spec.serial_number,
-                    'WavelengthCalibrationCoefficients': list(coeff[::-1]),
-                    'DarkPixels': list(self.spec.f.spectrometer.get_electric_dark_pixel_indices()),
-                    'NonlinearityCorrectionCoefficients': list(self.spec._nc.coeffs[::-1]),
-                    'SaturationLevel' : self.spec.max_intensity,
+                    'WavelengthCalibrationCoefficients': coeff,
+                    'DarkPixels': [int(p) for p in self.spec.f.spectrometer.get_electric_dark_pixel_indices()],
+                    'NonlinearityCorrectionCoefficients': [float(c) for c in self.spec._nc.coeffs[::-1]],
+                    'SaturationLevel' : int(self.spec.max_intensity),
                 }
             self._meta['IntegrationTimeUnits'] = 'milliseconds'
             self._meta['TemperatureEnabled'] = False
@@ -378,102 +617,203 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
         self._auto[c] = s
         self.info.put(('auto',(c,s)))
         
-    def process_task(self,task):
-        if task[0] == 'connect':
-            self.connect()
-        elif task[0] == 'disconnect':
-            self.disconnect()
-        elif task[0] == 'power_on':
-            self.power_on()
-        elif task[0] == 'power_off':
-            self.power_off()
-        elif task[0] == 'status':
-            self.results.put(self.status)
-        elif task[0] == 'haveTEC':
-            self.results.put(self.haveTEC)
-        elif task[0] == 'currentTemp':
-            self.results.put(self.currentTemperature)
-        elif task[0] == 'enableTEC':
-            result = self.enableTEC(task[1])
-            self.results.put(result)
-        elif task[0] == 'targetTemp':
-            result = 'ok'
-            if self.haveTEC:
-                try:
-                    self.spec.f.thermo_electric.set_temperature_setpoint_degrees_celsius(task[1])
-                    self.log.info('setting target temperature to {} degC'.format(task[1]))
-                except Exception as e:
-                    result = str(e)
-            self.results.put(result)
-        elif task[0] == 'current':
-            result = 'ok'
-            try:
-                self.set_currentIntegrationTime(task[1],task[2])
-            except Exception as e:
-                result = str(e)
-            self.results.put(result)
-        elif task[0] == 'min':
-            result = 'ok'
-            try:
-                self.minIntegrationTime = task[1]
-            except Exception as e:
-                result = str(e)
-            self.results.put(result)
-        elif task[0] == 'max':
-            result = 'ok'
+    @piccoloTask('connect')
+    def _task_connect(self):
+        self.connect()
+    @piccoloTask('disconnect')
+    def _task_disconnect(self):
+        self.disconnect()
+    @piccoloTask('power_on')
+    def _task_power_on(self):
+        self.power_on()
+    @piccoloTask('power_off')
+    def _task_power_off(self):
+        self.power_off()
+    @piccoloTask('added')
+    def _task_added(self):
+        self.device_added()
+    @piccoloTask('removed')
+    def _task_removed(self,serial):
+        self.device_removed(serial)
+    @piccoloTask('status')
+    def _task_status(self):
+        self.reply(self.status)
+    @piccoloTask('haveTEC')
+    def _task_haveTEC(self):
+        self.reply(self.haveTEC)
+    @piccoloTask('currentTemp')
+    def _task_currentTemp(self):
+        self.reply(self.currentTemperature)
+    @piccoloTask('enableTEC')
+    def _task_enableTEC(self,state):
+        result = self.enableTEC(state)
+        self.reply(result)
+    @piccoloTask('targetTemp')
+    def _task_targetTemp(self,t):
+        result = 'ok'
+        if self.haveTEC:
             try:
-                self.maxIntegrationTime = task[1]
+                self.spec.f.thermo_electric.set_temperature_setpoint_degrees_celsius(t)
+                self._targetTemperature = t
+                self.log.info('setting target temperature to {} degC'.format(t))
             except Exception as e:
                 result = str(e)
-            self.results.put(result)
-        elif task[0] == 'start_acquisition':
-            channel = task[1]
-            if channel not in self.channels:
-                self.results.put('channel {} is unknown'.format(channel))
-                return
-            try:
-                self.check_ready()
-            except Exception as e:
-                self.results.put(str(e))
-                return
-            dark = task[2]
-            task_id = task[3]
-            self.results.put('ok')
-            self.status = PiccoloSpectrometerStatus.RECORDING
-            try:
-                self._acquire_spectrum(channel,dark,task_id)
-            except Exception as e:
-                self.log.error('during acquisition: {}'.format(e))
-            self.status = PiccoloSpectrometerStatus.IDLE
-            
-        elif task[0] == 'autointegration':
-            channel = task[1]
-            if channel not in self.channels:
-                self.results.put('channel {} is unknown'.format(channel))
-                return
-            try:
-                self.check_ready()
-            except Exception as e:
-                self.results.put(str(e))
-                return
-            target = task[2]
-            self.results.put('ok')
+        self.reply(result)
+    @piccoloTask('current')
+    def _task_current(self,channel,t):
+        result = 'ok'
+        try:
+            self.set_currentIntegrationTime(channel,t)
+        except Exception as e:
+            result = str(e)
+        self.reply(result)
+    @piccoloTask('min')
+    def _task_min(self,t):
+        result = 'ok'
+        try:
+            self.minIntegrationTime = t
+        except Exception as e:
+            result = str(e)
+        self.reply(result)
+    @piccoloTask('max')
+    def _task_max(self,t):
+        result = 'ok'
+        try:
+            self.maxIntegrationTime = t
+        except Exception as e:
+            result = str(e)
+        self.reply(result)
 
-            if self.is_dummy:
-                self.log.warning('no spectrometer')
-                self.set_auto(channel,'f')
-                return
-            
-            self.status = PiccoloSpectrometerStatus.AUTOINTEGRATING
-            try:
-                self._autointegrate(channel,target)
-            except  Exception as e:
-                self.set_auto(channel,'f')
-                self.log.error('during acquisition: {}'.format(e))
-            self.status = PiccoloSpectrometerStatus.IDLE
+    @piccoloTask('start_acquisition')
+    def _task_start_acquisition(self,channel,dark,task_id):
+        if channel not in self.channels:
+            self.reply('channel {} is unknown'.format(channel))
+            return
+        try:
+            self.check_ready()
+        except Exception as e:
+            self.reply(str(e))
+            return
+        self.reply('ok')
+        self.status = PiccoloSpectrometerStatus.RECORDING
+        try:
+            self._acquire_spectrum(channel,dark,task_id)
+        except Exception as e:
+            self.log.error('during acquisition: {}'.format(e))
+        self.status = PiccoloSpectrometerStatus.IDLE
+
+    @piccoloTask('autointegration')
+    def _task_autointegration(self,channel,target):
+        if channel not in self.channels:
+            self.reply('channel {} is unknown'.format(channel))
+            return
+        try:
+            self.check_ready()
+        except Exception as e:
+            self.reply(str(e))
+            return
+        self.reply('ok')
+
+        if self.is_dummy:
+            self.log.warning('no spectrometer')
+            self.set_auto(channel,'f')
+            return
+
+        self.status = PiccoloSpectrometerStatus.AUTOINTEGRATING
+        try:
+            self._autointegrate(channel,target)
+        except  Exception as e:
+            self.set_auto(channel,'f')
+            self.log.error('during acquisition: {}'.format(e))
+        self.status = PiccoloSpectrometerStatus.IDLE
+
+    @piccoloTask('stream')
+    def _task_stream(self,channel,fname,decimate):
+        if channel not in self.channels:
+            self.reply('channel {} is unknown'.format(channel))
+            return
+        try:
+            self.check_ready()
+        except Exception as e:
+            self.reply(str(e))
+            return
+        self.reply('ok')
+        self.status = PiccoloSpectrometerStatus.RECORDING
+        try:
+            self._stream(channel,fname,decimate)
+        except Exception as e:
+            self.log.error('during streaming: {}'.format(e))
+        self.status = PiccoloSpectrometerStatus.IDLE
+
+    @piccoloTask('stop_stream')
+    def _task_stop_stream(self):
+        self.reply('spectrometer {} is not streaming'.format(self.serial))
+
+    def _read_frame(self,integration_time):
+        if self.is_dummy:
+            time.sleep(integration_time/1000.)
+            return numpy.arange(100,dtype=float)
+        return self.spec.intensities()
+
+    def _stream(self,channel,fname,decimate):
+        """read spectra back-to-back until told to stop"""
+        integration_time = self.get_currentIntegrationTime(channel)
+        integration_time = max(integration_time,self.minIntegrationTime)
+        integration_time = min(integration_time,self.maxIntegrationTime)
+        self.log.info('start streaming channel {} to {}, integration time {}'.format(
+            channel,fname,integration_time))
+        if self.is_dummy:
+            pixels = self._read_frame(integration_time)
         else:
-            result = 'unkown task: {}'.format(task)
-            self.results.put(result)
+            pixels = self._read_fresh(integration_time)
+        header = dict(self.meta)
+        header.update({'Direction':channel,
+                       'IntegrationTime':integration_time,
+                       'npixels':len(pixels)})
+        if channel in self._calibration:
+            header['WavelengthCalibrationCoefficientsPiccolo'] = self._calibration[channel]
+        buffer = PiccoloRingBuffer(STREAM_BUFFER_LENGTH,len(pixels))
+        live = None
+
+        t0 = time.time()
+        with PiccoloStreamWriter(fname,header) as writer:
+            while True:
+                t = time.time()
+                buffer.append(t,pixels)
+                writer.write(t,pixels)
+                if buffer.count % decimate == 0 and (live is None or live.done()):
+                    # the live frame is the mean of the frames since the last
+                    # one, it is computed by the compute pool while recording
+                    # carries on and skipped while the previous one is pending
+                    times,frames = buffer.latest(decimate)
+                    live = self._compute.submit(frame_mean,frames)
+                    live.add_done_callback(lambda f,lt=times[-1]: self._put_live(lt,f))
+
+                task = self.get_task(block=False)
+                if task is not None:
+                    if task == 'stop_stream':
+                        self.reply('ok',task)
+                        break
+                    elif task == 'shutdown':
+                        self.tasks.put(None)
+                        break
+                    elif task == 'check':
+                        self._checkPending.clear()
+                        if self._TECenabled:
+                            self._sample_tec()
+                    else:
+                        self.reply('spectrometer {} is streaming'.format(self.serial),task)
+                pixels = self._read_frame(integration_time)
+
+        dt = time.time()-t0
+        self.log.info('streamed {} frames in {:.1f}s ({:.1f} frames/s)'.format(
+            buffer.count,dt,buffer.count/max(dt,1e-6)))
+
+    def _put_live(self,lt,future):
+        try:
+            self.info.put(('live',(lt,future.result())))
+        except Exception as e:
+            self.log.error('failed to compute live frame: {}'.format(e))
 
     def _autointegrate(self,channel,target,target_tolerance = 10.,num_attempts = 5):
         self.log.info("start autointegration: channel {}, target {}%, current integration time {}".format(channel,target, self.get_currentIntegrationTime(channel)))
@@ -550,44 +890,65 @@ class PiccoloSpectrometerWorker(PiccoloWorkerThread):
                 time.sleep(self.get_currentIntegrationTime(channel)/1000.)
                 pixels = list(range(100))
             else:
-                self.info.put(('spectrum',(task_id,None)))
+                self.info.put(('spectrum',(task_id,None,None)))
                 return
         else:
             pixels = self._get_spectrum(self.get_currentIntegrationTime(channel))
-            spectrum['Temperature'] = self.currentTemperature
+            spectrum['Temperature'] = self._temperature()
 
         spectrum['IntegrationTime'] = self.get_currentIntegrationTime(channel)
         if channel in self._calibration:
             spectrum['WavelengthCalibrationCoefficientsPiccolo'] = self._calibration[channel]
-        spectrum.pixels = pixels
 
-        self.info.put(('spectrum',(task_id,spectrum)))
+        # the pixels are passed separately so that they can be put into
+        # shared memory when the worker runs in its own process
+        self.info.put(('spectrum',(task_id,spectrum,pixels)))
             
+    def _configure(self,integration_time):
+        """set the integration time of the device unless it is already set
+
+        :return: True if the integration time was changed
+        """
+        if integration_time == self._deviceIntegrationTime:
+            return False
+        self.spec.integration_time_micros(integration_time * 1000.)
+        self._deviceIntegrationTime = integration_time
+        time.sleep(SETTLE_TIME)
+        return True
+
+    def _read_fresh(self,integration_time):
+        """read a spectrum exposed after the request
+
+        The first frame is discarded if it was recorded with the old
+        integration time or if it was returned quicker than the exposure
+        takes, ie it was buffered before the request.
+        """
+        changed = self._configure(integration_time)
+        # each read shows that the worker is not stuck
+        self.tasks.touch()
+        t0 = time.monotonic()
+        pixels = self.spec.intensities()
+        if changed or integration_time < FLUSH_INTEGRATION_TIME or \
+           time.monotonic()-t0 < integration_time/1000.:
+            self.log.debug('flushing frame at t={}'.format(integration_time))
+            self.tasks.touch()
+            pixels = self.spec.intensities()
+        return pixels
+
     def _get_spectrum(self,integration_time):
         integration_time = max(integration_time,self.minIntegrationTime)
         integration_time = min(integration_time,self.maxIntegrationTime)
-        self.spec.integration_time_micros(integration_time * 1000.)
-        time.sleep(0.1)
-        pixels = self.spec.intensities()
-        pixels = self.spec.intensities()
-        self.spec.integration_time_micros(self.minIntegrationTime* 1000.)
+        pixels = self._read_fresh(integration_time)
         self.log.debug('recorded spectrum t={}, max intensity={}'.format(integration_time,max(pixels)))
         return pixels
                        
             
     def _get_max(self,integration_time):
         pixels = self._get_spectrum(integration_time)
-        if True:
-            try:
-                peaks, properties = find_peaks(pixels,width=5)
-                max_pixel = max(properties['prominences'])
-            except:
-                max_pixel = max(pixels)
-        else:
-            max_pixel = max(pixels)
+        # the next integration time depends on the result, so there is
+        # nothing to overlap with and the reduction is cheap
+        max_pixel = max_intensity(pixels)
         self.log.debug('max intensity at t={},max={}'.format(integration_time, max_pixel))
-        if False:
-            self.log.debug(properties['prominences'])
         return max_pixel    
 
     def _fit_autointegration(self,times,intensities,target_intensity):
@@ -614,7 +975,8 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
 
     NAME = 'spectrometer'
     
-    def __init__(self,name, channels,calibration, power_switch = -1, power_delay=0):
+    def __init__(self,name, channels,calibration, power_switch = -1, power_sequencer=None,usb_monitor=None,
+                 process=False,hang_timeout=60.,compute=None,loop=None):
         """Initialize a Piccolo Spectrometer object for Piccolo Server.
 
         The spectromter parameter must be the Spectrometer object from the
@@ -626,7 +988,21 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
         :param name: a descriptive name for the spectrometer.
         :param channels: a list of channels
         :param power_switch: power switch number, -1 to disable power switch
-        :param power_delay: delay powering on by power_delay seconds, default 0
+        :param power_sequencer: sequencer shared by spectrometers to stagger
+                                powering on
+        :param usb_monitor: monitor reporting devices being plugged in and
+                            removed, None to poll the device
+        :type usb_monitor: PiccoloUSBMonitor
+        :param process: run the worker in its own process
+        :param hang_timeout: time in seconds after which a worker process
+                             that does not make progress is restarted, must
+                             be longer than the longest integration time
+        :param compute: the pool analysing spectra, a worker process uses
+                        its own pool
+        :type compute: PiccoloComputePool
+        :param loop: the event loop serving the spectrometer, the current
+                     loop if None. It must be given when the spectrometer is
+                     created outside the event loop
         """
 
         super().__init__(name)
@@ -634,10 +1010,11 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
         # the various queues
         # The lock prevents two threads using the spectrometer at the same time.
         self._busy = threading.Lock()
-        self._tQ = Queue() # Task queue.
+        self._tQ = PiccoloCommandQueue() # Task queue.
         self._rQ = Queue() # Results queue.
 
-        loop = asyncio.get_event_loop()        
+        if loop is None:
+            loop = asyncio.get_event_loop()
         self._iQ = janus.Queue(loop=loop) # info queue
 
         self._status = PiccoloSpectrometerStatus.NO_WORKER
@@ -663,6 +1040,8 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
         self._TECenabled = None
         self._TECenabledChanged = None
         self._currentTemperature = None
+        self._tecHistory = deque(maxlen=TEC_HISTORY)
+        self._tec_history_changed = None
         self._targetTemperature = None
         self._targetTemperatureChanged = None
                 
@@ -670,24 +1049,46 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
         self._task_id = deque()
         self._spectra = {}
 
+        # the live frame while streaming
+        self._live = None
+        self._live_changed = None
+
         # start the info updater thread
-        self._uiTask = loop.create_task(self._update_info())
+        self._uiTask = asyncio.run_coroutine_threadsafe(self._update_info(),loop)
 
         # start the spectrometer worker thread
-        self._spectrometer = PiccoloSpectrometerWorker(name,
-                                                       channels,
-                                                       calibration,
-                                                       self._busy,
-                                                       self._tQ, self._rQ,
-                                                       self._iQ.sync_q,
-                                                       power_switch = power_switch,
-                                                       power_delay = power_delay)
+        if process:
+            self._spectrometer = PiccoloWorkerProcess(PiccoloSpectrometerWorker,
+                                                      'spectrometer_worker.{}'.format(name),
+                                                      self._busy,
+                                                      self._tQ, self._rQ,
+                                                      self._iQ.sync_q,
+                                                      args = (name,list(channels),calibration),
+                                                      kwargs = {'power_switch':power_switch,
+                                                                'power_sequencer':power_sequencer,
+                                                                'hotplug':usb_monitor is not None},
+                                                      hang_timeout = hang_timeout,
+                                                      restarted = self._worker_restarted)
+        else:
+            self._spectrometer = PiccoloSpectrometerWorker(name,
+                                                           channels,
+                                                           calibration,
+                                                           self._busy,
+                                                           self._tQ, self._rQ,
+                                                           self._iQ.sync_q,
+                                                           power_switch = power_switch,
+                                                           power_sequencer = power_sequencer,
+                                                           hotplug = usb_monitor is not None,
+                                                           compute = compute)
+        # the initial status, further changes are reported via the info
+        # queue so that construction does not wait for the device
+        self._status = self._spectrometer.status
+        # the status is answered without entering the worker
+        self._tQ.set_cached('status',lambda: self._spectrometer.status)
         self._spectrometer.start()
+        if usb_monitor is not None:
+            usb_monitor.add_listener(self._usb_event)
         self.connect()
-        # get initial status
-        self._tQ.put(('status',None))
-        result = self._rQ.get()
-        self._status = result
         self.log.info('started')
 
     def stop(self):
@@ -695,25 +1096,53 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
         self.log.info('shutting down')
         self._tQ.put(None)
 
-    @piccoloGET
+    def _worker_restarted(self):
+        """called by the supervisor after restarting the worker process"""
+        # reapply the TEC settings and reconnect
+        self._TEClocalchange = True
+        self.connect()
+
+    @piccoloGET(snapshot=False)
+    def get_worker(self):
+        """get the kind of worker, its process ID and the number of restarts"""
+        if isinstance(self._spectrometer,PiccoloWorkerProcess):
+            return {'process':True,
+                    'pid':self._spectrometer.pid,
+                    'restarts':self._spectrometer.restarts}
+        return {'process':False,'pid':os.getpid(),'restarts':0}
+
+    def _usb_event(self,action,serial):
+        """called by the USB monitor thread"""
+        if serial is not None and serial != self.name:
+            return
+        if action == 'add':
+            self._tQ.submit(PiccoloCommand('added'),policy='coalesce')
+        else:
+            self._tQ.submit(PiccoloCommand('removed',serial))
+
+    def _call(self,name,*args,policy='enqueue'):
+        """send a command to the worker and wait for the reply"""
+        return self._tQ.submit(PiccoloCommand(name,*args),policy=policy).result()
+
+    @piccoloGET(snapshot=False)
     def connect(self):
         if self.status>PiccoloSpectrometerStatus.DISCONNECTED:
             return 'spectrometer is in wrong state to be connected {}'.format(self.status.name)
-        self._tQ.put(('connect',None))
+        self._tQ.submit(PiccoloCommand('connect'))
         return 'ok'
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def disconnect(self):
         if self.status == PiccoloSpectrometerStatus.DISCONNECTED:
             return 'spectrometer is already disconnected'
-        self._tQ.put(('disconnect',None))        
+        self._tQ.submit(PiccoloCommand('disconnect'))
         return 'ok'
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def power_off(self):
         if self.status == PiccoloSpectrometerStatus.POWERED_OFF:
             return 'spectrometer is already powered off'
-        self._tQ.put(('power_off',None))
+        self._tQ.submit(PiccoloCommand('power_off'))
         return 'ok'
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def power_on(self):
         if self.status>PiccoloSpectrometerStatus.DISCONNECTED:
             result = 'spectrometer is already running'
@@ -722,7 +1151,7 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
                 result = 'ok'
             else:
                 result = 'spectrometer is already powered on'
-            self._tQ.put(('power_on',None))        
+            self._tQ.submit(PiccoloCommand('power_on'))
         return result
 
     
@@ -757,8 +1186,21 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
                 self._auto_state[c] = t
                 if self._auto_changed is not None:
                     self._auto_changed()
+            elif s == 'live':
+                self._live = {'time':datetime.datetime.fromtimestamp(t[0],tz=pytz.utc).isoformat(),
+                              'pixels':t[1]}
+                if self._live_changed is not None:
+                    self._live_changed()
+            elif s == 'tec':
+                self._currentTemperature = t[1]
+                self._tecHistory.append(t)
+                if self._tec_history_changed is not None:
+                    self._tec_history_changed()
             elif s == 'spectrum':
-                self._spectra[t[0]] = t[1]
+                tID,spectrum,pixels = t
+                if spectrum is not None:
+                    spectrum.pixels = pixels
+                self._spectra[tID] = spectrum
             elif s== 'status':
                 self._status = t
                 if self._TEClocalchange and t == PiccoloSpectrometerStatus.IDLE:
@@ -781,25 +1223,28 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
                 self.check_idle()
             except Warning:
                 return None
-            self._tQ.put(('haveTEC',None))
-            self._haveTEC = self._rQ.get()
+            self._haveTEC = self._call('haveTEC',policy='coalesce')
         return self._haveTEC
-    @piccoloGET
+    @piccoloGET(blocking=True)
     def get_haveTEC(self):
         return self.haveTEC        
-    @piccoloGET
+    @piccoloGET(blocking=True)
     def get_current_temperature(self):
         if not self.haveTEC:
             raise RuntimeError('device has not TEC')
-        try:
-            self.check_idle()
-            self._tQ.put(('currentTemp',))
-            t = self._rQ.get()
-            self._currentTemperature = t
-        except Exception as e:
-            self.log.warn(str(e))
-            t = self._currentTemperature
-        return t
+        # the worker samples the temperature periodically
+        return self._currentTemperature
+
+    @piccoloGET(observable=True,snapshot=False,stream=True)
+    def get_tec_history(self):
+        """the recent TEC samples, oldest first, each a list of the time,
+        the temperature and the target temperature"""
+        samples = list(self._tecHistory)
+        return streamed_list([datetime.datetime.fromtimestamp(t,tz=pytz.utc).isoformat(),temp,target]
+                             for t,temp,target in samples)
+    @piccoloChanged
+    def callback_tec_history(self,cb):
+        self._tec_history_changed = cb
 
     @property
     def TECenabled(self):
@@ -810,8 +1255,7 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
     def TECenabled(self,state):
         if self._TEClocalchange or state is not self._TECenabled:
             if self.status == PiccoloSpectrometerStatus.IDLE:
-                self._tQ.put(('enableTEC',state))
-                result = self._rQ.get()
+                result = self._call('enableTEC',state)
                 if result != 'ok':
                     raise RuntimeError(result)
             else:
@@ -822,7 +1266,7 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
     @piccoloGET
     def get_TECenabled(self):
         return self.TECenabled
-    @piccoloPUT
+    @piccoloPUT(blocking=True)
     def set_TECenabled(self,state):
         self.TECenabled = state
     @piccoloChanged
@@ -836,8 +1280,7 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
     def target_temperature(self,t):
         if self._TEClocalchange or self._targetTemperature is None or abs(self._targetTemperature-t)>1e-5:
             if self.status == PiccoloSpectrometerStatus.IDLE:
-                self._tQ.put(('targetTemp',t))
-                result = self._rQ.get()
+                result = self._call('targetTemp',t)
                 if result != 'ok':
                     raise RuntimeError(result)
             else:
@@ -845,61 +1288,58 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
             self._targetTemperature = t
             if self._targetTemperatureChanged is not None:
                 self._targetTemperatureChanged()
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_target_temperature(self):
         return self.target_temperature
-    @piccoloPUT
+    @piccoloPUT(blocking=True)
     def set_target_temperature(self,t):
         self.target_temperature = t
     @piccoloChanged
     def callback_target_temperature(self,cb):
         self._targetTemperatureChanged = cb
     
-    @piccoloGET(parse_path=True)
+    @piccoloGET(parse_path=True,snapshot='channels',cache='changed')
     def get_current_time(self,channel):
         if channel not in self._channels:
             raise RuntimeError('unknown channel {}'.format(channel))
         return self._currentIntegrationTime[channel]
-    @piccoloPUT(parse_path=True)
+    @piccoloPUT(parse_path=True,blocking=True)
     def set_current_time(self,channel,t):
         self.check_idle()
-        self._tQ.put(('current',channel,t))
-        result = self._rQ.get()
+        result = self._call('current',channel,t)
         if result != 'ok':
             raise RuntimeError(result)
     @piccoloChanged
     def callback_current_time(self,cb):
         self._currentIntegrationTimeChanged = cb
         
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_min_time(self):
         return self._minIntegrationTime
-    @piccoloPUT
+    @piccoloPUT(blocking=True)
     def set_min_time(self,t):
         self.check_idle()
-        self._tQ.put(('min',t))
-        result = self._rQ.get()
+        result = self._call('min',t)
         if result != 'ok':
             raise RuntimeError(result)
     @piccoloChanged
     def callback_min_time(self,cb):
         self._minIntegrationTimeChanged = cb
         
-    @piccoloGET
+    @piccoloGET(cache='changed')
     def get_max_time(self):
         return self._maxIntegrationTime    
-    @piccoloPUT
+    @piccoloPUT(blocking=True)
     def set_max_time(self,t):
         self.check_idle()
-        self._tQ.put(('max',t))
-        result = self._rQ.get()
+        result = self._call('max',t)
         if result != 'ok':
             raise RuntimeError(result)
     @piccoloChanged
     def callback_max_time(self,cb):
         self._maxIntegrationTimeChanged = cb
 
-    @piccoloGET(parse_path=True)
+    @piccoloGET(parse_path=True,snapshot='channels')
     def get_autointegration(self,channel):
         if channel not in self._channels:
             raise RuntimeError('unknown channel {}'.format(channel))
@@ -908,6 +1348,11 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
     def callback_autointegration(self,cb):
         self._auto_changed = cb
 
+    @property
+    def channels(self):
+        """the channels the spectrometer is connected to"""
+        return self._channels
+
     @property
     def status(self):
         if not self._spectrometer.is_alive():
@@ -932,8 +1377,7 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
         self.check_idle()
         if target<0 or target > 100:
             raise RuntimeError('target out of range 0<%s<100'%target)
-        self._tQ.put(('autointegration',channel,target))
-        result = self._rQ.get()
+        result = self._call('autointegration',channel,target)
         if result != 'ok':
             raise RuntimeError(result)
 
@@ -944,12 +1388,36 @@ class PiccoloSpectrometer(PiccoloNamedComponent):
             raise Warning('spectrum not collected yet')
         task_id = uuid.uuid1()
         self._task_id.append(task_id)        
-        self._tQ.put(('start_acquisition',channel,dark,task_id))
-        result = self._rQ.get()
+        result = self._call('start_acquisition',channel,dark,task_id)
         if result != 'ok':
             self._task_id.pop()
             raise RuntimeError(result)
 
+    def start_stream(self,channel,fname,decimate=10):
+        """continuously record spectra
+
+        :param channel: the channel, its shutter needs to be open
+        :param fname: the name of the stream file
+        :param decimate: publish the mean of every decimate frames as live
+                         frame
+        """
+        self.check_idle()
+        result = self._call('stream',channel,fname,decimate,policy='reject')
+        if result != 'ok':
+            raise RuntimeError(result)
+
+    def stop_stream(self):
+        """stop streaming spectra"""
+        return self._call('stop_stream')
+
+    @piccoloGET(observable=True,snapshot=False)
+    def get_live(self):
+        """the most recent live frame while streaming"""
+        return self._live
+    @piccoloChanged
+    def callback_live(self,cb):
+        self._live_changed = cb
+
     def _get_spectrum(self,tID,status):
         s = self._spectra[tID]
         del self._spectra[tID]
@@ -987,19 +1455,46 @@ class PiccoloSpectrometers(PiccoloBaseComponent):
     
     NAME = "spectrometer"
 
-    def __init__(self,spectrometer_cfg,channels):
+    def __init__(self,spectrometer_cfg,channels,power_cfg=None,worker_cfg=None,compute_cfg=None,
+                 loop=None):
+        """
+        :param spectrometer_cfg: the spectrometer configuration
+        :param channels: the list of channels
+        :param power_cfg: the power sequencing configuration
+        :param worker_cfg: the worker configuration
+        :param compute_cfg: the configuration of the pool analysing spectra
+        :param loop: the event loop serving the spectrometers, the current
+                     loop if None
+        """
         super().__init__()
 
         self._channels = channels
         
         self._spectrometers = {}
 
+        if power_cfg is None:
+            power_cfg = {}
+        self._power_sequencer = PiccoloPowerSequencer(**power_cfg)
+        if worker_cfg is None:
+            worker_cfg = {}
+        if compute_cfg is None:
+            compute_cfg = {}
+        # the pool analysing spectra is shared by the spectrometers
+        self._compute = PiccoloComputePool(**compute_cfg)
+
+        # watch spectrometers being plugged in and removed
+        self._usb_monitor = None
+        if PiccoloUSBMonitor.available():
+            self._usb_monitor = PiccoloUSBMonitor()
+            self._usb_monitor.start()
+        else:
+            self.log.warning('cannot monitor USB devices, polling spectrometers')
+
         self.log.info('attached spectrometers:')
         for s in sb.list_devices():
             self.log.info('{0.model:15}\t{0.serial_number}'.format(s))        
 
         if len(self._spectrometers) == 0:
-            i = 0
             for sn in spectrometer_cfg:
                 sname = 'S_'+sn
                 calibration = {}
@@ -1007,13 +1502,21 @@ class PiccoloSpectrometers(PiccoloBaseComponent):
                     for c in spectrometer_cfg[sn]['calibration']:
                         if 'wavelengthCalibrationCoefficientsPiccolo' in spectrometer_cfg[sn]['calibration'][c]:
                             calibration[c] = spectrometer_cfg[sn]['calibration'][c]['wavelengthCalibrationCoefficientsPiccolo']
-                self.spectrometers[sname] = PiccoloSpectrometer(sn,channels,calibration,
+                # spectrometers are connected to all channels unless configured otherwise
+                schannels = [c for c in spectrometer_cfg[sn]['channels'] if c in channels]
+                if len(schannels) == 0:
+                    schannels = channels
+                self.spectrometers[sname] = PiccoloSpectrometer(sn,schannels,calibration,
                                                                 power_switch = spectrometer_cfg[sn]['power_switch'],
-                                                                power_delay = i *10
+                                                                power_sequencer = self._power_sequencer,
+                                                                usb_monitor = self._usb_monitor,
+                                                                compute = self._compute,
+                                                                loop = loop,
+                                                                **worker_cfg
                                                                 )
+                # applied once the spectrometer is connected
                 self.spectrometers[sname].TECenabled = spectrometer_cfg[sn]['fan']
                 self.spectrometers[sname].target_temperature = spectrometer_cfg[sn]['detectorSetTemperature']
-                i += 1
 
         for s in self.spectrometers:
             self.coapResources.add_resource([s],self.spectrometers[s].coapResources)
@@ -1022,16 +1525,22 @@ class PiccoloSpectrometers(PiccoloBaseComponent):
     def spectrometers(self):
         return self._spectrometers
 
-    @piccoloGET
+    @piccoloGET(cache='static')
     def get_spectrometers(self):
         spectrometers = list(self.spectrometers.keys())
         spectrometers.sort()
         return spectrometers
 
-    @piccoloGET
+    @piccoloGET(cache='static')
     def get_channels(self):
         return self._channels
 
+    @piccoloGET
+    def get_enumeration_time(self):
+        """the mean time in seconds spectrometers take to appear on the
+        USB bus after being switched on"""
+        return self._power_sequencer.enumeration_time
+
     def all_spec(self,action):
         result = []
         for s in self.spectrometers:
@@ -1043,16 +1552,16 @@ class PiccoloSpectrometers(PiccoloBaseComponent):
         else:
             return 'ok'
     
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def connect(self):
         return self.all_spec('connect')
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def disconnect(self):
         return self.all_spec('disconnect')
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def power_off(self):
         return self.all_spec('power_off')
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def power_on(self):
         return self.all_spec('power_on')
     
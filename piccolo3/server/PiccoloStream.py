@@ -0,0 +1,128 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+support for continuously streaming spectra
+
+A stream file starts with the magic string PICOSTRM, the format version and
+the length of a JSON encoded header (both little endian uint32) followed by
+the header itself. The header contains the metadata of the spectrometer and
+the number of pixels. Each frame consists of the POSIX timestamp (float64)
+followed by the pixel values (float32).
+"""
+
+__all__ = ['PiccoloRingBuffer','PiccoloStreamWriter','read_stream']
+
+import json
+import struct
+import threading
+import numpy
+
+MAGIC = b'PICOSTRM'
+VERSION = 1
+
+class PiccoloRingBuffer:
+    """fixed size buffer holding the most recent frames"""
+
+    def __init__(self,length,npixels):
+        """
+        :param length: the number of frames held
+        :param npixels: the number of pixels per frame
+        """
+        self._times = numpy.zeros(length)
+        self._frames = numpy.zeros((length,npixels),dtype=numpy.float32)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count,len(self._times))
+
+    @property
+    def count(self):
+        """the total number of frames appended"""
+        return self._count
+
+    def append(self,t,pixels):
+        with self._lock:
+            self._times[self._next] = t
+            self._frames[self._next,:] = pixels
+            self._next = (self._next+1)%len(self._times)
+            self._count += 1
+
+    def latest(self,n=1):
+        """get copies of the n most recent frames, oldest first
+
+        :return: tuple of times and frames
+        """
+        with self._lock:
+            n = min(n,len(self))
+            idx = numpy.arange(self._next-n,self._next)%len(self._times)
+            return self._times[idx],self._frames[idx]
+
+    def mean(self,n):
+        """average the n most recent frames
+
+        :return: tuple of the time of the most recent frame and the mean frame
+        """
+        times,frames = self.latest(n)
+        return times[-1],frames.mean(axis=0)
+
+class PiccoloStreamWriter:
+    """append frames to a stream file"""
+
+    def __init__(self,fname,header):
+        """
+        :param fname: name of the output file
+        :param header: dictionary written as the file header, must
+                       contain npixels
+        """
+        self._npixels = header['npixels']
+        h = json.dumps(header).encode()
+        self._out = open(fname,'wb')
+        self._out.write(MAGIC+struct.pack('<II',VERSION,len(h))+h)
+
+    def write(self,t,pixels):
+        self._out.write(struct.pack('<d',t))
+        self._out.write(numpy.asarray(pixels,dtype='<f4').tobytes())
+
+    def close(self):
+        self._out.close()
+
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        self.close()
+
+def read_stream(fname):
+    """read a stream file
+
+    :return: tuple of header, array of times and array of frames
+    """
+    with open(fname,'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError('{} is not a stream file'.format(fname))
+        version,hlen = struct.unpack('<II',f.read(8))
+        if version != VERSION:
+            raise RuntimeError('unsupported stream file version {}'.format(version))
+        header = json.loads(f.read(hlen).decode())
+        dtype = numpy.dtype([('time','<f8'),('pixels','<f4',(header['npixels'],))])
+        data = f.read()
+    # ignore an incomplete last frame
+    n = len(data)//dtype.itemsize
+    data = numpy.frombuffer(data,dtype=dtype,count=n)
+    return header,data['time'],data['pixels']
@@ -22,19 +22,80 @@
 
 __all__ = ['PiccoloSysinfo']
 
-from .PiccoloComponent import PiccoloBaseComponent, piccoloGET, piccoloPUT
+from .PiccoloComponent import PiccoloBaseComponent, piccoloGET, piccoloPUT, handler_latency
+from .PiccoloTrace import tracer
 from . import __version__
 import psutil
 import socket
 from datetime import datetime
 from pytz import utc
-import subprocess
+import asyncio
+import importlib
+import time
+from collections import OrderedDict
 
 class PiccoloSysinfo(PiccoloBaseComponent):
     """piccolo system information"""
     
     NAME = 'sysinfo'
 
+    def __init__(self,start_time=None):
+        """
+        :param start_time: the time (time.monotonic) the server was started,
+                           defaults to now
+        """
+        super().__init__()
+        if start_time is None:
+            start_time = time.monotonic()
+        self._start_time = start_time
+        self._phases = OrderedDict()
+        self._budgets = {}
+        self._imports = OrderedDict()
+
+    def startup_phase(self,phase,budget=None):
+        """record the time taken to reach a startup phase
+
+        :param phase: the name of the phase
+        :param budget: maximum time in seconds the phase should take
+        """
+        elapsed = time.monotonic()-self._start_time
+        self._phases[phase] = elapsed
+        self._budgets[phase] = budget
+        self.log.info('startup phase {} reached after {:.2f}s'.format(phase,elapsed))
+        if budget is not None and elapsed > budget:
+            self.log.warning('startup phase {} took {:.2f}s, exceeding budget of {}s'.format(
+                phase,elapsed,budget))
+        return elapsed
+
+    def import_modules(self,modules):
+        """import modules and record how long each import takes
+
+        The time recorded for a module excludes modules imported previously.
+
+        :param modules: list of module names
+        """
+        for m in modules:
+            t = time.monotonic()
+            try:
+                importlib.import_module(m)
+            except ImportError as e:
+                self.log.warning('failed to import {}: {}'.format(m,e))
+                continue
+            self._imports[m] = time.monotonic()-t
+        report = sorted(self._imports.items(),key=lambda i: i[1],reverse=True)
+        self.log.info('import times: '+', '.join(
+            '{} {:.2f}s'.format(m,t) for m,t in report))
+
+    @piccoloGET
+    def get_startup(self):
+        """get the time taken for each startup phase and the module import times"""
+        phases = []
+        for p in self._phases:
+            phases.append({'phase':p,
+                           'time':self._phases[p],
+                           'budget':self._budgets[p]})
+        return {'phases':phases,'imports':self._imports}
+
     @piccoloGET
     def get_cpu(self):
         """get cpu usage (percent)"""
@@ -43,29 +104,60 @@ class PiccoloSysinfo(PiccoloBaseComponent):
     def get_mem(self):
         """get memory usage (percent)"""
         return psutil.virtual_memory().percent
-    @piccoloGET
+    @piccoloGET(cache='static')
     def get_host(self):
         """get hostname"""
         return socket.gethostname()
-    @piccoloGET
+    @piccoloGET(snapshot=False)
     def get_clock(self):
         """get the current date and time"""
         return datetime.now(tz=utc).isoformat()
-    @piccoloGET
+    @piccoloGET(cache='static')
     def get_version(self):
         """get the server version"""
         return __version__
+    @piccoloGET(snapshot=False)
+    def get_handler_latency(self):
+        """get the latency statistics of the CoAP handlers in seconds"""
+        return handler_latency()
+    @piccoloGET(snapshot=False)
+    def get_request_histograms(self):
+        """get the latency histograms of the CoAP requests per path and method"""
+        return tracer.histograms()
+    @piccoloGET(snapshot=False)
+    def get_slow_requests(self):
+        """get the most recent requests exceeding the slow request threshold"""
+        return tracer.slow_requests()
+    @piccoloGET
+    def get_slow_threshold(self):
+        """get the time in seconds above which requests are logged as slow"""
+        return tracer.slow_threshold
+    @piccoloPUT
+    def set_slow_threshold(self,threshold):
+        """set the time in seconds above which requests are logged as slow
+
+        :param threshold: the threshold, None to disable logging"""
+        if threshold is not None:
+            threshold = float(threshold)
+            if threshold < 0:
+                raise Warning('slow request threshold must not be negative')
+        tracer.slow_threshold = threshold
+    @piccoloGET(snapshot=False)
+    def reset_traces(self):
+        """drop the request histograms and slow requests"""
+        tracer.reset()
     @piccoloPUT
-    def set_clock(self,clock):
+    async def set_clock(self,clock):
         """set the current date and time
 
         :param clock: isoformat date and time string used to set the time"""
         self.log.debug('setting system time to \'{}\''.format(clock))
-        cmdPipe = subprocess.Popen(['sudo','date','-s',clock],
-                                   stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-        if cmdPipe.wait()!=0:
-            raise OSError('setting time to \'{}\': {}'.format(clock,
-                                                              cmdPipe.stderr.read().decode()))
+        proc = await asyncio.create_subprocess_exec('sudo','date','-s',clock,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        stdout,stderr = await proc.communicate()
+        if proc.returncode!=0:
+            raise OSError('setting time to \'{}\': {}'.format(clock,stderr.decode()))
 
 if __name__ == '__main__':
     from piccolo3.common import piccoloLogging
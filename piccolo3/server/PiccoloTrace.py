@@ -0,0 +1,198 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+trace the CoAP requests handled by the server
+
+Every request handled by a piccolo resource produces a trace recording the
+path, the method, the size of the arguments, the time spent in the handler
+and encoding the result and the size of the payload. The tracer keeps a
+latency histogram per path and method and logs requests exceeding the slow
+request threshold.
+"""
+
+__all__ = ['PiccoloHistogram','PiccoloTrace','PiccoloTracer','tracer','configure_tracer']
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pytz import utc
+
+# upper edges of the histogram bins in seconds, the last bin is unbounded
+HISTOGRAM_EDGES = [0.001,0.002,0.005,0.01,0.02,0.05,0.1,0.2,0.5,1.,2.,5.,10.]
+# requests taking longer than this many seconds are logged as slow
+SLOW_THRESHOLD = 0.5
+# the number of slow requests kept in memory
+SLOW_HISTORY = 100
+
+class PiccoloHistogram:
+    """histogram of request durations"""
+
+    def __init__(self,edges=HISTOGRAM_EDGES):
+        """
+        :param edges: the upper edges of the bins in seconds
+        """
+        self._edges = list(edges)
+        self._counts = [0]*(len(self._edges)+1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self,dt):
+        self._counts[bisect.bisect_left(self._edges,dt)] += 1
+        self.count += 1
+        self.total += dt
+        self.max = max(self.max,dt)
+
+    def quantile(self,q):
+        """estimate a quantile from the upper edge of its bin
+
+        :return: the upper edge in seconds, the maximum if the quantile falls
+                 into the last bin, None if the histogram is empty
+        """
+        if self.count == 0:
+            return None
+        n = q*self.count
+        c = 0
+        for i in range(len(self._edges)):
+            c += self._counts[i]
+            if c >= n:
+                return self._edges[i]
+        return self.max
+
+    def tolist(self):
+        return {'edges':self._edges,
+                'counts':self._counts,
+                'count':self.count,
+                'mean':self.total/self.count if self.count>0 else None,
+                'max':self.max,
+                'p50':self.quantile(0.5),
+                'p95':self.quantile(0.95)}
+
+class PiccoloTrace:
+    """the trace of a single request"""
+
+    __slots__ = ['time','path','method','args_size','handler','encode',
+                 'payload_size','cached','code','_start','total']
+
+    def __init__(self,path,method,args_size=0):
+        """
+        :param path: the path of the resource
+        :param method: the request method
+        :param args_size: the size in bytes of the arguments
+        """
+        self.time = datetime.now(tz=utc).isoformat()
+        self.path = path
+        self.method = method
+        self.args_size = args_size
+        self.handler = 0.
+        self.encode = 0.
+        self.payload_size = 0
+        self.cached = False
+        self.code = None
+        self._start = time.monotonic()
+        self.total = None
+
+    def finish(self,response):
+        """record the response and the total time taken"""
+        self.total = time.monotonic()-self._start
+        self.payload_size = len(response.payload)
+        self.code = str(response.code)
+        return self
+
+    def tolist(self):
+        return {s:getattr(self,s) for s in self.__slots__ if not s.startswith('_')}
+
+class PiccoloTracer:
+    """collect request traces"""
+
+    def __init__(self,slow_threshold=SLOW_THRESHOLD,history=SLOW_HISTORY):
+        """
+        :param slow_threshold: requests taking longer than this many seconds
+                               are logged as slow
+        :param history: the number of slow requests kept
+        """
+        self._log = logging.getLogger('piccolo.trace')
+        self._lock = threading.Lock()
+        self.slow_threshold = slow_threshold
+        self._slow = deque(maxlen=history)
+        self._histograms = {}
+
+    def configure(self,slow_threshold=None,history=None,slow_log=None):
+        """
+        :param slow_threshold: requests taking longer than this many seconds
+                               are logged as slow
+        :param history: the number of slow requests kept
+        :param slow_log: name of a file slow requests are written to
+        """
+        with self._lock:
+            if slow_threshold is not None:
+                self.slow_threshold = slow_threshold
+            if history is not None:
+                self._slow = deque(self._slow,maxlen=history)
+        if slow_log is not None:
+            handler = logging.FileHandler(slow_log)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self._log.addHandler(handler)
+
+    def record(self,trace):
+        with self._lock:
+            key = (trace.path,trace.method)
+            if key not in self._histograms:
+                self._histograms[key] = PiccoloHistogram()
+            self._histograms[key].add(trace.total)
+            slow = self.slow_threshold is not None and trace.total > self.slow_threshold
+            if slow:
+                self._slow.append(trace)
+        if slow:
+            self._log.warning('slow request {} {}: total {:.3f}s, handler {:.3f}s, '
+                              'encode {:.3f}s, args {}B, payload {}B'.format(
+                                  trace.method,trace.path,trace.total,trace.handler,
+                                  trace.encode,trace.args_size,trace.payload_size))
+
+    def histograms(self):
+        """the latency histograms
+
+        :return: dictionary mapping paths to dictionaries of histograms
+                 per method
+        """
+        with self._lock:
+            hists = {}
+            for (path,method),h in self._histograms.items():
+                hists.setdefault(path,{})[method] = h.tolist()
+        return hists
+
+    def slow_requests(self):
+        """the most recent slow requests, oldest first"""
+        with self._lock:
+            return [t.tolist() for t in self._slow]
+
+    def reset(self):
+        """drop the histograms and slow requests"""
+        with self._lock:
+            self._histograms = {}
+            self._slow.clear()
+
+# the tracer used by all piccolo resources
+tracer = PiccoloTracer()
+
+def configure_tracer(slow_threshold=None,history=None,slow_log=None):
+    """configure the tracer used by all piccolo resources"""
+    tracer.configure(slow_threshold=slow_threshold,history=history,slow_log=slow_log)
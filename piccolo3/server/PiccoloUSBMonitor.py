@@ -0,0 +1,162 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+watch spectrometers being plugged in and removed
+
+udev events are used if pyudev is available, otherwise the USB devices
+listed in sysfs are polled.
+"""
+
+__all__ = ['PiccoloUSBMonitor']
+
+from .PiccoloWorkerThreads import PiccoloThread
+import os, os.path
+import threading
+import time
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+# USB vendor IDs of Ocean Optics spectrometers
+VENDOR_IDS = ['2457']
+SYSFS_USB = '/sys/bus/usb/devices'
+
+def _read_attribute(path,attribute):
+    try:
+        with open(os.path.join(path,attribute)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+class PiccoloUSBMonitor(PiccoloThread):
+    """thread reporting spectrometers being added and removed
+
+    Listeners are called with the action (add or remove) and the serial
+    number of the device. The serial number is None if the device does not
+    report it.
+    """
+
+    def __init__(self,poll_interval=2.,daemon=True):
+        """
+        :param poll_interval: time in seconds between scanning sysfs if
+                              udev is not available
+        """
+        super().__init__('usb_monitor',daemon=daemon)
+
+        self._poll_interval = poll_interval
+        self._listeners = []
+        self._lock = threading.Lock()
+
+        self._monitor = None
+        if pyudev is not None:
+            context = pyudev.Context()
+            self._monitor = pyudev.Monitor.from_netlink(context)
+            self._monitor.filter_by('usb',device_type='usb_device')
+            self._monitor.start()
+        else:
+            self.log.info('pyudev not available, polling {}'.format(SYSFS_USB))
+
+        # map of device paths to serial numbers of devices present
+        self._devices = self.scan()
+
+    @staticmethod
+    def available():
+        """check whether USB devices can be monitored"""
+        return pyudev is not None or os.path.isdir(SYSFS_USB)
+
+    def add_listener(self,listener):
+        """register a function called when a device is added or removed"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    @property
+    def devices(self):
+        """the serial numbers of the spectrometers present"""
+        return list(self._devices.values())
+
+    def scan(self):
+        """find the spectrometers listed in sysfs
+
+        :return: dictionary mapping device paths to serial numbers
+        """
+        devices = {}
+        try:
+            entries = os.listdir(SYSFS_USB)
+        except OSError:
+            return devices
+        for d in entries:
+            path = os.path.join(SYSFS_USB,d)
+            if _read_attribute(path,'idVendor') in VENDOR_IDS:
+                devices[os.path.realpath(path)] = _read_attribute(path,'serial')
+        return devices
+
+    def _notify(self,action,serial):
+        self.log.info('spectrometer {} {}'.format(serial,
+                                                  'added' if action == 'add' else 'removed'))
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(action,serial)
+            except Exception as e:
+                self.log.error('USB listener failed: {}'.format(e))
+
+    def _poll_udev(self):
+        while True:
+            device = self._monitor.poll()
+            if device is None:
+                continue
+            if device.properties.get('ID_VENDOR_ID') not in VENDOR_IDS:
+                continue
+            path = device.sys_path
+            if device.action == 'add':
+                serial = device.properties.get('ID_SERIAL_SHORT')
+                self._devices[path] = serial
+                self._notify('add',serial)
+            elif device.action == 'remove':
+                serial = self._devices.pop(path,device.properties.get('ID_SERIAL_SHORT'))
+                self._notify('remove',serial)
+
+    def _poll_sysfs(self):
+        while True:
+            time.sleep(self._poll_interval)
+            devices = self.scan()
+            for path in self._devices:
+                if path not in devices:
+                    self._notify('remove',self._devices[path])
+            for path in devices:
+                if path not in self._devices:
+                    self._notify('add',devices[path])
+            self._devices = devices
+
+    def run(self):
+        if self._monitor is not None:
+            self._poll_udev()
+        else:
+            self._poll_sysfs()
+
+if __name__ == '__main__':
+    from piccolo3.common import piccoloLogging
+    piccoloLogging(debug=True)
+
+    monitor = PiccoloUSBMonitor(daemon=False)
+    print ('spectrometers present: {}'.format(monitor.devices))
+    monitor.add_listener(lambda action,serial: print (action,serial))
+    monitor.start()
@@ -0,0 +1,509 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+run a worker in its own process
+
+The worker runs unchanged in a child process. A supervisor thread in the
+server process takes the place of the worker thread: it forwards a command
+from the task queue over a pipe whenever the worker asks for one, passes
+replies, info messages and log records back and mirrors the busy lock.
+Commands wait in the task queue of the server process so that its admission
+policies apply. Pixel arrays of info messages are passed through shared
+memory. The child sends a heartbeat every second while the worker makes
+progress, ie it waits for a command, takes a command or touches the task
+queue while processing one. If the child dies or stops sending heartbeats
+it is killed and restarted.
+"""
+
+__all__ = ['PiccoloWorkerProcess']
+
+from .PiccoloWorkerThreads import PiccoloThread, PiccoloCommand, PiccoloCommandQueue
+from piccolo3.common import PiccoloSpectrometerStatus
+import multiprocessing
+import threading
+import logging
+import itertools
+import time
+import os
+from queue import Queue, Empty
+from concurrent.futures import Future
+import numpy
+
+# time in seconds between heartbeats of the child process
+HEARTBEAT_INTERVAL = 1.
+# the child is restarted if it does not send a heartbeat for this many seconds
+HANG_TIMEOUT = 60.
+# time in seconds waited before restarting the child, doubled after each
+# failure up to the maximum
+RESTART_DELAY = 1.
+RESTART_MAX_DELAY = 60.
+# the number of frames that can be in transit and the maximum frame size
+FRAME_SLOTS = 4
+FRAME_PIXELS = 4096
+# info messages whose last value is a pixel array
+FRAME_KEYS = ['spectrum','live']
+
+class _SharedFrame:
+    """reference to a frame in shared memory"""
+    def __init__(self,slot,npixels):
+        self.slot = slot
+        self.npixels = npixels
+
+def _frames(buf):
+    return numpy.frombuffer(buf,dtype=numpy.float64).reshape((FRAME_SLOTS,FRAME_PIXELS))
+
+class _ChildConnection:
+    """thread safe sending end of the pipe in the child"""
+    def __init__(self,conn):
+        self._conn = conn
+        self._lock = threading.Lock()
+    def send(self,*msg):
+        with self._lock:
+            self._conn.send(msg)
+
+class _ForwardedCommand(PiccoloCommand):
+    """a command forwarded by the supervisor"""
+    __slots__ = ['cid']
+
+class _ChildCommandQueue(PiccoloCommandQueue):
+    """task queue asking the supervisor for commands
+
+    The supervisor is asked for a command when the worker waits for a task
+    and none is queued locally. Finished commands that were forwarded by
+    the supervisor are reported back.
+    """
+    def __init__(self,conn):
+        super().__init__()
+        self._conn = conn
+        self._requested = False
+        # whether the worker is processing a task taken by its main loop
+        self._processing = False
+        # the id of the forwarded command being processed
+        self._cid = None
+        # whether the worker is waiting for a task
+        self.idle = False
+    def forward(self,command):
+        with self._lock:
+            self._requested = False
+        self.put(command)
+    def get(self,block=True,timeout=None):
+        with self._lock:
+            if not self._requested and self._queue.empty():
+                self._requested = True
+                self._conn.send('ready')
+        self.idle = block
+        try:
+            task = super().get(block=block,timeout=timeout)
+        finally:
+            self.idle = False
+        if not self._processing:
+            # tasks taken while processing a task are handled by it
+            self._processing = True
+            self._cid = getattr(task,'cid',None)
+        return task
+    def done(self):
+        super().done()
+        self._processing = False
+        if self._cid is not None:
+            self._conn.send('done',self._cid)
+            self._cid = None
+
+class _ChildBusyLock:
+    """busy lock mirrored by the supervisor"""
+    def __init__(self,conn):
+        self._conn = conn
+        self._lock = threading.Lock()
+    def acquire(self,*args,**kwargs):
+        result = self._lock.acquire(*args,**kwargs)
+        if result:
+            self._conn.send('busy',True)
+        return result
+    def release(self):
+        self._conn.send('busy',False)
+        self._lock.release()
+    def locked(self):
+        return self._lock.locked()
+
+class _ChildInfoQueue:
+    """info queue forwarding messages to the supervisor"""
+    def __init__(self,conn,buf):
+        self._conn = conn
+        self._frames = _frames(buf)
+        self._free = Queue()
+        for i in range(FRAME_SLOTS):
+            self._free.put(i)
+    def release(self,slot):
+        self._free.put(slot)
+    def put(self,item,block=True,timeout=None):
+        if item is not None and item[0] in FRAME_KEYS and item[1][-1] is not None:
+            key,value = item
+            pixels = numpy.asarray(value[-1],dtype=numpy.float64)
+            if len(pixels) <= FRAME_PIXELS:
+                try:
+                    slot = self._free.get(timeout=HEARTBEAT_INTERVAL)
+                except Empty:
+                    # the supervisor is lagging, send the pixels inline
+                    slot = None
+                if slot is not None:
+                    self._frames[slot,:len(pixels)] = pixels
+                    item = (key,tuple(value[:-1])+(_SharedFrame(slot,len(pixels)),))
+        self._conn.send('info',item)
+
+class _ChildSequencer:
+    """forward power sequencer calls to the supervisor"""
+    def __init__(self,conn):
+        self._conn = conn
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+    def reply(self,cid):
+        with self._lock:
+            event = self._pending.pop(cid,None)
+        if event is not None:
+            event.set()
+    def power_on(self,name,switch_on):
+        cid = next(self._ids)
+        event = threading.Event()
+        with self._lock:
+            self._pending[cid] = event
+        self._conn.send('power_on',cid,name)
+        event.wait()
+        switch_on()
+    def enumerated(self,name):
+        self._conn.send('enumerated',name)
+    def release(self,name):
+        self._conn.send('release',name)
+
+class _ChildLogHandler(logging.Handler):
+    """send log records to the supervisor"""
+    def __init__(self,conn):
+        super().__init__()
+        self._conn = conn
+    def emit(self,record):
+        try:
+            self._conn.send('log',record.name,record.levelno,self.format(record))
+        except Exception:
+            pass
+
+def _run_child(worker_class,conn,buf,args,kwargs,sequencer,level):
+    """the main function of the child process"""
+    conn = _ChildConnection(conn)
+
+    handler = _ChildLogHandler(conn)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    tasks = _ChildCommandQueue(conn)
+    info = _ChildInfoQueue(conn,buf)
+    if sequencer:
+        sequencer = _ChildSequencer(conn)
+        kwargs['power_sequencer'] = sequencer
+    worker = worker_class(*args,_ChildBusyLock(conn),tasks,Queue(),info,**kwargs)
+    stopping = threading.Event()
+
+    def heartbeat():
+        # only beat while the worker makes progress so that a command
+        # stuck in the device stops the heartbeat
+        progress = None
+        while not stopping.wait(HEARTBEAT_INTERVAL):
+            if tasks.idle or tasks.progress != progress:
+                conn.send('heartbeat')
+            progress = tasks.progress
+    def watch():
+        worker.join()
+        if not stopping.is_set():
+            worker.log.error('worker thread died')
+            os._exit(1)
+        conn.send('exit')
+        os._exit(0)
+    worker.start()
+    threading.Thread(target=heartbeat,daemon=True).start()
+    threading.Thread(target=watch,daemon=True).start()
+
+    def reply(cid,future):
+        try:
+            conn.send('reply',cid,future.result(),None)
+        except Exception as e:
+            conn.send('reply',cid,None,str(e))
+
+    while True:
+        try:
+            msg = conn._conn.recv()
+        except EOFError:
+            # the server went away
+            os._exit(1)
+        if msg[0] == 'command':
+            cid,name,cargs = msg[1:]
+            command = _ForwardedCommand(name,*cargs)
+            command.cid = cid
+            command.future = Future()
+            command.future.add_done_callback(lambda f,cid=cid: reply(cid,f))
+            tasks.forward(command)
+        elif msg[0] == 'shutdown':
+            stopping.set()
+            tasks.put(None)
+        elif msg[0] == 'frame':
+            info.release(msg[1])
+        elif msg[0] == 'power_on':
+            sequencer.reply(msg[1])
+
+class PiccoloWorkerProcess(PiccoloThread):
+    """supervise a worker running in a child process
+
+    The object stands in for the worker thread. It takes commands from the
+    task queue and puts the messages of the worker onto the info queue.
+    """
+
+    def __init__(self,worker_class,name,busy,tasks,results,info,args=(),kwargs=None,
+                 hang_timeout=HANG_TIMEOUT,restarted=None,daemon=True):
+        """
+        :param worker_class: the worker class, it is called with args, busy,
+                             tasks, results, info and kwargs in the child
+        :param name: a descriptive name used for logging
+        :param busy: the busy lock of the frontend
+        :param tasks: the task queue
+        :type tasks: PiccoloCommandQueue
+        :param results: the results queue used to reply to commands submitted
+                        without a future
+        :param info: the info queue
+        :param args: the leading positional arguments of the worker
+        :param kwargs: the keyword arguments of the worker, a power_sequencer
+                       stays in the server process and is called by the child
+        :param hang_timeout: the child is restarted if it does not send a
+                             heartbeat for this many seconds
+        :param restarted: function called after the child was restarted
+        """
+        super().__init__(name,daemon=daemon)
+
+        self._workerClass = worker_class
+        self._busy = busy
+        self._tQ = tasks
+        self._rQ = results
+        self._iQ = info
+        self._args = args
+        self._kwargs = {} if kwargs is None else dict(kwargs)
+        self._sequencer = self._kwargs.pop('power_sequencer',None)
+        self._hangTimeout = hang_timeout
+        self._restarted = restarted
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._buf = self._ctx.RawArray('d',FRAME_SLOTS*FRAME_PIXELS)
+        self._frames = _frames(self._buf)
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._process = None
+        self._ids = itertools.count()
+        self._pending = {}
+        # set when the child asks for a command
+        self._ready = threading.Event()
+        self._holdsBusy = False
+        self._stopping = False
+        self._restarts = 0
+        self._status = PiccoloSpectrometerStatus.NO_WORKER
+        self._infoClosed = False
+
+    @property
+    def status(self):
+        """the status last reported by the worker"""
+        return self._status
+    @property
+    def pid(self):
+        if self._process is not None:
+            return self._process.pid
+    @property
+    def restarts(self):
+        """the number of times the child was restarted"""
+        return self._restarts
+
+    def is_alive(self):
+        return super().is_alive() and self._process is not None and self._process.is_alive()
+
+    def _send(self,*msg):
+        with self._lock:
+            if self._conn is None:
+                raise RuntimeError('worker process {} is not running'.format(self.name))
+            self._conn.send(msg)
+
+    def _spawn(self):
+        conn,child = self._ctx.Pipe()
+        level = logging.getLogger('piccolo').getEffectiveLevel()
+        process = self._ctx.Process(target=_run_child,name=self.name,daemon=True,
+                                    args=(self._workerClass,child,self._buf,self._args,
+                                          self._kwargs,self._sequencer is not None,level))
+        process.start()
+        child.close()
+        with self._lock:
+            self._conn = conn
+            self._process = process
+        self.log.info('started worker process {}'.format(process.pid))
+
+    def _forward(self):
+        """forward a command from the task queue whenever the child asks"""
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            command = self._tQ.get()
+            if command is None or command == 'shutdown':
+                self._stopping = True
+                try:
+                    self._send('shutdown')
+                except Exception:
+                    pass
+                return
+            command = PiccoloCommand.from_task(command)
+            cid = next(self._ids)
+            self._pending[cid] = command
+            try:
+                self._send('command',cid,command.name,command.args)
+            except Exception as e:
+                self._pending.pop(cid,None)
+                self._fail(command,str(e))
+                self._tQ.done()
+                # ask the next child
+                self._ready.clear()
+
+    def _fail(self,command,msg):
+        if command.future is not None and not command.future.done():
+            command.future.set_exception(RuntimeError(msg))
+
+    def _set_busy(self,busy):
+        if busy and not self._holdsBusy:
+            self._busy.acquire()
+            self._holdsBusy = True
+        elif not busy and self._holdsBusy:
+            self._holdsBusy = False
+            self._busy.release()
+
+    def _handle(self,msg):
+        """handle a message from the child"""
+        kind = msg[0]
+        if kind == 'info':
+            item = msg[1]
+            if item is not None and item[0] in FRAME_KEYS and isinstance(item[1][-1],_SharedFrame):
+                frame = item[1][-1]
+                pixels = self._frames[frame.slot,:frame.npixels].copy()
+                self._send('frame',frame.slot)
+                item = (item[0],tuple(item[1][:-1])+(pixels,))
+            if item is None:
+                self._infoClosed = True
+            elif item[0] == 'status':
+                self._status = item[1]
+            self._iQ.put(item)
+        elif kind == 'reply':
+            cid,result,error = msg[1:]
+            command = self._pending.pop(cid,None)
+            if command is None:
+                return
+            if error is not None:
+                self._fail(command,error)
+            elif command.future is not None:
+                if not command.future.done():
+                    command.future.set_result(result)
+            else:
+                self._rQ.put(result)
+        elif kind == 'ready':
+            self._ready.set()
+        elif kind == 'done':
+            # a command forwarded by the supervisor finished
+            self._tQ.done()
+        elif kind == 'busy':
+            self._set_busy(msg[1])
+        elif kind == 'log':
+            logging.getLogger(msg[1]).log(msg[2],msg[3])
+        elif kind == 'power_on':
+            cid,name = msg[1:]
+            def power_on():
+                self._sequencer.power_on(name,lambda: None)
+                self._send('power_on',cid)
+            threading.Thread(target=power_on,daemon=True).start()
+        elif kind == 'enumerated':
+            self._sequencer.enumerated(msg[1])
+        elif kind == 'release':
+            self._sequencer.release(msg[1])
+
+    def _receive(self):
+        """handle messages until the child exits or hangs
+
+        :return: True if the child exited after being told to shut down
+        """
+        last = time.monotonic()
+        while True:
+            try:
+                if self._conn.poll(HEARTBEAT_INTERVAL):
+                    msg = self._conn.recv()
+                    if msg[0] == 'heartbeat':
+                        last = time.monotonic()
+                    elif msg[0] == 'exit':
+                        return True
+                    else:
+                        self._handle(msg)
+                if time.monotonic()-last > self._hangTimeout:
+                    self.log.error('worker process {} made no progress for {}s, killing it'.format(
+                        self._process.pid,self._hangTimeout))
+                    self._process.kill()
+                    return False
+            except (EOFError,OSError):
+                return self._stopping
+
+    def _cleanup(self):
+        """tidy up after the child exited"""
+        with self._lock:
+            conn = self._conn
+            self._conn = None
+        conn.close()
+        self._process.join(timeout=5)
+        for cid in list(self._pending):
+            self._fail(self._pending.pop(cid),'worker process {} died'.format(self.name))
+        self._ready.clear()
+        self._set_busy(False)
+        if self._tQ.active:
+            # the command being processed died with the child
+            self._tQ.done()
+
+    def run(self):
+        delay = RESTART_DELAY
+        while True:
+            self._spawn()
+            if self._restarts == 0:
+                # commands wait in the task queue while the child is restarted
+                threading.Thread(target=self._forward,name='{}.forward'.format(self.name),
+                                 daemon=True).start()
+            if self._restarts > 0 and self._restarted is not None:
+                self._restarted()
+            started = time.monotonic()
+            stopped = self._receive()
+            self._cleanup()
+            if stopped or self._stopping:
+                break
+            self.log.error('worker process exited with code {}'.format(self._process.exitcode))
+            self._status = PiccoloSpectrometerStatus.NO_WORKER
+            self._iQ.put(('status',self._status))
+            if time.monotonic()-started > RESTART_MAX_DELAY:
+                delay = RESTART_DELAY
+            self.log.info('restarting worker process in {}s'.format(delay))
+            time.sleep(delay)
+            delay = min(2*delay,RESTART_MAX_DELAY)
+            if self._stopping:
+                break
+            self._restarts += 1
+        if not self._infoClosed:
+            self._iQ.put(None)
+        self.log.info('Stopped worker process')
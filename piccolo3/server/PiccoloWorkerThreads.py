@@ -20,11 +20,191 @@
 
 """
 
-__all__ = ['PiccoloThread','PiccoloWorkerThread']
+__all__ = ['PiccoloThread','PiccoloWorkerThread','PiccoloCommand','PiccoloCommandQueue',
+           'piccoloTask']
 
 import threading
 import logging
-from queue import Empty
+from queue import Queue, Empty
+from concurrent.futures import Future
+
+class PiccoloCommand:
+    """a command sent to a worker thread"""
+
+    __slots__ = ['name','args','future']
+
+    def __init__(self,name,*args):
+        """
+        :param name: the name of the command used to look up the handler
+        :param args: the arguments passed to the handler
+        """
+        self.name = name
+        self.args = args
+        # the reply of the worker is passed back through the future
+        self.future = None
+
+    @classmethod
+    def from_task(cls,task):
+        """convert a task, a string or a tuple of name and arguments, to a command"""
+        if isinstance(task,cls):
+            return task
+        if isinstance(task,str):
+            return cls(task)
+        return cls(task[0],*task[1:])
+
+    def __getitem__(self,i):
+        return ((self.name,)+self.args)[i]
+
+    def __eq__(self,other):
+        if isinstance(other,str):
+            # a command without arguments matches its name
+            return len(self.args) == 0 and self.name == other
+        if isinstance(other,PiccoloCommand):
+            return self.name == other.name and self.args == other.args
+        return NotImplemented
+
+    def __hash__(self):
+        if len(self.args) == 0:
+            return hash(self.name)
+        return hash((self.name,)+self.args)
+
+    def __repr__(self):
+        return 'PiccoloCommand({})'.format(', '.join(repr(a) for a in (self.name,)+self.args))
+
+class PiccoloCommandQueue:
+    """bounded command queue of a worker thread
+
+    Commands are admitted according to a policy:
+
+    reject
+      fail if the worker is processing a command or commands are waiting
+    enqueue
+      queue the command, fail if the queue is full
+    coalesce
+      share the reply with an identical command that is still waiting,
+      otherwise enqueue
+
+    Commands registered with set_cached are answered by the calling thread
+    from state cached outside the worker. Background tasks, such as health
+    checks, neither count as waiting nor mark the worker as active.
+    """
+
+    POLICIES = ['reject','enqueue','coalesce']
+    BACKGROUND = ['check']
+
+    def __init__(self,maxsize=16):
+        """
+        :param maxsize: the maximum number of waiting commands
+        """
+        self._maxsize = maxsize
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._waiting = {}
+        # the number of waiting tasks that are not background tasks
+        self._pending = 0
+        self._active = False
+        # incremented whenever the worker takes a task or reports progress
+        self._progress = 0
+        self._cached = {}
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def active(self):
+        """whether the worker is processing a command"""
+        return self._active
+
+    @property
+    def progress(self):
+        """counter incremented while the worker makes progress"""
+        return self._progress
+
+    def touch(self):
+        """the worker is making progress while processing a command"""
+        self._progress += 1
+
+    def _background(self,task):
+        return isinstance(task,(str,PiccoloCommand)) and task in self.BACKGROUND
+
+    def set_cached(self,name,func):
+        """answer command name by calling func instead of the worker"""
+        self._cached[name] = func
+
+    def submit(self,command,policy='enqueue'):
+        """submit a command to the worker
+
+        :param command: the command
+        :type command: PiccoloCommand
+        :param policy: the admission policy
+        :return: future holding the reply of the worker
+        :rtype: concurrent.futures.Future
+        """
+        if policy not in self.POLICIES:
+            raise ValueError('unknown admission policy {}'.format(policy))
+        command = PiccoloCommand.from_task(command)
+        future = Future()
+        if command.name in self._cached:
+            try:
+                future.set_result(self._cached[command.name](*command.args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self._lock:
+            if policy == 'coalesce' and command in self._waiting:
+                return self._waiting[command].future
+            if policy == 'reject' and (self._active or self._pending>0):
+                future.set_exception(Warning('worker is busy'))
+                return future
+            if self._queue.qsize() >= self.maxsize:
+                future.set_exception(Warning('too many commands waiting'))
+                return future
+            command.future = future
+            if policy == 'coalesce':
+                self._waiting[command] = command
+            self._pending += 1
+            self._queue.put(command)
+        return future
+
+    def put(self,task,block=True,timeout=None):
+        """queue a task bypassing admission, eg to stop the worker"""
+        with self._lock:
+            if not self._background(task):
+                self._pending += 1
+            self._queue.put(task)
+
+    def get(self,block=True,timeout=None):
+        task = self._queue.get(block=block,timeout=timeout)
+        with self._lock:
+            self._progress += 1
+            if not self._background(task):
+                if isinstance(task,PiccoloCommand):
+                    self._waiting.pop(task,None)
+                self._pending -= 1
+                self._active = True
+        return task
+
+    def done(self):
+        """the worker finished processing a command"""
+        with self._lock:
+            self._active = False
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def empty(self):
+        return self._queue.empty()
+
+def piccoloTask(name):
+    """decorator registering a worker method as the handler of a command
+
+    :param name: the name of the command
+    """
+    def decorator_task(func):
+        func.TASK = name
+        return func
+    return decorator_task
 
 class PiccoloThread(threading.Thread):
     """base piccolo threading class"""
@@ -43,7 +223,15 @@ class PiccoloThread(threading.Thread):
         return self._log
 
 class PiccoloWorkerThread(PiccoloThread):
-    """base class for handling piccolo worker threads"""
+    """base class for handling piccolo worker threads
+
+    Commands are dispatched to the methods decorated with piccoloTask. The
+    worker blocks until a command arrives. If health_interval is set, a
+    check command is queued periodically which calls check_ok.
+    """
+
+    # time in seconds between health checks, None to disable them
+    health_interval = None
 
     def __init__(self,name,busy, tasks, results,info,daemon=True):
         """initialise worker thread
@@ -53,8 +241,9 @@ class PiccoloWorkerThread(PiccoloThread):
         :param busy: a "lock" which prevents using the spectrometer when it is busy
         :type busy: thread.lock
         :param tasks: a queue into which tasks will be put
-        :type tasks: Queue.Queue
-        :param results: the results queue from where results will be collected
+        :type tasks: PiccoloCommandQueue
+        :param results: the results queue used to reply to commands submitted
+                        without a future
         :type results: Queue.Queue
         :param info: queue for reporting back info
         :type info: Queue.Queue
@@ -68,6 +257,18 @@ class PiccoloWorkerThread(PiccoloThread):
         self._rQ = results
         self._iQ = info
 
+        # the command handlers
+        self._handlers = {}
+        for klass in reversed(type(self).__mro__):
+            for a in vars(klass):
+                attrib = getattr(klass,a)
+                if hasattr(attrib,'TASK'):
+                    self._handlers[attrib.TASK] = getattr(self,a)
+
+        self._stopped = threading.Event()
+        self._checkPending = threading.Event()
+        self._current = None
+
     @property
     def busy(self):
         """the busy lock"""
@@ -93,6 +294,7 @@ class PiccoloWorkerThread(PiccoloThread):
 
         if task is None:
             task = 'shutdown'
+        task = PiccoloCommand.from_task(task)
         
         self.log.debug('got task {}'.format(task))
 
@@ -103,31 +305,80 @@ class PiccoloWorkerThread(PiccoloThread):
 
     def check_ok(self):
         pass
-    
+
+    def reply(self,result,command=None):
+        """reply to a command
+
+        :param result: the reply
+        :param command: the command, defaults to the command being processed
+        """
+        if command is None:
+            command = self._current
+        if command is not None and command.future is not None:
+            if not command.future.done():
+                command.future.set_result(result)
+        else:
+            self.results.put(result)
+
+    @piccoloTask('check')
+    def _check(self):
+        self._checkPending.clear()
+        self.check_ok()
+
+    def _schedule_health_checks(self):
+        """queue a health check every health_interval seconds"""
+        while not self._stopped.wait(self.health_interval):
+            # do not pile up checks while the worker is busy
+            if not self._checkPending.is_set():
+                self._checkPending.set()
+                self.tasks.put(PiccoloCommand('check'))
+
     def run(self):
+        if self.health_interval is not None:
+            threading.Thread(target=self._schedule_health_checks,
+                             name='{}.health'.format(self.name),
+                             daemon=True).start()
         while True:
             # wait for a new task from the task queue
-            task = self.get_task(timeout=1)
+            task = self.get_task()
             if task is None:
-                self.check_ok()
+                self.tasks.done()
                 continue
 
-            if self.busy.locked():
-                self.results.put('worker {} is busy'.format(self.name))
+            if task == 'check':
+                # health checks do not need the busy lock
+                self._check()
+                self.tasks.done()
                 continue
+
+            # the frontend might hold the lock briefly while waiting for
+            # the worker to finish
             self.busy.acquire()
                         
             if task == 'shutdown':
                 # The worker thread can be stopped by putting a None onto the task queue.
+                self._stopped.set()
                 self.info.put(None)
                 self.stop()
                 self.log.info('Stopped worker thread')
                 return
 
-            self.process_task(task)
-
-            self.busy.release()
+            self._current = PiccoloCommand.from_task(task)
+            try:
+                self.process_task(self._current)
+            finally:
+                # make sure nobody waits for a reply forever
+                if self._current.future is not None and not self._current.future.done():
+                    self._current.future.set_result(None)
+                self._current = None
+                self.tasks.done()
+                self.busy.release()
 
     def process_task(self,task):
-        """process task"""
-        raise NotImplementedError
+        """call the handler of a command"""
+        task = PiccoloCommand.from_task(task)
+        handler = self._handlers.get(task.name)
+        if handler is None:
+            self.reply('unknown task: {}'.format(task))
+            return
+        handler(*task.args)
@@ -15,19 +15,42 @@
 # You should have received a copy of the GNU General Public License
 # along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
 
-from pkg_resources import get_distribution, DistributionNotFound
 try:
-    __version__ = get_distribution('piccolo3-server').version
-except DistributionNotFound:
+    from importlib.metadata import version, PackageNotFoundError
+except ImportError:
+    # python < 3.8
+    from pkg_resources import get_distribution, DistributionNotFound as PackageNotFoundError
+    def version(dist):
+        return get_distribution(dist).version
+try:
+    __version__ = version('piccolo3-server')
+except PackageNotFoundError:
     # package is not installed
     pass
 
+import importlib
+
 from .PiccoloServerConfig import *
 from .PiccoloConfig import *
+from .PiccoloTrace import *
 
 from .PiccoloSysinfo import *
 from .PiccoloDataDir import *
-from .PiccoloConfig import *
-from .PiccoloShutter import *
-from .PiccoloSpectrometer import *
-from .Piccolo import *
+from .PiccoloSnapshot import *
+
+# the hardware components pull in heavy modules (numpy, scipy, seabreeze,
+# sqlalchemy, gpiozero) and are only imported when they are first used
+_lazy = {'PiccoloShutters':'PiccoloShutter',
+         'PiccoloSpectrometers':'PiccoloSpectrometer',
+         'PiccoloControl':'Piccolo'}
+
+def __getattr__(name):
+    if name in _lazy:
+        module = importlib.import_module('.'+_lazy[name],__name__)
+        obj = getattr(module,name)
+        globals()[name] = obj
+        return obj
+    raise AttributeError('module {} has no attribute {}'.format(__name__,name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy.keys()))
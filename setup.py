@@ -37,6 +37,10 @@ setup(
         'janus == 0.4.0',
         'seabreeze >= 1.0.0',
     ],
+    extras_require = {
+        'cbor': ['cbor2'],
+        'udev': ['pyudev'],
+    },
     entry_points={
         'console_scripts': [
             'piccolo3-server = piccolo3.pserver:main',
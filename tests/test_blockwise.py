@@ -0,0 +1,75 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from piccolo3.server.PiccoloComponent import encode_payload, decode_payload, \
+    CONTENT_FORMAT_JSON, CONTENT_FORMAT_CBOR
+from piccolo3.server.PiccoloBlockwise import streamed_list, streamed_text, PiccoloBlockCursor
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+needs_cbor = pytest.mark.skipif(cbor2 is None,reason='cbor2 is not installed')
+
+ITEMS = [[i,'job {}'.format(i),{'interval':i*1.5}] for i in range(50)]
+TEXT = ['line {}\n'.format(i)*3 for i in range(50)]+['','"quoted" µmol']
+
+def encode(result,fmt):
+    return b''.join(result.chunks(fmt,encode_payload))
+
+def test_streamed_list_json():
+    assert encode(streamed_list(iter(ITEMS)),CONTENT_FORMAT_JSON) == encode_payload(ITEMS)
+    assert encode(streamed_list([]),CONTENT_FORMAT_JSON) == encode_payload([])
+
+def test_streamed_text_json():
+    assert encode(streamed_text(iter(TEXT)),CONTENT_FORMAT_JSON) == encode_payload(''.join(TEXT))
+
+@needs_cbor
+def test_streamed_cbor():
+    # indefinite length encoding decodes to the same value
+    payload = encode(streamed_list(iter(ITEMS)),CONTENT_FORMAT_CBOR)
+    assert decode_payload(payload,CONTENT_FORMAT_CBOR) == ITEMS
+    payload = encode(streamed_text(iter(TEXT)),CONTENT_FORMAT_CBOR)
+    assert decode_payload(payload,CONTENT_FORMAT_CBOR) == ''.join(TEXT)
+
+@pytest.mark.parametrize('size',[16,64,1024])
+def test_block_cursor(size):
+    full = encode_payload(ITEMS)
+    cursor = PiccoloBlockCursor(streamed_list(iter(ITEMS)).chunks(CONTENT_FORMAT_JSON,encode_payload))
+    blocks = []
+    start = 0
+    while True:
+        block,more = cursor.read(start,size)
+        blocks.append(block)
+        start += len(block)
+        if not more:
+            break
+    assert all(len(b) == size for b in blocks[:-1])
+    assert b''.join(blocks) == full
+    # a block can be requested again
+    assert cursor.read(start-len(blocks[-1]),size) == (blocks[-1],False)
+
+def test_block_cursor_out_of_order():
+    cursor = PiccoloBlockCursor([b'a'*32,b'b'*32])
+    cursor.read(16,16)
+    with pytest.raises(ValueError):
+        cursor.read(0,16)
+    with pytest.raises(ValueError):
+        cursor.read(128,16)
@@ -0,0 +1,88 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from piccolo3.server.PiccoloWorkerThreads import PiccoloCommand, PiccoloCommandQueue
+
+def state(future):
+    """the reply or exception of a command, None if it is still waiting"""
+    if not future.done():
+        return None
+    if future.exception() is not None:
+        return str(future.exception())
+    return future.result()
+
+def test_enqueue_maxsize():
+    q = PiccoloCommandQueue(maxsize=2)
+    futures = [q.submit(PiccoloCommand('record',i)) for i in range(3)]
+    assert [state(f) for f in futures] == [None,None,'too many commands waiting']
+    assert q.qsize() == 2
+
+def test_reject_waiting():
+    q = PiccoloCommandQueue()
+    first = q.submit(PiccoloCommand('record'))
+    # a command is waiting
+    assert state(q.submit(PiccoloCommand('status'),policy='reject')) == 'worker is busy'
+    q.get()
+    assert q.active
+    # the worker is processing a command
+    assert state(q.submit(PiccoloCommand('status'),policy='reject')) == 'worker is busy'
+    q.done()
+    assert not q.active
+    assert state(q.submit(PiccoloCommand('status'),policy='reject')) is None
+    assert state(first) is None
+
+def test_coalesce():
+    q = PiccoloCommandQueue()
+    a = q.submit(PiccoloCommand('info',1),policy='coalesce')
+    b = q.submit(PiccoloCommand('info',1),policy='coalesce')
+    c = q.submit(PiccoloCommand('info',2),policy='coalesce')
+    assert a is b
+    assert a is not c
+    assert q.qsize() == 2
+    command = q.get()
+    command.future.set_result('ok')
+    assert state(b) == 'ok'
+    # the command is no longer waiting
+    d = q.submit(PiccoloCommand('info',1),policy='coalesce')
+    assert d is not a
+
+def test_unknown_policy():
+    q = PiccoloCommandQueue()
+    with pytest.raises(ValueError):
+        q.submit(PiccoloCommand('record'),policy='drop')
+
+def test_cached():
+    q = PiccoloCommandQueue()
+    q.set_cached('status',lambda *args: ('cached',)+args)
+    future = q.submit(PiccoloCommand('status',1),policy='reject')
+    assert state(future) == ('cached',1)
+    assert q.empty()
+
+def test_background():
+    q = PiccoloCommandQueue()
+    q.put('check')
+    # health checks are not waiting commands
+    assert state(q.submit(PiccoloCommand('status'),policy='reject')) is None
+    progress = q.progress
+    assert q.get() == 'check'
+    assert not q.active
+    assert q.progress == progress+1
+    q.get()
+    assert q.active
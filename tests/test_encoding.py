@@ -0,0 +1,66 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import numpy
+import pytest
+
+from piccolo3.server.PiccoloComponent import encode_payload, decode_payload, CONTENT_FORMAT_CBOR
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+needs_cbor = pytest.mark.skipif(cbor2 is None,reason='cbor2 is not installed')
+
+DATA = {'name':'S_QEP01651',
+        'DarkPixels':[numpy.int64(1),numpy.int64(2)],
+        'SaturationLevel':numpy.float32(200000.),
+        'pixels':numpy.arange(5,dtype=numpy.float32)}
+
+def test_json():
+    assert json.loads(encode_payload(DATA).decode()) == {
+        'name':'S_QEP01651',
+        'DarkPixels':[1,2],
+        'SaturationLevel':200000.,
+        'pixels':[0.,1.,2.,3.,4.]}
+
+def test_json_unsupported():
+    with pytest.raises(TypeError):
+        encode_payload({'x':object()})
+
+def typed_array(tag):
+    """decode a little endian RFC 8746 typed array"""
+    dtypes = {69:'<u2',85:'<f4',86:'<f8'}
+    if tag.tag == 40:
+        shape,data = tag.value
+        return typed_array(data).reshape(shape)
+    return numpy.frombuffer(tag.value,dtype=dtypes[tag.tag])
+
+@needs_cbor
+def test_cbor_typed_arrays():
+    pixels = numpy.linspace(0.,1.,7)
+    result = decode_payload(encode_payload(pixels,CONTENT_FORMAT_CBOR),CONTENT_FORMAT_CBOR)
+    assert numpy.array_equal(typed_array(result),pixels)
+    result = decode_payload(encode_payload(DATA,CONTENT_FORMAT_CBOR),CONTENT_FORMAT_CBOR)
+    assert result['DarkPixels'] == [1,2]
+    assert result['SaturationLevel'] == 200000.
+    assert typed_array(result['pixels']).tolist() == [0.,1.,2.,3.,4.]
+    frames = numpy.arange(6,dtype='>u2').reshape((2,3))
+    result = decode_payload(encode_payload(frames,CONTENT_FORMAT_CBOR),CONTENT_FORMAT_CBOR)
+    assert numpy.array_equal(typed_array(result),frames)
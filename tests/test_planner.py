@@ -0,0 +1,91 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from piccolo3.server.PiccoloPlanner import PiccoloSequencePlan, acquisition_time, \
+    STEP_OVERHEAD
+
+SHUTTERS = ['upwelling','downwelling']
+
+def darks(steps):
+    """the darks recorded by each spectrometer"""
+    result = {}
+    for step in steps:
+        for spec,channel,dark in step.acquisitions():
+            if dark:
+                result.setdefault(spec,[]).append(channel)
+    return result
+
+def test_dark_reused():
+    plan = PiccoloSequencePlan(SHUTTERS,{'S1':SHUTTERS},
+                               {'S1':{'upwelling':100,'downwelling':100}})
+    # a single dark serves both channels
+    assert darks(plan.steps()) == {'S1':['upwelling']}
+    assert plan.reused('S1','upwelling') == ['downwelling']
+    assert plan.reused('S1','downwelling') == []
+
+def test_dark_per_integration_time():
+    plan = PiccoloSequencePlan(SHUTTERS,{'S1':SHUTTERS},
+                               {'S1':{'upwelling':100,'downwelling':300}})
+    steps = plan.steps()
+    # the longest dark is recorded first, with all shutters closed
+    assert darks(steps) == {'S1':['downwelling','upwelling']}
+    assert [s.shutter for s in steps] == SHUTTERS+[None,None]
+    assert plan.reused('S1','upwelling') == []
+
+def test_dark_while_other_shutter_open():
+    topology = {'S1':['upwelling'],'S2':['downwelling']}
+    times = {'S1':{'upwelling':100},'S2':{'downwelling':200}}
+    plan = PiccoloSequencePlan(SHUTTERS,topology,times)
+    steps = plan.steps()
+    # each spectrometer records its dark while the other one records a light
+    assert len(steps) == 2
+    assert steps[0].lights == {'S1':'upwelling'}
+    assert steps[0].darks == {'S2':'downwelling'}
+    assert steps[1].lights == {'S2':'downwelling'}
+    assert steps[1].darks == {'S1':'upwelling'}
+    # both steps take as long as the longer integration time
+    assert plan.duration() == pytest.approx(2*(acquisition_time(200)+STEP_OVERHEAD))
+
+def test_darks_only():
+    plan = PiccoloSequencePlan(SHUTTERS,{'S1':SHUTTERS},
+                               {'S1':{'upwelling':100,'downwelling':100}})
+    steps = plan.steps(lights=False)
+    assert len(steps) == 1
+    assert steps[0].shutter is None
+    assert plan.steps(darks=False)[0].darks == {}
+
+def test_needs_dark():
+    needs = [PiccoloSequencePlan.needs_dark(s,5,2) for s in range(5)]
+    assert needs == [True,False,True,False,True]
+    needs = [PiccoloSequencePlan.needs_dark(s,3,0) for s in range(3)]
+    assert needs == [True,False,True]
+
+def test_estimate_batch():
+    plan = PiccoloSequencePlan(SHUTTERS,{'S1':SHUTTERS},
+                               {'S1':{'upwelling':100,'downwelling':100}})
+    estimate = plan.estimate_batch(3,-1,1.)
+    # darks with the first and the last sequence
+    assert estimate['light_spectra'] == 6
+    assert estimate['dark_spectra'] == 4
+    assert estimate['duration'] == pytest.approx(plan.duration()*2+plan.duration(darks=False)+3.)
+    # autointegrate before the first and the third sequence
+    estimate = plan.estimate_batch(3,2,0.)
+    assert estimate['duration'] == pytest.approx(2*plan.autointegration_duration()
+                                                 +2*plan.duration()+plan.duration(darks=False))
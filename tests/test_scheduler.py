@@ -0,0 +1,97 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import datetime
+import pytz
+import pytest
+
+from piccolo3.server.PiccoloScheduler import PiccoloScheduler
+
+def in_future(minutes):
+    return datetime.datetime.now(tz=pytz.utc)+datetime.timedelta(minutes=minutes)
+
+@pytest.fixture
+def scheduler():
+    s = PiccoloScheduler(db='sqlite://')
+    yield s
+    s.stop()
+
+def test_jobs_version(scheduler):
+    v0 = scheduler.get_jobs_version()
+    job = scheduler.add(in_future(10),('record',))
+    assert scheduler.get_jobs_version() == v0+1
+    assert job.version == v0+1
+    scheduler.add_jobs([{'start_time':in_future(20+i),'job':('record',)}
+                        for i in range(3)])
+    # a batch of jobs is a single change
+    assert scheduler.get_jobs_version() == v0+2
+    scheduler.suspend(job.id)
+    assert scheduler.get_jobs_version() == v0+3
+    # nothing changes if the job is already suspended
+    scheduler.suspend(job.id)
+    assert scheduler.get_jobs_version() == v0+3
+
+def test_jobs_since(scheduler):
+    v0 = scheduler.get_jobs_version()
+    jobs = scheduler.add_jobs([{'start_time':in_future(10+i),'job':('record',)}
+                               for i in range(3)])
+    v1 = scheduler.get_jobs_version()
+    scheduler.delete(jobs[1].id)
+
+    since = scheduler.get_jobs_since(v1)
+    assert since['version'] == v1+1
+    assert not since['full']
+    assert [j[0] for j in since['jobs']] == [jobs[1].id]
+
+    since = scheduler.get_jobs_since(v0)
+    assert not since['full']
+    assert sorted(j[0] for j in since['jobs']) == sorted(j.id for j in jobs)
+
+    assert scheduler.get_jobs_since(v1+1) == {'version':v1+1,'full':False,'jobs':[]}
+
+def test_jobs_since_unknown_version(scheduler):
+    jobs = scheduler.add_jobs([{'start_time':in_future(10+i),'job':('record',)}
+                               for i in range(3)])
+    scheduler.delete(jobs[0].id)
+    version = scheduler.get_jobs_version()
+    # a version from the future returns the scheduled jobs
+    since = scheduler.get_jobs_since(version+5)
+    assert since['full']
+    assert [j[0] for j in since['jobs']] == [jobs[1].id,jobs[2].id]
+
+def test_jobs_since_truncated_log(scheduler):
+    from collections import deque
+    v0 = scheduler.get_jobs_version()
+    scheduler._jobsLog = deque(maxlen=2)
+    for i in range(4):
+        scheduler.add(in_future(10+i),('record',))
+    # the oldest changes were dropped from the log
+    assert scheduler.get_jobs_since(v0)['full']
+    since = scheduler.get_jobs_since(v0+2)
+    assert not since['full']
+    assert len(since['jobs']) == 2
+
+def test_job_fields(scheduler):
+    job = scheduler.add(in_future(10),('record',),interval=60.,
+                        end_time=in_future(100))
+    # the jobs resource keeps its six fields
+    rows = list(scheduler.get_jobs()._iterable)
+    assert rows == [[job.id,('record',),job.start_time.isoformat(),
+                     job.end_time.isoformat(),60.,'active']]
+    since = scheduler.get_jobs_since(0)
+    assert since['jobs'] == [rows[0]+[None]]
@@ -0,0 +1,69 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from piccolo3.server.PiccoloScheduler import PiccoloSchedulerDB
+
+@pytest.fixture
+def db():
+    db = PiccoloSchedulerDB('sqlite://',coalesce=0.2)
+    commits = []
+    commit = db._commit_locked
+    def record(pending):
+        commits.append(dict(pending))
+        commit(pending)
+    db._commit_locked = record
+    db.commits = commits
+    db.start()
+    yield db
+    db.stop()
+
+def test_db_coalesces_changes(db):
+    for i in range(10):
+        db.put_setting('power_delay',str(i))
+    db.put_setting('solar_quiet_time','True')
+    assert db.flush(timeout=5)
+    # all changes were written in a single transaction
+    assert len(db.commits) == 1
+    assert db.commits[0][('settings','power_delay')]['value'] == '9'
+    settings,quietTimes,jobs = db.load()
+    assert settings == {'power_delay':'9','solar_quiet_time':'True'}
+
+def test_db_batch(db):
+    db.put_setting('power_delay','1')
+    db.put_setting('power_delay','2')
+    assert db.flush(timeout=5)
+    db.put_setting('power_delay','3')
+    assert db.flush(timeout=5)
+    assert len(db.commits) == 2
+    assert db.load()[0]['power_delay'] == '3'
+
+def test_db_flush_stopped():
+    db = PiccoloSchedulerDB('sqlite://')
+    assert not db.flush(timeout=1)
+
+def test_db_stop_writes_changes():
+    db = PiccoloSchedulerDB('sqlite://',coalesce=60.)
+    db.start()
+    db.put_setting('power_delay','5')
+    # the change is written without waiting for the coalesce period
+    assert db.stop(timeout=5)
+    assert not db.is_alive()
+    assert db.load()[0] == {'power_delay':'5'}
+    assert db.stop()
@@ -0,0 +1,135 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import aiocoap.resource as resource
+import pytest
+
+from piccolo3.server.PiccoloComponent import PiccoloBaseComponent, piccoloGET, piccoloChanged
+from piccolo3.server.PiccoloSnapshot import PiccoloSnapshot
+
+class Counter(PiccoloBaseComponent):
+    NAME = 'counter'
+
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+        self.calls = 0
+        self.changed = None
+
+    def set(self,value):
+        self.value = value
+        self.changed()
+
+    @piccoloGET(observable=True)
+    def get_value(self):
+        self.calls += 1
+        return self.value
+    @piccoloChanged
+    def callback_value(self,cb):
+        self.changed = cb
+
+    @piccoloGET(snapshot=False)
+    def get_live(self):
+        return self.value
+    @piccoloChanged
+    def callback_live(self,cb):
+        self.live_changed = cb
+
+def run(test):
+    async def main():
+        root = resource.Site()
+        counter = Counter()
+        root.add_resource(*counter.coapSite)
+        snapshot = PiccoloSnapshot(root,interval=60.)
+        root.add_resource(*snapshot.coapSite)
+        await test(counter,snapshot)
+    asyncio.run(main())
+
+def test_state():
+    async def test(counter,snapshot):
+        state = await snapshot.get_state()
+        assert state['version'] == 1
+        assert state['state'] == {'counter/value':0}
+        # the snapshot is only collected again once a resource changed
+        await snapshot.get_state()
+        assert counter.calls == 1
+        counter.set(1)
+        state = await snapshot.get_state()
+        assert state['version'] == 2
+        assert state['state'] == {'counter/value':1}
+        assert counter.calls == 2
+    run(test)
+
+def test_delta_and_since():
+    async def test(counter,snapshot):
+        v1 = await snapshot.get_version()
+        counter.set(1)
+        delta = await snapshot.get_delta()
+        assert delta == {'version':v1+1,'base':v1,'time':delta['time'],
+                         'state':{'counter/value':1}}
+        counter.set(2)
+        since = await snapshot.get_since(v1)
+        assert since == {'version':v1+2,'full':False,'state':{'counter/value':2}}
+        since = await snapshot.get_since(v1+2)
+        assert since['state'] == {}
+        # unknown versions get the full state
+        since = await snapshot.get_since(v1+10)
+        assert since == {'version':v1+2,'full':True,'state':{'counter/value':2}}
+    run(test)
+
+def test_unchanged():
+    async def test(counter,snapshot):
+        v1 = await snapshot.get_version()
+        # a change notification without a new value keeps the version
+        counter.set(0)
+        assert await snapshot.get_version() == v1
+        assert counter.calls == 2
+    run(test)
+
+def test_not_in_snapshot():
+    async def test(counter,snapshot):
+        v1 = await snapshot.get_version()
+        counter.live_changed()
+        # resources excluded from the snapshot do not invalidate it
+        assert await snapshot.get_version() == v1
+        assert counter.calls == 1
+        # not even while the snapshot is observed
+        snapshot.observation_count_changed('state',1)
+        await asyncio.sleep(0)
+        calls = counter.calls
+        for i in range(10):
+            counter.live_changed()
+            await asyncio.sleep(0.01)
+        assert counter.calls == calls
+        assert not snapshot._stale
+        snapshot.observation_count_changed('state',0)
+    run(test)
+
+def test_since_version_types():
+    async def test(counter,snapshot):
+        v1 = await snapshot.get_version()
+        counter.set(1)
+        for version in [v1,str(v1),float(v1)]:
+            since = await snapshot.get_since(version)
+            assert not since['full']
+            assert since['state'] == {'counter/value':1}
+        for version in ['one',1.5,None,True]:
+            with pytest.raises(ValueError):
+                await snapshot.get_since(version)
+    run(test)
@@ -0,0 +1,104 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import datetime
+import pytz
+import pytest
+
+from piccolo3.server.PiccoloSolar import solar_elevation, sun_windows, SUNRISE_ELEVATION
+
+# Edinburgh
+LAT,LON = 55.95,-3.19
+
+def utc(*args):
+    return datetime.datetime(*args,tzinfo=pytz.utc)
+
+def test_solar_noon():
+    # around the equinox the sun culminates at 90-latitude degrees
+    elevation = solar_elevation(utc(2020,3,20,12,13),LAT,LON)[0]
+    assert elevation == pytest.approx(90-LAT,abs=0.5)
+    assert solar_elevation(utc(2020,3,20,0,13),LAT,LON)[0] < -30
+
+def test_naive_time():
+    with pytest.raises(ValueError):
+        solar_elevation(datetime.datetime(2020,3,20,12),LAT,LON)
+
+def test_sun_windows_equinox():
+    windows = sun_windows(utc(2020,3,20),utc(2020,3,23),LAT,LON)
+    assert len(windows) == 3
+    for start,end in windows:
+        # roughly 12 hours of daylight centred on noon
+        assert (end-start).total_seconds()/3600. == pytest.approx(12.2,abs=0.3)
+        assert start.hour == 6
+        assert end.hour == 18
+        # the crossings are interpolated
+        for t in [start,end]:
+            assert solar_elevation(t,LAT,LON)[0] == pytest.approx(SUNRISE_ELEVATION,abs=0.05)
+
+def test_sun_windows_min_elevation():
+    day = sun_windows(utc(2020,6,21),utc(2020,6,22),LAT,LON)
+    high = sun_windows(utc(2020,6,21),utc(2020,6,22),LAT,LON,min_elevation=30.)
+    assert len(day) == len(high) == 1
+    assert day[0][0] < high[0][0] < high[0][1] < day[0][1]
+
+def test_sun_windows_clipped():
+    # the search period starts during the day
+    windows = sun_windows(utc(2020,3,20,12),utc(2020,3,21,12),LAT,LON)
+    assert len(windows) == 2
+    assert windows[0][0] == utc(2020,3,20,12)
+    assert windows[1][1] == utc(2020,3,21,12)
+
+def test_polar_day_and_night():
+    assert sun_windows(utc(2020,12,21),utc(2020,12,23),80.,0.) == []
+    windows = sun_windows(utc(2020,6,20),utc(2020,6,22),80.,0.)
+    assert windows == [(utc(2020,6,20),utc(2020,6,22))]
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    from piccolo3.server.PiccoloScheduler import PiccoloScheduler
+    def make(now,latitude,longitude):
+        monkeypatch.setattr(PiccoloScheduler,'now',staticmethod(lambda: now))
+        s = PiccoloScheduler(db='sqlite://',location=(latitude,longitude))
+        schedulers.append(s)
+        return s
+    schedulers = []
+    yield make
+    for s in schedulers:
+        s.stop()
+
+def test_solar_quiet_time(scheduler):
+    s = scheduler(utc(2020,3,20,12),LAT,LON)
+    s.set_solarQuietTime('True')
+    # quiet from sunset until sunrise
+    assert s.quietStart.date() == datetime.date(2020,3,20)
+    assert s.quietStart.hour == 18
+    assert s.quietEnd.date() == datetime.date(2020,3,21)
+    assert s.quietEnd.hour == 6
+
+def test_solar_quiet_time_polar_night(scheduler,caplog):
+    s = scheduler(utc(2020,12,21,12),80.,0.)
+    start,end = s.quietStart,s.quietEnd
+    s.set_solarQuietTime('True')
+    assert 'sun does not rise above 0.0 degrees' in caplog.text
+    # the fixed quiet time is used
+    assert (s.quietStart,s.quietEnd) == (start,end)
+
+def test_solar_quiet_time_midnight_sun(scheduler,caplog):
+    s = scheduler(utc(2020,6,21,12),80.,0.)
+    s.set_solarQuietTime('True')
+    assert 'sun does not set below 0.0 degrees' in caplog.text
@@ -0,0 +1,79 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-server.
+#
+# piccolo3-server is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-server.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy
+import pytest
+
+from piccolo3.server.PiccoloStream import PiccoloRingBuffer, PiccoloStreamWriter, read_stream
+
+def test_ring_buffer():
+    buf = PiccoloRingBuffer(4,3)
+    assert len(buf) == 0
+    for i in range(6):
+        buf.append(float(i),[i,i,i])
+    assert len(buf) == 4
+    assert buf.count == 6
+    times,frames = buf.latest(3)
+    # oldest first across the end of the ring
+    assert list(times) == [3.,4.,5.]
+    assert frames[:,0].tolist() == [3.,4.,5.]
+    times,frames = buf.latest(10)
+    assert list(times) == [2.,3.,4.,5.]
+    t,mean = buf.mean(2)
+    assert t == 5.
+    assert mean.tolist() == [4.5,4.5,4.5]
+
+def test_ring_buffer_copies():
+    buf = PiccoloRingBuffer(2,2)
+    buf.append(0.,[1,1])
+    times,frames = buf.latest()
+    buf.append(1.,[2,2])
+    buf.append(2.,[3,3])
+    assert frames.tolist() == [[1.,1.]]
+
+def test_stream_round_trip(tmp_path):
+    fname = str(tmp_path/'stream.pstr')
+    header = {'SerialNumber':'QEP01651','Direction':'upwelling',
+              'IntegrationTime':10.,'npixels':8}
+    frames = numpy.random.default_rng(1).random((5,8)).astype(numpy.float32)
+    times = 1.6e9+numpy.arange(5)*0.01
+    with PiccoloStreamWriter(fname,header) as writer:
+        for t,pixels in zip(times,frames):
+            writer.write(t,pixels)
+    h,t,p = read_stream(fname)
+    assert h == header
+    assert numpy.array_equal(t,times)
+    assert numpy.array_equal(p,frames)
+
+def test_stream_incomplete_frame(tmp_path):
+    fname = str(tmp_path/'stream.pstr')
+    with PiccoloStreamWriter(fname,{'npixels':4}) as writer:
+        writer.write(1.,[1,2,3,4])
+        writer.write(2.,[5,6,7,8])
+    # the writer stopped in the middle of a frame
+    with open(fname,'ab') as f:
+        f.write(b'\x00'*10)
+    h,t,p = read_stream(fname)
+    assert list(t) == [1.,2.]
+    assert p.tolist() == [[1.,2.,3.,4.],[5.,6.,7.,8.]]
+
+def test_not_a_stream(tmp_path):
+    fname = tmp_path/'other'
+    fname.write_bytes(b'PICOSHUT')
+    with pytest.raises(RuntimeError):
+        read_stream(str(fname))